@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -51,6 +52,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'LittleLemonAPI.middleware.RequestMetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'LittleLemon.urls'
@@ -77,13 +79,64 @@ WSGI_APPLICATION = 'LittleLemon.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# SQLite connection profiles, picked with the SQLITE_PROFILE environment
+# variable. 'tuned' switches to WAL so readers never wait for the writer,
+# uses synchronous=NORMAL (safe across application crashes; a power loss can
+# lose the last commits), memory-maps up to 256 MB of the file and makes
+# writers wait up to `timeout` seconds for the lock instead of failing with
+# "database is locked". transaction_mode IMMEDIATE takes the write lock when
+# atomic() starts: a deferred transaction that reads before it writes (like
+# checkout) cannot wait for the lock when it upgrades and fails straight
+# away. Connections are kept for CONN_MAX_AGE seconds so the pragmas run once
+# per connection rather than per request. 'default' is stock SQLite.
+SQLITE_PROFILES = {
+    'default': {
+        'OPTIONS': {},
+        'CONN_MAX_AGE': 0,
+    },
+    'tuned': {
+        'OPTIONS': {
+            'init_command': (
+                'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; '
+                'PRAGMA mmap_size=268435456; PRAGMA temp_store=MEMORY'
+            ),
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    },
+}
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'tuned')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        **SQLITE_PROFILES[SQLITE_PROFILE],
     }
 }
 
+# Read replicas. The menu, category and order list views read from one of
+# READ_REPLICAS (writes and every other read use 'default'), except for a user
+# who wrote through those views or the cart in the last
+# REPLICA_STICKY_SECONDS. That is tracked per user in the cache when it is
+# shared between processes, and with a signed cookie otherwise, so with the
+# default per-process cache only clients that keep cookies get
+# read-your-writes. Locally, SQLITE_REPLICA names a second SQLite file
+# standing in for a replica; `manage.py sync_sqlite_replica` copies the
+# primary into it.
+SQLITE_REPLICA = os.environ.get('SQLITE_REPLICA')
+if SQLITE_REPLICA:
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': SQLITE_REPLICA,
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['LittleLemonAPI.routers.ReplicaRouter']
+READ_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+REPLICA_STICKY_SECONDS = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -128,23 +181,22 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'LittleLemonAPI.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
-        'rest_framework.renderers.BrowsableAPIRenderer',
-        'rest_framework_xml.renderers.XMLRenderer',
-        'rest_framework_csv.renderers.CSVRenderer', 
-        'rest_framework_yaml.renderers.YAMLRenderer',
+        'LittleLemonAPI.renderers.FastJSONRenderer',
+        'LittleLemonAPI.renderers.LazyXMLRenderer',
+        'LittleLemonAPI.renderers.LazyCSVRenderer',
+        'LittleLemonAPI.renderers.LazyYAMLRenderer',
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'rest_framework.filters.OrderingFilter',
         'rest_framework.filters.SearchFilter',
     ],
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.UserRateThrottle',
-        'rest_framework.throttling.AnonRateThrottle',
+        'LittleLemonAPI.throttles.SharedUserRateThrottle',
+        'LittleLemonAPI.throttles.SharedAnonRateThrottle',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 4,
@@ -157,7 +209,93 @@ REST_FRAMEWORK = {
     },
 }
 
+# The browsable API is a development tool; production workers don't load it.
+if DEBUG:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].insert(1, 'rest_framework.renderers.BrowsableAPIRenderer')
+
 DJOSER = {
     'ID_FIELD': 'username',
     # 'LOGIN_FIELD': 'email',
-}
\ No newline at end of file
+}
+
+# Seconds a user's resolved groups are cached across requests (0 disables).
+# Membership changes invalidate the entry immediately. Only used when the
+# default cache is shared between processes (redis, memcached, database or
+# file cache): the default per-process LocMemCache can't be invalidated on
+# the other workers, so roles are then loaded once per request instead.
+ROLE_CACHE_TIMEOUT = 300
+
+# Cache alias and timeout for serialized menu / category pages, invalidated
+# by a menu version counter. Only used when the alias is shared between
+# processes (redis, memcached, database or file cache); with the default
+# per-process LocMemCache every menu list is rendered from the database.
+MENU_CACHE_ALIAS = 'default'
+MENU_CACHE_TIMEOUT = 600
+
+# Menu search backend. The SQLite FTS5 backend falls back to LIKE filtering
+# when FTS5 is unavailable; MENU_SEARCH_LIMIT caps the ranked result set.
+MENU_SEARCH_BACKEND = 'LittleLemonAPI.search.SQLiteFTSBackend'
+MENU_SEARCH_LIMIT = 1000
+
+# Largest batch accepted by the bulk menu import endpoint and command.
+MENU_IMPORT_MAX_ROWS = 5000
+
+# Where throttle counters live. The database store is shared by every worker
+# process but writes on every throttled request, and needs
+# `manage.py sweep_throttle_windows` run periodically (e.g. from cron) to drop
+# the windows of keys that never come back. CacheThrottleStore avoids both
+# but is only correct with a shared cache (redis, memcached) whose incr() is
+# atomic.
+THROTTLE_STORE = 'LittleLemonAPI.throttles.DatabaseThrottleStore'
+
+# Seconds a token's user id and roles stay cached (0 disables). Logout, token
+# regeneration, user updates and group changes invalidate the entry, and the
+# user's is_active is re-checked on every request. Like ROLE_CACHE_TIMEOUT,
+# only used when the default cache is shared between processes.
+TOKEN_CACHE_TIMEOUT = 60
+
+# Idempotency-Key handling for order, cart and menu item POSTs: how long a
+# stored response is replayed (seconds), how long a repeat waits for the
+# original request before getting a 409, and after how long an unfinished
+# claim is considered abandoned. `manage.py sweep_idempotency_keys` deletes
+# expired keys.
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+IDEMPOTENCY_WAIT = 5
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+
+# Order events pushed over /api/async/orders/events (Server-Sent Events).
+# Serve it under ASGI: under WSGI every open stream holds a worker thread. The
+# local broker only reaches subscribers in the same process. Streams send a
+# comment every EVENTS_HEARTBEAT seconds and close after
+# EVENTS_STREAM_TIMEOUT seconds, after which clients reconnect.
+EVENTS_BROKER = 'LittleLemonAPI.events.LocalBroker'
+EVENTS_HEARTBEAT = 15
+EVENTS_STREAM_TIMEOUT = 300
+EVENTS_RETRY_MS = 3000
+
+# Rows fetched per database round trip by the streaming order export.
+ORDER_EXPORT_CHUNK_SIZE = 2000
+
+# Delivered orders older than this many days are moved to the archive tables
+# by `manage.py archive_orders`. Order lists include them when the request
+# has a from/to date range; single orders are always found.
+ORDER_ARCHIVE_AFTER_DAYS = 90
+
+# Automatic delivery crew assignment (LittleLemonAPI/dispatch.py). With
+# DISPATCH_INTERVAL > 0, `manage.py dispatch_orders` keeps running and assigns
+# unassigned pending orders every that many seconds; start it in one process
+# only, next to the web workers rather than inside them. 0 runs it once, and
+# /api/orders/dispatch runs it on demand. Runs take turns on a lock row, so an
+# extra one is harmless. DISPATCH_MAX_OPEN_ORDERS caps the open orders a crew
+# member is given (None: no cap).
+DISPATCH_INTERVAL = int(os.environ.get('DISPATCH_INTERVAL', 0))
+DISPATCH_MAX_OPEN_ORDERS = None
+
+# Per-request query count / SQL / view / render timings, sent as a
+# Server-Timing header and aggregated per route at /api/stats/requests.
+# Disabled, the middleware drops out of the chain entirely.
+REQUEST_METRICS = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 1.0,
+    'WINDOW': 500,
+}
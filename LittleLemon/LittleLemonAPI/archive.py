@@ -0,0 +1,149 @@
+import functools
+import heapq
+from itertools import islice
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Value
+from django.utils import timezone
+from .fast_serializers import archived_order_rows, order_snapshot_rows
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+from .snapshots import write_snapshots
+
+# Hot/cold order storage. Delivered orders older than ORDER_ARCHIVE_AFTER_DAYS
+# are moved, a batch per transaction, into ArchivedOrder/ArchivedOrderItem
+# with INSERT ... SELECT and then deleted from the hot tables. The copy and
+# delete bypass model signals: an archived order is neither a sale to take
+# out of the rollups nor a deletion to push to clients. Order lists that ask
+# for a date range read both tables and merge them (OrderHistory).
+
+def archive_after_days():
+    return getattr(settings, 'ORDER_ARCHIVE_AFTER_DAYS', 90)
+
+#region Archiving
+
+def _copy(source, target, column, ids, extra=None):
+    quote = connection.ops.quote_name
+    columns = [field.column for field in source._meta.concrete_fields]
+    extra = extra or {}
+    targets = ', '.join(quote(name) for name in columns + list(extra))
+    selects = ', '.join([quote(name) for name in columns] + ['%s'] * len(extra))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(target._meta.db_table)} ({targets}) SELECT {selects} '
+            f'FROM {quote(source._meta.db_table)} WHERE {quote(column)} IN ({", ".join(["%s"] * len(ids))})',
+            [*extra.values(), *ids],
+        )
+
+
+def _delete(model, column, ids):
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {quote(model._meta.db_table)} WHERE {quote(column)} IN ({", ".join(["%s"] * len(ids))})',
+            ids,
+        )
+
+
+def archive_orders(older_than_days=None, batch_size=500):
+    # Returns how many orders were moved. Each batch is re-checked inside its
+    # transaction, so an order reopened meanwhile stays hot.
+    now = timezone.now()
+    cutoff = now - timezone.timedelta(days=archive_after_days() if older_than_days is None else older_than_days)
+    candidates = Order.objects.filter(status=True, date__lt=cutoff).order_by('pk')
+    archived_at = connection.ops.adapt_datetimefield_value(now)
+    moved = 0
+    last = 0
+    while True:
+        ids = list(candidates.filter(pk__gt=last).values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return moved
+        last = ids[-1]
+        with transaction.atomic():
+            ids = list(candidates.filter(pk__in=ids).values_list('pk', flat=True))
+            if not ids:
+                continue
+            # Archived orders are served from their snapshots.
+            stale = list(
+                Order.objects.filter(pk__in=ids).exclude(snapshot_version=Order.SNAPSHOT_VERSION)
+                .values_list('pk', flat=True)
+            )
+            if stale:
+                write_snapshots(stale)
+            _copy(Order, ArchivedOrder, 'id', ids, {'archived_at': archived_at})
+            _copy(OrderItem, ArchivedOrderItem, 'order_id', ids)
+            _delete(OrderItem, 'order_id', ids)
+            _delete(Order, 'id', ids)
+        moved += len(ids)
+
+#endregion
+
+#region Reading
+
+def wants_archive(params):
+    # Only date-bounded lists look at the archive.
+    return bool(params.get('from') or params.get('to'))
+
+
+class OrderHistory:
+    # Hot and archived order rows as one sequence ordered by `ordering`,
+    # with the parts of the QuerySet API the paginators use: count(),
+    # order_by(), filter() and slicing. A slice reads at most `stop` rows from
+    # each table and merges them, so keyset pages stay two indexed seeks.
+    ordered = True
+
+    def __init__(self, hot, archived, ordering):
+        self.hot = hot
+        self.archived = archived
+        self.ordering = tuple(ordering)
+
+    @classmethod
+    def of(cls, hot, archived, ordering):
+        # The merge needs a total order: ties are broken on id.
+        if 'id' not in [field.lstrip('-') for field in ordering]:
+            ordering = [*ordering, 'id']
+        names = list(dict.fromkeys(['id', 'date', 'snapshot', 'snapshot_version', *(f.lstrip('-') for f in ordering)]))
+        return cls(
+            hot.prefetch_related(None).values(*names, archived=Value(False)).order_by(*ordering),
+            archived.values(*names, archived=Value(True)).order_by(*ordering),
+            ordering,
+        )
+
+    def order_by(self, *ordering):
+        return OrderHistory(self.hot.order_by(*ordering), self.archived.order_by(*ordering), ordering)
+
+    def filter(self, *args, **kwargs):
+        return OrderHistory(self.hot.filter(*args, **kwargs), self.archived.filter(*args, **kwargs), self.ordering)
+
+    def count(self):
+        return self.hot.count() + self.archived.count()
+
+    def _compare(self, a, b):
+        for field in self.ordering:
+            name = field.lstrip('-')
+            x, y = a[name], b[name]
+            if x == y:
+                continue
+            # NULLs sort first, as on SQLite.
+            result = -1 if x is None or (y is not None and x < y) else 1
+            return -result if field.startswith('-') else result
+        return 0
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.stop is None or index.step:
+            raise TypeError('OrderHistory only supports [start:stop] slices')
+        start = index.start or 0
+        key = functools.cmp_to_key(self._compare)
+        rows = heapq.merge(self.hot[:index.stop], self.archived[:index.stop], key=key)
+        return list(islice(rows, start, index.stop))
+
+
+def serialize_history(rows):
+    rows = list(rows)
+    data = {
+        order['id']: order
+        for source, archived in ((order_snapshot_rows, False), (archived_order_rows, True))
+        for order in source.serialize([row for row in rows if row['archived'] == archived])
+    }
+    return [data[row['id']] for row in rows if row['id'] in data]
+
+#endregion
@@ -0,0 +1,231 @@
+import functools
+import math
+from asgiref.sync import sync_to_async
+import time
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Q
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from rest_framework.views import APIView
+from . import events
+from .archive import OrderHistory, serialize_history, wants_archive
+from .authentication import CachedTokenAuthentication
+from .export import export_filters
+from .fast_serializers import archived_order_rows, cart_rows, menu_item_rows, order_rows, order_snapshot_rows
+from .models import ArchivedOrder, Cart, MenuItem, Order
+from .renderers import FastJSONRenderer
+from .roles import ais_delivery_crew, ais_manager
+from .search import search_menu_items
+
+# Native async versions of the hot read endpoints, mounted under /api/async/.
+# They return the same JSON as their DRF counterparts (fast serializers,
+# page-number pagination) but run on the event loop under ASGI: the ORM is
+# used through aget()/acount()/aiterator(), token auth and role checks use
+# the async cache and ORM, and only the throttle store (and the archive merge
+# for date-ranged order lists) still runs in a worker thread. JSON is the
+# only format served here.
+
+_renderer = FastJSONRenderer()
+
+
+def _json(data, status=200, headers=None):
+    return HttpResponse(_renderer.render(data), content_type='application/json', status=status, headers=headers)
+
+
+def _throttle_waits(request):
+    # Same throttle classes as the DRF views (APIView.throttle_classes).
+    # Returns None when the request is allowed, else the known waits.
+    waits = None
+    for throttle in [throttle() for throttle in APIView.throttle_classes]:
+        if not throttle.allow_request(request, None):
+            waits = (waits or []) + [wait for wait in [throttle.wait()] if wait is not None]
+    return waits
+
+
+def api_view(view):
+    # Authentication (token, then session), IsAuthenticated and throttling
+    # for an async GET view, with DRF's status codes and messages.
+    @require_GET
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            result = await CachedTokenAuthentication().aauthenticate(request)
+        except AuthenticationFailed as exc:
+            return _json({'detail': exc.detail}, 401, {'WWW-Authenticate': 'Token'})
+        user = result[0] if result else await request.auser()
+        if not user.is_authenticated:
+            return _json({'detail': 'Authentication credentials were not provided.'}, 401,
+                         {'WWW-Authenticate': 'Token'})
+        request.user = user
+        waits = await sync_to_async(_throttle_waits)(request)
+        if waits is not None:
+            if not waits:
+                return _json({'detail': 'Request was throttled.'}, 429)
+            seconds = math.ceil(max(waits))
+            return _json({'detail': f'Request was throttled. Expected available in {seconds} seconds.'}, 429,
+                         {'Retry-After': str(seconds)})
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def _not_found(model):
+    return _json({'detail': f'No {model.__name__} matches the given query.'}, 404)
+
+
+async def _paginated(request, queryset, rows):
+    return await _paginate(request, queryset.acount,
+                           lambda start, stop: rows.aserialize(rows.values(queryset[start:stop])))
+
+
+async def _paginate(request, count, results):
+    # PageNumberPagination's response shape for `?page=`. `count()` and
+    # `results(start, stop)` are awaited.
+    page_size = api_settings.PAGE_SIZE
+    page = request.GET.get('page', '1')
+    if not page.isdigit() or int(page) < 1:
+        return _json({'detail': 'Invalid page.'}, 404)
+    page = int(page)
+    count = await count()
+    pages = max(1, math.ceil(count / page_size))
+    if page > pages:
+        return _json({'detail': 'Invalid page.'}, 404)
+    start = (page - 1) * page_size
+    results = await results(start, start + page_size)
+    url = request.build_absolute_uri()
+    previous = None
+    if page > 1:
+        previous = remove_query_param(url, 'page') if page == 2 else replace_query_param(url, 'page', page - 1)
+    return _json({
+        'count': count,
+        'next': replace_query_param(url, 'page', page + 1) if page < pages else None,
+        'previous': previous,
+        'results': results,
+    })
+
+
+@api_view
+async def menu_items(request):
+    queryset = MenuItem.objects.select_related('category')
+    search = request.GET.get('search', '').strip()
+    if search:
+        # The FTS lookup uses a raw cursor, so it runs in a worker thread.
+        queryset = await sync_to_async(search_menu_items)(queryset, search)
+    ordering = request.GET.get('ordering')
+    if ordering in ('price', '-price'):
+        queryset = queryset.order_by(ordering, 'id')
+    elif not search:
+        queryset = queryset.order_by('id')
+    return await _paginated(request, queryset, menu_item_rows)
+
+
+@api_view
+async def single_item(request, pk):
+    try:
+        row = await menu_item_rows.values(MenuItem.objects.filter(pk=pk)).aget()
+    except MenuItem.DoesNotExist:
+        return _not_found(MenuItem)
+    return _json(menu_item_rows.mapper.map(row))
+
+
+@api_view
+async def cart(request):
+    return await _paginated(request, Cart.objects.filter(user=request.user).order_by('id'), cart_rows)
+
+
+@api_view
+async def orders(request):
+    # Same from/to/status/delivery_crew filters as /api/orders; a date range
+    # also covers the archive, which is merged in a worker thread.
+    try:
+        conditions = export_filters(request.GET)
+    except ValidationError as exc:
+        return _json(exc.detail, 400)
+    visible = Q()
+    if not await ais_manager(request.user):
+        if await ais_delivery_crew(request.user):
+            visible = Q(delivery_crew=request.user)
+        else:
+            visible = Q(user=request.user)
+    queryset = Order.objects.filter(conditions, visible).order_by('-date', '-id')
+    if not wants_archive(request.GET):
+        return await _paginated(request, queryset, order_snapshot_rows)
+    history = OrderHistory.of(queryset, ArchivedOrder.objects.filter(conditions, visible), ('-date', '-id'))
+    return await _paginate(request, sync_to_async(history.count),
+                           sync_to_async(lambda start, stop: serialize_history(history[start:stop])))
+
+
+@api_view
+async def single_order(request, pk):
+    # Archived orders are read-only and always served from the archive.
+    fields = ('user_id', 'snapshot', 'snapshot_version')
+    model, rows = Order, order_rows
+    row = await Order.objects.values(*fields).filter(pk=pk).afirst()
+    if row is None:
+        model, rows = ArchivedOrder, archived_order_rows
+        row = await ArchivedOrder.objects.values(*fields).filter(pk=pk).afirst()
+        if row is None:
+            return _not_found(Order)
+    if request.user.id != row['user_id'] and not await ais_manager(request.user):
+        return _json({'error': 'You are not allowed to perform this action'}, 401)
+    if order_snapshot_rows.fresh(row):
+        return _json(row['snapshot'])
+    data = await rows.aserialize(rows.values(model.objects.filter(pk=pk)))
+    return _json(data[0])
+
+
+@api_view
+async def order_events(request):
+    # Server-Sent Events for order creates, status / crew changes and
+    # deletes. Reconnecting clients send Last-Event-ID and get the events
+    # they missed while they are still in the broker's history. The stream
+    # ends after EVENTS_STREAM_TIMEOUT seconds; EventSource reconnects.
+    # Under ASGI the stream is awaited on the event loop. Under WSGI (e.g.
+    # runserver) it is a blocking generator, so every connected client ties
+    # up a worker thread: serve it from an ASGI server in production.
+    audiences = {events.user_audience(request.user.pk)}
+    if await ais_manager(request.user):
+        audiences.add(events.MANAGERS)
+    if await ais_delivery_crew(request.user):
+        audiences.add(events.crew_audience(request.user.pk))
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    last_event_id = int(last_event_id) if last_event_id.isdigit() else None
+    broker = events.get_broker()
+    heartbeat = getattr(settings, 'EVENTS_HEARTBEAT', 15)
+    deadline = time.monotonic() + getattr(settings, 'EVENTS_STREAM_TIMEOUT', 300)
+    retry = f'retry: {getattr(settings, "EVENTS_RETRY_MS", 3000)}\n\n'
+
+    async def stream():
+        # Subscribed from the loop that consumes the stream.
+        subscription = broker.subscribe(audiences, last_event_id)
+        try:
+            yield retry
+            for event in subscription.backlog:
+                yield events.format_event(event)
+            while (remaining := deadline - time.monotonic()) > 0:
+                event = await subscription.get(min(heartbeat, remaining))
+                yield events.format_event(event) if event else ': keep-alive\n\n'
+        finally:
+            broker.unsubscribe(subscription)
+
+    def blocking_stream():
+        # WSGI would collect an async iterator into a list before sending it.
+        subscription = broker.subscribe(audiences, last_event_id, blocking=True)
+        try:
+            yield retry
+            for event in subscription.backlog:
+                yield events.format_event(event)
+            while (remaining := deadline - time.monotonic()) > 0:
+                event = subscription.get(min(heartbeat, remaining))
+                yield events.format_event(event) if event else ': keep-alive\n\n'
+        finally:
+            broker.unsubscribe(subscription)
+
+    content = stream() if isinstance(request, ASGIRequest) else blocking_stream()
+    response = StreamingHttpResponse(content, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,90 @@
+import hashlib
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from . import shared_cache
+from .roles import aget_roles, get_roles, prime_roles
+
+# Token -> (user id, roles) for TOKEN_CACHE_TIMEOUT seconds, so the
+# authtoken/auth_user join and the role lookup become one primary key lookup
+# of the user, whose is_active is checked on every request. Entries are
+# dropped when the token is deleted (djoser logout or token regeneration),
+# when the user is saved or when the user's group membership changes; see
+# signals.py. Nothing is cached unless the default cache is shared between
+# processes (shared_cache.py), since those signals only reach one process.
+
+
+def _cache_key(key):
+    return 'littlelemon:token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def invalidate_token(*keys):
+    cache.delete_many([_cache_key(key) for key in keys])
+
+
+def invalidate_user_tokens(*user_ids):
+    invalidate_token(*Token.objects.filter(user_id__in=user_ids).values_list('key', flat=True))
+
+
+def _cache_timeout():
+    return getattr(settings, 'TOKEN_CACHE_TIMEOUT', 0) if shared_cache.is_shared() else 0
+
+
+def _cached_user(key, user, roles):
+    # The token's user for a cache hit, or None (and the entry dropped) when
+    # the user is gone or inactive.
+    if user is None or not user.is_active:
+        invalidate_token(key)
+        return None
+    prime_roles(user, roles)
+    return user
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        timeout = _cache_timeout()
+        cached = cache.get(_cache_key(key)) if timeout else None
+        if cached is not None:
+            user_id, roles = cached
+            user = _cached_user(key, get_user_model().objects.filter(pk=user_id).first(), roles)
+            if user is not None:
+                return (user, Token(key=key, user=user))
+
+        user, token = super().authenticate_credentials(key)
+        if timeout:
+            cache.set(_cache_key(key), (user.pk, get_roles(user)), timeout)
+        return (user, token)
+
+    async def aauthenticate(self, request):
+        # authenticate() for the async views, which get a plain Django
+        # request. Same header parsing, cache entries and error messages.
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise AuthenticationFailed('Invalid token header. Token string should not contain spaces.')
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise AuthenticationFailed('Invalid token header. Token string should not contain invalid characters.')
+
+        timeout = _cache_timeout()
+        cached = await cache.aget(_cache_key(key)) if timeout else None
+        if cached is not None:
+            user_id, roles = cached
+            user = _cached_user(key, await get_user_model().objects.filter(pk=user_id).afirst(), roles)
+            if user is not None:
+                return (user, Token(key=key, user=user))
+        try:
+            token = await Token.objects.select_related('user').aget(key=key)
+        except Token.DoesNotExist:
+            raise AuthenticationFailed('Invalid token.')
+        if not token.user.is_active:
+            raise AuthenticationFailed('User inactive or deleted.')
+        roles = await aget_roles(token.user)
+        if timeout:
+            await cache.aset(_cache_key(key), (token.user_id, roles), timeout)
+        return (token.user, token)
@@ -0,0 +1,527 @@
+import asyncio
+import json
+import platform
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+from unittest import mock
+from urllib.parse import urlsplit
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from rest_framework.views import APIView
+
+from .menu_cache import bump_menu_version
+from . import rollups, snapshots
+from .models import Cart, Category, MenuItem, Order, OrderItem
+from .roles import DELIVERY_CREW, MANAGER, invalidate_roles
+from .search import get_backend as search_backend
+from .urls import urlpatterns
+
+# Load-test helpers behind the `benchmark` management command: seed a dataset
+# with bulk inserts, drive every route in LittleLemonAPI/urls.py through the
+# Django test client and report latency, throughput and query counts per
+# endpoint as JSON that later runs can be compared against.
+
+DEFAULT_SIZES = {
+    'categories': 10,
+    'menu_items': 2000,
+    'managers': 5,
+    'crew': 20,
+    'customers': 200,
+    'cart_items': 5,
+    'orders': 10000,
+    'items_per_order': 3,
+}
+
+#region Seeding
+
+def _batches(objects, batch_size):
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _create_users(prefix, count, password):
+    User.objects.bulk_create(
+        User(username=f'{prefix}{i}', password=password) for i in range(count)
+    )
+    users = list(User.objects.filter(username__startswith=prefix).order_by('id'))
+    Token.objects.bulk_create(Token(key=Token.generate_key(), user=user) for user in users)
+    return users
+
+
+def seed(sizes=None, batch_size=5000, seed_value=0):
+    sizes = {**DEFAULT_SIZES, **(sizes or {})}
+    rng = random.Random(seed_value)
+    password = make_password('benchmark')
+    now = timezone.now()
+
+    managers_group, _ = Group.objects.get_or_create(name=MANAGER)
+    crew_group, _ = Group.objects.get_or_create(name=DELIVERY_CREW)
+    managers = _create_users('bench-manager-', sizes['managers'], password)
+    crew = _create_users('bench-crew-', sizes['crew'], password)
+    customers = _create_users('bench-customer-', sizes['customers'], password)
+    # Staff, for the admin-only request stats.
+    admins = _create_users('bench-admin-', 1, password)
+    User.objects.filter(pk__in=[user.pk for user in admins]).update(is_staff=True)
+    memberships = User.groups.through
+    memberships.objects.bulk_create(
+        [memberships(user=user, group=managers_group) for user in managers]
+        + [memberships(user=user, group=crew_group) for user in crew]
+    )
+    # bulk_create skips the m2m_changed signal that drops cached roles.
+    invalidate_roles(*[user.pk for user in managers + crew + customers])
+
+    Category.objects.bulk_create(
+        Category(slug=f'category-{i}', title=f'Category {i}') for i in range(sizes['categories'])
+    )
+    category_ids = list(Category.objects.values_list('id', flat=True))
+    for batch in _batches((
+        MenuItem(
+            title=f'Dish {i}',
+            price=Decimal(rng.randint(200, 5000)) / 100,
+            featured=rng.random() < 0.1,
+            category_id=rng.choice(category_ids),
+        )
+        for i in range(sizes['menu_items'])
+    ), batch_size):
+        MenuItem.objects.bulk_create(batch)
+    menu = list(MenuItem.objects.values_list('id', 'price'))
+
+    carts = []
+    for customer in customers:
+        for item_id, price in rng.sample(menu, min(sizes['cart_items'], len(menu))):
+            carts.append(Cart(user=customer, menuitem_id=item_id, quantity=1, unit_price=price, price=price))
+    for batch in _batches(carts, batch_size):
+        Cart.objects.bulk_create(batch)
+
+    # Orders are inserted a batch at a time and their items right after, so
+    # memory stays flat even for millions of orders.
+    for batch in _batches(range(sizes['orders']), batch_size):
+        orders = []
+        lines = []
+        for _ in batch:
+            picked = rng.sample(menu, min(sizes['items_per_order'], len(menu)))
+            lines.append(picked)
+            orders.append(Order(
+                user=rng.choice(customers),
+                delivery_crew=rng.choice(crew) if rng.random() < 0.7 else None,
+                status=rng.random() < 0.5,
+                total=sum(price for _, price in picked),
+                date=now - timezone.timedelta(minutes=rng.randint(0, 60 * 24 * 365)),
+            ))
+        orders = Order.objects.bulk_create(orders)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, menuitem_id=item_id, quantity=1, unit_price=price, price=price)
+            for order, picked in zip(orders, lines)
+            for item_id, price in picked
+        ])
+
+    # bulk_create skips the signals that maintain these.
+    search_backend().rebuild()
+    bump_menu_version()
+    rollups.rebuild(batch_size)
+    snapshots.backfill(batch_size)
+    return sizes
+
+#endregion
+
+#region Driving
+
+class Endpoint:
+    # One benchmarked request. `path` and `data` may be callables taking the
+    # dataset; `setup` runs untimed before every request (e.g. to fill a cart).
+    # Streamed responses are read to the end unless `chunks` caps them, for
+    # streams that don't end by themselves.
+    def __init__(self, name, method, path, role, data=None, setup=None, chunks=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.role = role
+        self.data = data
+        self.setup = setup
+        self.chunks = chunks
+
+
+class Dataset:
+    def __init__(self):
+        self.manager = User.objects.filter(username__startswith='bench-manager-').order_by('id').first()
+        self.crew = User.objects.filter(username__startswith='bench-crew-').order_by('id').first()
+        self.customer = User.objects.filter(username__startswith='bench-customer-').order_by('id').first()
+        self.admin = User.objects.filter(username__startswith='bench-admin-').order_by('id').first()
+        self.spare = User.objects.filter(username__startswith='bench-customer-').order_by('-id').first()
+        self.item = MenuItem.objects.order_by('id').first()
+        self.order = Order.objects.filter(user=self.customer).order_by('id').first()
+        self.tokens = dict(Token.objects.filter(
+            user__in=[self.manager, self.crew, self.customer, self.admin]
+        ).values_list('user_id', 'key'))
+
+    def user(self, role):
+        return getattr(self, role)
+
+    def fill_cart(self):
+        Cart.objects.get_or_create(
+            user=self.customer, menuitem=self.item,
+            defaults={'quantity': 1, 'unit_price': self.item.price, 'price': self.item.price},
+        )
+
+    def new_order(self):
+        return Order.objects.create(user=self.customer, total=self.item.price, date=timezone.now())
+
+    def new_item(self):
+        return MenuItem.objects.create(title='Benchmark dish', price=self.item.price, featured=False,
+                                       category_id=self.item.category_id)
+
+    def item_data(self):
+        item = self.item
+        return {'title': item.title, 'price': str(item.price), 'featured': item.featured,
+                'category_id': item.category_id}
+
+
+ENDPOINTS = [
+    Endpoint('categories', 'get', '/api/categories', 'customer'),
+    Endpoint('categories add', 'post', '/api/categories', 'manager',
+             data={'slug': 'benchmark', 'title': 'Benchmark'},
+             setup=lambda d: Category.objects.filter(slug='benchmark').delete()),
+    Endpoint('menu-items', 'get', '/api/menu-items', 'customer'),
+    Endpoint('menu-items add', 'post', '/api/menu-items', 'manager',
+             data=lambda d: {**d.item_data(), 'title': 'Benchmark dish'},
+             setup=lambda d: MenuItem.objects.filter(title='Benchmark dish').delete()),
+    Endpoint('menu-items search', 'get', '/api/menu-items?search=dish', 'customer'),
+    Endpoint('menu-items cursor', 'get', '/api/menu-items?pagination=cursor', 'customer'),
+    Endpoint('menu-item', 'get', lambda d: f'/api/menu-items/{d.item.pk}', 'customer'),
+    Endpoint('menu-item patch', 'patch', lambda d: f'/api/menu-items/{d.item.pk}', 'manager',
+             data=lambda d: {'featured': d.item.featured}),
+    Endpoint('menu-item put', 'put', lambda d: f'/api/menu-items/{d.item.pk}', 'manager', data=Dataset.item_data),
+    Endpoint('menu-item delete', 'delete', lambda d: f'/api/menu-items/{d.item_to_delete.pk}', 'manager',
+             setup=lambda d: setattr(d, 'item_to_delete', d.new_item())),
+    Endpoint('menu-items bulk', 'post', '/api/menu-items/bulk', 'manager',
+             data=lambda d: [{'id': d.item.pk, 'featured': d.item.featured}]),
+    Endpoint('managers', 'get', '/api/groups/manager/users', 'manager'),
+    Endpoint('managers add', 'post', '/api/groups/manager/users', 'manager',
+             data=lambda d: {'username': d.manager.username}),
+    Endpoint('managers remove', 'delete', lambda d: f'/api/groups/manager/users/{d.spare.pk}', 'manager'),
+    Endpoint('delivery-crew', 'get', '/api/groups/delivery-crew/users', 'manager'),
+    Endpoint('delivery-crew add', 'post', '/api/groups/delivery-crew/users', 'manager',
+             data=lambda d: {'username': d.crew.username}),
+    Endpoint('delivery-crew remove', 'delete', lambda d: f'/api/groups/delivery-crew/users/{d.spare.pk}', 'manager'),
+    Endpoint('cart', 'get', '/api/cart/menu-items', 'customer'),
+    Endpoint('cart add', 'post', '/api/cart/menu-items', 'customer',
+             data=lambda d: {'menuitem_id': d.item.pk, 'quantity': 1},
+             setup=lambda d: Cart.objects.filter(user=d.customer, menuitem=d.item).delete()),
+    Endpoint('cart batch', 'post', '/api/cart/menu-items/batch', 'customer',
+             data=lambda d: {'set': [{'menuitem_id': d.item.pk, 'quantity': 2}]}),
+    Endpoint('cart clear', 'delete', '/api/cart/menu-items', 'customer', setup=Dataset.fill_cart),
+    Endpoint('orders (manager)', 'get', '/api/orders', 'manager'),
+    Endpoint('orders (crew)', 'get', '/api/orders', 'crew'),
+    Endpoint('orders (customer)', 'get', '/api/orders', 'customer'),
+    Endpoint('orders cursor', 'get', '/api/orders?pagination=cursor', 'manager'),
+    Endpoint('orders date range', 'get', '/api/orders?from=2000-01-01&pagination=cursor', 'manager'),
+    Endpoint('orders export csv', 'get', '/api/orders/export', 'manager'),
+    Endpoint('orders export ndjson', 'get', '/api/orders/export?output=ndjson&status=pending', 'manager'),
+    Endpoint('analytics revenue', 'get', '/api/analytics/revenue', 'manager'),
+    Endpoint('analytics top items', 'get', '/api/analytics/top-items', 'manager'),
+    Endpoint('analytics delivery crew', 'get', '/api/analytics/delivery-crew', 'manager'),
+    Endpoint('checkout', 'post', '/api/orders', 'customer', setup=Dataset.fill_cart),
+    Endpoint('order', 'get', lambda d: f'/api/orders/{d.order.pk}', 'customer'),
+    Endpoint('order assign', 'put', lambda d: f'/api/orders/{d.order.pk}', 'manager',
+             data=lambda d: {'crew_id': d.crew.pk}),
+    Endpoint('order status', 'patch', lambda d: f'/api/orders/{d.order.pk}', 'crew',
+             data=lambda d: {'status': d.order.status}),
+    Endpoint('order delete', 'delete', lambda d: f'/api/orders/{d.order_to_delete.pk}', 'manager',
+             setup=lambda d: setattr(d, 'order_to_delete', d.new_order())),
+    Endpoint('dispatch preview', 'get', '/api/orders/dispatch', 'manager'),
+    Endpoint('dispatch run', 'post', '/api/orders/dispatch', 'manager', setup=Dataset.new_order),
+    Endpoint('request stats', 'get', '/api/stats/requests', 'admin'),
+    Endpoint('request stats clear', 'delete', '/api/stats/requests', 'admin'),
+    Endpoint('async menu-items', 'get', '/api/async/menu-items', 'customer'),
+    Endpoint('async menu-item', 'get', lambda d: f'/api/async/menu-items/{d.item.pk}', 'customer'),
+    Endpoint('async cart', 'get', '/api/async/cart/menu-items', 'customer'),
+    Endpoint('async orders', 'get', '/api/async/orders', 'customer'),
+    Endpoint('async order', 'get', lambda d: f'/api/async/orders/{d.order.pk}', 'customer'),
+    Endpoint('async order events', 'get', '/api/async/orders/events', 'customer', chunks=1),
+]
+
+
+def uncovered_routes(report):
+    # (route, method) pairs of LittleLemonAPI/urls.py that no endpoint in the
+    # report drove. Function views are the async GET views.
+    driven = {(resolve(urlsplit(result['path']).path).route, result['method'].lower())
+              for result in report['endpoints'].values()}
+    routes = set()
+    for pattern in urlpatterns:
+        view = getattr(pattern.callback, 'view_class', None)
+        methods = [method for method in ('get', 'post', 'put', 'patch', 'delete') if hasattr(view, method)]
+        routes.update((f'api/{pattern.pattern}', method) for method in (methods if view else ['get']))
+    return sorted(routes - driven)
+
+
+@contextmanager
+def throttling_disabled():
+    # A benchmark would otherwise measure 429s after a handful of requests.
+    with mock.patch.object(APIView, 'throttle_classes', []):
+        yield
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _resolve(value, dataset):
+    return value(dataset) if callable(value) else value
+
+
+def measure(client, endpoint, dataset, iterations):
+    user = dataset.user(endpoint.role)
+    headers = {'HTTP_AUTHORIZATION': f'Token {dataset.tokens[user.pk]}'}
+    request = getattr(client, endpoint.method)
+
+    def send():
+        if endpoint.setup:
+            endpoint.setup(dataset)
+        path = _resolve(endpoint.path, dataset)
+        data = _resolve(endpoint.data, dataset)
+        started = time.perf_counter()
+        response = request(path, data, format='json', **headers) if data is not None else request(path, **headers)
+        if response.streaming:
+            # Streamed bodies are produced while they are read.
+            for read, _ in enumerate(response.streaming_content, 1):
+                if read == endpoint.chunks:
+                    break
+            response.close()
+        return time.perf_counter() - started, response.status_code
+
+    # Untimed warm-up pass that also records the query count.
+    with CaptureQueriesContext(connection) as captured:
+        _, status_code = send()
+    queries = len(captured)
+    samples = [send()[0] for _ in range(iterations)]
+    return {
+        'method': endpoint.method.upper(),
+        'path': _resolve(endpoint.path, dataset),
+        'status': status_code,
+        'queries': queries,
+        'p50_ms': round(_percentile(samples, 0.50) * 1000, 3),
+        'p99_ms': round(_percentile(samples, 0.99) * 1000, 3),
+        'mean_ms': round(statistics.fmean(samples) * 1000, 3),
+        'throughput_rps': round(len(samples) / sum(samples), 1) if sum(samples) else None,
+    }
+
+
+def run(iterations=50, only=None, sizes=None):
+    dataset = Dataset()
+    client = APIClient()
+    results = {}
+    with throttling_disabled():
+        for endpoint in ENDPOINTS:
+            if only and endpoint.name not in only:
+                continue
+            results[endpoint.name] = measure(client, endpoint, dataset, iterations)
+    return {
+        'meta': {
+            'timestamp': timezone.now().isoformat(),
+            'iterations': iterations,
+            'dataset': sizes,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+        },
+        'endpoints': results,
+    }
+
+#endregion
+
+#region Concurrency
+
+def _latency_summary(latencies, elapsed):
+    return {
+        'requests': len(latencies),
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+    }
+
+
+def _sync_clients(path, headers, clients, requests_per_client, workers, client_delay):
+    # A WSGI server with `workers` threads: requests beyond that queue for a
+    # free worker. The client's own think time is spent outside the worker,
+    # as on the async side, so only request handling is compared.
+    server = threading.BoundedSemaphore(workers)
+
+    def client_session(_):
+        client = Client()
+        latencies = []
+        try:
+            for _ in range(requests_per_client):
+                started = time.perf_counter()
+                with server:
+                    client.get(path, **headers)
+                time.sleep(client_delay)
+                latencies.append(time.perf_counter() - started)
+        finally:
+            connections.close_all()
+        return latencies
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        latencies = [latency for session in pool.map(client_session, range(clients)) for latency in session]
+    return _latency_summary(latencies, time.perf_counter() - started)
+
+
+def _async_clients(path, headers, clients, requests_per_client, client_delay):
+    # One ASGI event loop: waiting on a slow client is an await, not a
+    # blocked thread.
+    async def client_session():
+        client = AsyncClient()
+        latencies = []
+        for _ in range(requests_per_client):
+            started = time.perf_counter()
+            await client.get(path, **headers)
+            await asyncio.sleep(client_delay)
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+    async def main():
+        return await asyncio.gather(*[client_session() for _ in range(clients)])
+
+    started = time.perf_counter()
+    latencies = [latency for session in asyncio.run(main()) for latency in session]
+    return _latency_summary(latencies, time.perf_counter() - started)
+
+
+def concurrency(path='menu-items', role='customer', clients=50, requests_per_client=4, workers=4,
+                client_delay=0.05):
+    # The same read endpoint through the sync DRF view under WSGI and the
+    # async view (/api/async/...) under ASGI, with `clients` concurrent
+    # clients that each wait `client_delay` seconds between requests.
+    dataset = Dataset()
+    token = dataset.tokens[dataset.user(role).pk]
+    with throttling_disabled():
+        return {
+            'meta': {'path': path, 'clients': clients, 'requests_per_client': requests_per_client,
+                     'workers': workers, 'client_delay_ms': client_delay * 1000},
+            'sync_wsgi': _sync_clients(f'/api/{path}', {'HTTP_AUTHORIZATION': f'Token {token}'},
+                                       clients, requests_per_client, workers, client_delay),
+            'async_asgi': _async_clients(f'/api/async/{path}', {'HTTP_AUTHORIZATION': f'Token {token}'},
+                                         clients, requests_per_client, client_delay),
+        }
+
+#endregion
+
+#region Contention
+
+def _contention_summary(latencies, failures, elapsed):
+    summary = {'requests': len(latencies), 'failures': failures,
+               'throughput_rps': round(len(latencies) / elapsed, 1)}
+    if latencies:
+        summary.update(_latency_summary(latencies, elapsed))
+    return summary
+
+
+def contention(writers=4, readers=8, duration=5.0):
+    # `writers` customers checking out (add a cart line, then place the
+    # order) while `readers` managers page through the order list, for
+    # `duration` seconds. Failed requests (mostly "database is locked") are
+    # counted, not timed. Only meaningful against a file database: how
+    # readers and writers block each other depends on the journal mode.
+    customers = list(User.objects.filter(username__startswith='bench-customer-').order_by('id')[:writers])
+    managers = list(User.objects.filter(username__startswith='bench-manager-').order_by('id'))
+    tokens = dict(Token.objects.filter(user__in=customers + managers).values_list('user_id', 'key'))
+    items = list(MenuItem.objects.order_by('id').values_list('id', flat=True)[:100])
+    deadline = time.perf_counter() + duration
+
+    def session(user, requests):
+        client = Client(raise_request_exception=False, headers={'Authorization': f'Token {tokens[user.pk]}'})
+        rng = random.Random(user.pk)
+        latencies = []
+        failures = 0
+        try:
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                if all(response.status_code < 400 for response in requests(client, rng)):
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    failures += 1
+        finally:
+            connections.close_all()
+        return latencies, failures
+
+    def checkout(client, rng):
+        yield client.post('/api/cart/menu-items', {'menuitem_id': rng.choice(items), 'quantity': 1})
+        yield client.post('/api/orders')
+
+    def browse(client, rng):
+        yield client.get(f'/api/orders?page={rng.randint(1, 50)}')
+
+    started = time.perf_counter()
+    with throttling_disabled(), ThreadPoolExecutor(max_workers=writers + readers) as pool:
+        writes = [pool.submit(session, user, checkout) for user in customers]
+        reads = [pool.submit(session, managers[i % len(managers)], browse) for i in range(readers)]
+        results = {
+            name: [future.result() for future in futures]
+            for name, futures in (('checkout', writes), ('orders', reads))
+        }
+    elapsed = time.perf_counter() - started
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode')
+        journal_mode = cursor.fetchone()[0]
+    return {
+        'meta': {'writers': writers, 'readers': readers, 'duration_s': duration, 'journal_mode': journal_mode},
+        **{
+            name: _contention_summary(
+                [latency for latencies, _ in sessions for latency in latencies],
+                sum(failures for _, failures in sessions), elapsed,
+            )
+            for name, sessions in results.items()
+        },
+    }
+
+#endregion
+
+#region Comparing
+
+def compare(baseline, current, tolerance=0.2):
+    # Regressions: slower p50/p99 beyond the tolerance, or any extra query.
+    regressions = []
+    for name, result in current['endpoints'].items():
+        before = baseline.get('endpoints', {}).get(name)
+        if before is None:
+            continue
+        for metric in ('p50_ms', 'p99_ms'):
+            if result[metric] > before[metric] * (1 + tolerance):
+                regressions.append(f'{name}: {metric} {before[metric]} -> {result[metric]}')
+        if result['queries'] > before['queries']:
+            regressions.append(f'{name}: queries {before["queries"]} -> {result["queries"]}')
+    return regressions
+
+
+def load(path):
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def dump(report, path):
+    with open(path, 'w') as handle:
+        json.dump(report, handle, indent=2)
+
+#endregion
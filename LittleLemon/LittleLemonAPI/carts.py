@@ -0,0 +1,73 @@
+from decimal import Decimal
+from django.db import connection, transaction
+from rest_framework.exceptions import ValidationError
+from .models import Cart, MenuItem
+
+# Cart writes for many lines at once: one query for the prices of every
+# referenced menu item, then one statement per kind of change. Lines are
+# upserted on the ('user', 'menuitem') unique constraint, so adding an item
+# that is already in the cart increments its quantity atomically instead of
+# failing validation. The upsert skips model validation, so the resulting
+# quantity and price are checked against Cart's columns first.
+
+_MAX_QUANTITY = 32767
+_price_field = Cart._meta.get_field('price')
+_MAX_PRICE = (Decimal(10) ** (_price_field.max_digits - _price_field.decimal_places)
+              - Decimal(10) ** -_price_field.decimal_places)
+
+
+def _check(user, add, replace, prices):
+    # Locks the lines being incremented, so the check still holds at write time.
+    quantities = {line['menuitem_id']: line['quantity'] for line in replace}
+    if add:
+        current = dict(
+            Cart.objects.select_for_update().filter(user=user, menuitem_id__in=[line['menuitem_id'] for line in add])
+            .values_list('menuitem_id', 'quantity')
+        )
+        for line in add:
+            quantities[line['menuitem_id']] = current.get(line['menuitem_id'], 0) + line['quantity']
+    errors = [
+        f'Menu item {menuitem_id}: quantity {quantity} exceeds the cart limit'
+        for menuitem_id, quantity in sorted(quantities.items())
+        if quantity > _MAX_QUANTITY or prices[menuitem_id] * quantity > _MAX_PRICE
+    ]
+    if errors:
+        raise ValidationError({'quantity': errors})
+
+
+def _upsert(user, lines, prices, increment):
+    if not lines:
+        return
+    table = connection.ops.quote_name(Cart._meta.db_table)
+    if increment:
+        updates = ('"quantity" = "quantity" + excluded."quantity", "unit_price" = excluded."unit_price", '
+                   '"price" = ("quantity" + excluded."quantity") * excluded."unit_price"')
+    else:
+        updates = '"quantity" = excluded."quantity", "unit_price" = excluded."unit_price", "price" = excluded."price"'
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {table} ("user_id", "menuitem_id", "quantity", "unit_price", "price") '
+            f'VALUES (%s, %s, %s, %s, %s) ON CONFLICT ("user_id", "menuitem_id") DO UPDATE SET {updates}',
+            [
+                (user.pk, line['menuitem_id'], line['quantity'], prices[line['menuitem_id']],
+                 prices[line['menuitem_id']] * line['quantity'])
+                for line in lines
+            ],
+        )
+
+
+def update_cart(user, add=(), replace=(), remove=()):
+    # Returns the ids of unknown menu items, in which case nothing is written.
+    # Raises ValidationError when a line would outgrow the cart columns.
+    ids = {line['menuitem_id'] for line in (*add, *replace)}
+    prices = dict(MenuItem.objects.filter(pk__in=ids).values_list('pk', 'price')) if ids else {}
+    missing = sorted(ids - prices.keys())
+    if missing:
+        return missing
+    with transaction.atomic():
+        _check(user, add, replace, prices)
+        _upsert(user, add, prices, increment=True)
+        _upsert(user, replace, prices, increment=False)
+        if remove:
+            Cart.objects.filter(user=user, menuitem_id__in=remove).delete()
+    return []
@@ -0,0 +1,28 @@
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from .models import Cart, Order, OrderItem
+from .rollups import record_items
+from .snapshots import write_snapshots
+
+
+# Turns the user's cart into an order in one transaction and returns it, or
+# None when the cart is empty. The cart rows are locked first, so a concurrent
+# double-submit finds an empty cart instead of creating a second order.
+def place_order(user):
+    with transaction.atomic():
+        carts = list(
+            Cart.objects.select_for_update()
+            .filter(user=user)
+            .values('menuitem_id', 'quantity', 'unit_price', 'price')
+        )
+        if not carts:
+            return None
+        total = Cart.objects.filter(user=user).aggregate(total=Sum('price'))['total']
+        order = Order.objects.create(user=user, status=False, total=total, date=timezone.now())
+        OrderItem.objects.bulk_create([OrderItem(order=order, **cart) for cart in carts])
+        record_items(order.date, carts)
+        order.snapshot = write_snapshots([order.pk])[order.pk]
+        order.snapshot_version = Order.SNAPSHOT_VERSION
+        Cart.objects.filter(user=user).delete()
+    return order
@@ -0,0 +1,70 @@
+import hashlib
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+# Detail validators come from the stored updated_at columns, never from the
+# rendered body, so an unchanged resource is answered with a 304 before
+# anything is serialized. Lists use a cheap version from get_list_validators
+# when the view has one, and otherwise a weak ETag of the rendered page, since
+# a list's body also changes with rows it joins (user names, menu titles)
+# that no updated_at column tracks. The negotiated format is part of the ETag
+# because JSON, XML and CSV renderings of the same data are different
+# representations.
+
+
+def make_etag(request, *parts):
+    renderer = getattr(request, 'accepted_renderer', None)
+    parts = (getattr(renderer, 'format', ''), *parts)
+    return quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+
+
+def latest_timestamp(*values):
+    values = [value for value in values if value is not None]
+    return int(max(values).timestamp()) if values else None
+
+
+def not_modified(request, etag, last_modified):
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def add_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+class ConditionalListMixin:
+    def get_list_validators(self, request):
+        # (etag, last modified) known before the list is built, or None.
+        return None
+
+    def get(self, request, *args, **kwargs):
+        validators = self.get_list_validators(request)
+        if validators is None:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            etag = f'W/{make_etag(request, response.data)}'
+            return add_validators(not_modified(request, etag, None) or response, etag, None)
+        etag, last_modified = validators
+        response = not_modified(request, etag, last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        return add_validators(response, etag, last_modified)
+
+
+class ConditionalDetailMixin:
+    conditional_fields = ('updated_at',)
+
+    def get(self, request, *args, **kwargs):
+        lookup = {self.lookup_field: kwargs[self.lookup_url_kwarg or self.lookup_field]}
+        values = self.get_queryset().filter(**lookup).values_list(*self.conditional_fields).first()
+        if values is None:
+            return super().get(request, *args, **kwargs)
+        last_modified = latest_timestamp(*values)
+        etag = make_etag(request, lookup, [value and value.isoformat() for value in values])
+        response = not_modified(request, etag, last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        return add_validators(response, etag, last_modified)
@@ -0,0 +1,113 @@
+import heapq
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from .models import DispatchLock, Order
+from .roles import DELIVERY_CREW
+from . import events, rollups, snapshots
+
+# Automatic delivery crew assignment. A run hands every pending order without
+# a crew, oldest first, to the active Delivery Crew member with the fewest
+# open orders (a heap keyed on open-order count, ties broken on user id), and
+# writes all assignments with one bulk_update. Crew membership is read once
+# per run instead of once per order. bulk_update skips the Order signals, so
+# the run does their work itself: snapshots, updated_at, crew rollups and
+# order.updated events. Runs are started by the manager endpoint or by
+# `manage.py dispatch_orders`, which repeats them every DISPATCH_INTERVAL
+# seconds when that is set. Run exactly one such command per deployment; the
+# web processes never dispatch on their own.
+
+def max_open_orders():
+    return getattr(settings, 'DISPATCH_MAX_OPEN_ORDERS', None)
+
+#region Planning
+
+def crew_loads():
+    # {crew member id: open orders}, for every active Delivery Crew member.
+    crew = User.objects.filter(groups__name=DELIVERY_CREW, is_active=True).values_list('pk', flat=True)
+    loads = dict.fromkeys(crew, 0)
+    open_orders = (
+        Order.objects.filter(status=False, delivery_crew__in=list(loads))
+        .values_list('delivery_crew').annotate(open=Count('pk')).order_by()
+    )
+    loads.update(open_orders)
+    return loads
+
+
+def plan(order_ids, loads, limit=None):
+    # [(order id, crew id)] for `order_ids` in order. Stops once every crew
+    # member has `limit` open orders.
+    heap = [(count, crew_id) for crew_id, count in loads.items()]
+    heapq.heapify(heap)
+    assignments = []
+    for order_id in order_ids:
+        if not heap or (limit is not None and heap[0][0] >= limit):
+            break
+        count, crew_id = heap[0]
+        heapq.heapreplace(heap, (count + 1, crew_id))
+        assignments.append((order_id, crew_id))
+    return assignments
+
+
+def _summary(assignments, loads, pending):
+    for _, crew_id in assignments:
+        loads[crew_id] += 1
+    return {
+        'assigned': len(assignments),
+        'unassigned': pending - len(assignments),
+        'assignments': [{'order': order_id, 'delivery_crew': crew_id} for order_id, crew_id in assignments],
+        'open_orders': [{'delivery_crew': crew_id, 'open': count} for crew_id, count in sorted(loads.items())],
+    }
+
+#endregion
+
+#region Running
+
+def _pending():
+    return Order.objects.filter(status=False, delivery_crew__isnull=True).order_by('date', 'pk')
+
+
+def preview():
+    # What run() would assign now, without writing anything.
+    loads = crew_loads()
+    order_ids = list(_pending().values_list('pk', flat=True))
+    return _summary(plan(order_ids, dict(loads), max_open_orders()), loads, len(order_ids))
+
+
+def _lock(now):
+    # The first statement of the run is a write to the lock row: it blocks
+    # other runs until this one commits, also on SQLite where
+    # select_for_update() does nothing.
+    if not DispatchLock.objects.filter(pk=1).update(last_run_at=now):
+        DispatchLock.objects.create(pk=1, last_run_at=now)
+
+
+def run():
+    # Orders and crew loads are read and written in one transaction behind
+    # the lock row, so concurrent runs can't hand out an order twice.
+    with transaction.atomic():
+        now = timezone.now()
+        _lock(now)
+        orders = list(_pending().select_for_update())
+        loads = crew_loads()
+        assignments = plan([order.pk for order in orders], dict(loads), max_open_orders())
+        crew = User.objects.in_bulk({crew_id for _, crew_id in assignments})
+        changes = []
+        assigned = []
+        for order, (_, crew_id) in zip(orders, assignments):
+            old = rollups.order_state(order)
+            order.delivery_crew = crew[crew_id]
+            order.updated_at = now
+            snapshots.refresh_snapshot(order)
+            changes += [(old, -1), (rollups.order_state(order), 1)]
+            assigned.append(order)
+        Order.objects.bulk_update(assigned, ['delivery_crew', 'updated_at', 'snapshot'], batch_size=500)
+        rollups.apply_order_changes(changes)
+        for order in assigned:
+            events.publish_order_event('order.updated', order)
+            order._saved_state = rollups.order_state(order)
+    return _summary(assignments, loads, len(orders))
+
+#endregion
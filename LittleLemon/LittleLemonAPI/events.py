@@ -0,0 +1,168 @@
+import asyncio
+import itertools
+import queue
+import threading
+from collections import defaultdict, deque
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+from .models import Order
+from .renderers import FastJSONRenderer
+
+# Order status push. Order saves and deletes (signals.py) publish an event
+# once their transaction commits; the SSE endpoint subscribes to the
+# audiences its user may see: their own orders, the orders assigned to them
+# as delivery crew, or every order for managers.
+
+#region Brokers
+
+class Event:
+    def __init__(self, id, type, data, audiences):
+        self.id = id
+        self.type = type
+        self.data = data
+        self.audiences = frozenset(audiences)
+
+
+class Subscription:
+    # Events are handed over from whatever thread published them to the
+    # subscriber's event loop. A subscriber that falls `maxsize` events
+    # behind loses the newest ones and should reconnect with Last-Event-ID.
+    def __init__(self, audiences, maxsize=100):
+        self.audiences = frozenset(audiences)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+        self.backlog = []
+
+    def deliver(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # The subscriber's loop is already closed.
+            pass
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    async def get(self, timeout):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class BlockingSubscription(Subscription):
+    # For streams served by a WSGI worker thread, which blocks on get().
+    def __init__(self, audiences, maxsize=100):
+        self.audiences = frozenset(audiences)
+        self.queue = queue.Queue(maxsize)
+        self.backlog = []
+
+    def deliver(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            pass
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class LocalBroker:
+    # In-process broker: enough for a single server process and for tests.
+    # A broker for several processes (e.g. on redis pub/sub) implements the
+    # same publish/subscribe/unsubscribe methods.
+    def __init__(self, history=1000):
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(set)
+        self.history = deque(maxlen=history)
+        self.ids = itertools.count(1)
+
+    def publish(self, type, data, audiences):
+        with self.lock:
+            event = Event(next(self.ids), type, data, audiences)
+            self.history.append(event)
+            subscribers = set().union(*(self.subscribers.get(audience, ()) for audience in event.audiences))
+        for subscription in subscribers:
+            subscription.deliver(event)
+        return event
+
+    def subscribe(self, audiences, last_event_id=None, blocking=False):
+        # Call from the event loop that will read the subscription, or with
+        # `blocking` from the thread that will.
+        subscription = BlockingSubscription(audiences) if blocking else Subscription(audiences)
+        with self.lock:
+            for audience in subscription.audiences:
+                self.subscribers[audience].add(subscription)
+            if last_event_id is not None:
+                subscription.backlog = [
+                    event for event in self.history
+                    if event.id > last_event_id and event.audiences & subscription.audiences
+                ]
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for audience in subscription.audiences:
+                self.subscribers[audience].discard(subscription)
+                if not self.subscribers[audience]:
+                    del self.subscribers[audience]
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(getattr(settings, 'EVENTS_BROKER', 'LittleLemonAPI.events.LocalBroker'))()
+    return _broker
+
+#endregion
+
+#region Orders
+
+def user_audience(user_id):
+    return f'user:{user_id}'
+
+
+def crew_audience(user_id):
+    return f'crew:{user_id}'
+
+
+MANAGERS = 'managers'
+
+_status_field = Order._meta.get_field('status')
+
+
+def order_event_data(order):
+    return {
+        'id': order.pk,
+        'user_id': order.user_id,
+        'delivery_crew_id': order.delivery_crew_id,
+        'status': 'Delivered' if _status_field.to_python(order.status) else 'Pending',
+    }
+
+
+def publish_order_event(type, order, previous_crew_id=None):
+    # Published after commit, so listeners never see a rolled back change.
+    # A crew member who was just unassigned still gets the update.
+    data = order_event_data(order)
+    audiences = {user_audience(order.user_id), MANAGERS}
+    for crew_id in (order.delivery_crew_id, previous_crew_id):
+        if crew_id is not None:
+            audiences.add(crew_audience(crew_id))
+    transaction.on_commit(lambda: get_broker().publish(type, data, audiences))
+
+
+def format_event(event):
+    data = FastJSONRenderer().render(event.data).decode()
+    return f'id: {event.id}\nevent: {event.type}\ndata: {data}\n\n'
+
+#endregion
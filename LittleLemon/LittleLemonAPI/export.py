@@ -0,0 +1,159 @@
+import csv
+import datetime
+import heapq
+import io
+from itertools import groupby
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from .models import ArchivedOrder, Order
+from .renderers import FastJSONRenderer
+
+# Streaming order history export. One SQL query walks orders LEFT JOINed to
+# their items with iterator(chunk_size), so rows are fetched and written a
+# chunk at a time (a server-side cursor on PostgreSQL) and memory stays flat
+# however many orders match. CSV has one line per order item; NDJSON has one
+# order per line with its items nested, grouped on the fly from the sorted rows.
+# Like the order list, a from/to range also covers archived orders: the
+# archive is walked the same way and merged in by date.
+
+COLUMNS = (
+    'order_id', 'date', 'user_id', 'username', 'delivery_crew_id', 'delivery_crew', 'status', 'total',
+    'item_id', 'menuitem_id', 'menuitem', 'quantity', 'unit_price', 'price',
+)
+_FIELDS = (
+    'id', 'date', 'user_id', 'user__username', 'delivery_crew_id', 'delivery_crew__username', 'status', 'total',
+    'order_items__id', 'order_items__menuitem_id', 'order_items__menuitem__title',
+    'order_items__quantity', 'order_items__unit_price', 'order_items__price',
+)
+_ORDER_COLUMNS = 8
+_BUFFER_SIZE = 64 * 1024
+_date_field = serializers.DateTimeField()
+
+
+def chunk_size():
+    return getattr(settings, 'ORDER_EXPORT_CHUNK_SIZE', 2000)
+
+#region Filters
+
+def _parse_bound(name, value, end):
+    # A bare date covers the whole day on both ends. Well-formed but
+    # impossible values (2024-02-30, hour 25) are rejected like malformed ones.
+    try:
+        day = parse_date(value)
+        if day is not None:
+            if end:
+                return timezone.make_aware(datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time())), 'lt'
+            return timezone.make_aware(datetime.datetime.combine(day, datetime.time())), 'gte'
+        moment = parse_datetime(value)
+    except (ValueError, OverflowError):
+        moment = None
+    if moment is None:
+        raise ValidationError({name: 'Expected an ISO 8601 date or datetime'})
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment, 'lte' if end else 'gte'
+
+
+def export_filters(params):
+    # `from`/`to` (inclusive), `status` (delivered/pending or 1/0) and
+    # `delivery_crew` (user id, or `none` for unassigned), all applied in SQL.
+    conditions = Q()
+    if params.get('from'):
+        moment, lookup = _parse_bound('from', params['from'], end=False)
+        conditions &= Q(**{f'date__{lookup}': moment})
+    if params.get('to'):
+        moment, lookup = _parse_bound('to', params['to'], end=True)
+        conditions &= Q(**{f'date__{lookup}': moment})
+    status = params.get('status', '').lower()
+    if status:
+        if status in ('1', 'true', 'delivered'):
+            conditions &= Q(status=True)
+        elif status in ('0', 'false', 'pending'):
+            conditions &= Q(status=False)
+        else:
+            raise ValidationError({'status': 'Expected delivered or pending'})
+    crew = params.get('delivery_crew', '')
+    if crew:
+        if crew.lower() == 'none':
+            conditions &= Q(delivery_crew__isnull=True)
+        elif crew.isdigit():
+            conditions &= Q(delivery_crew_id=int(crew))
+        else:
+            raise ValidationError({'delivery_crew': 'Expected a user id or none'})
+    return conditions
+
+#endregion
+
+#region Writers
+
+def _rows(model, conditions):
+    return (
+        model.objects.filter(conditions)
+        .order_by('date', 'id', 'order_items__id')
+        .values_list(*_FIELDS)
+        .iterator(chunk_size=chunk_size())
+    )
+
+
+def export_rows(conditions, archived=False):
+    rows = _rows(Order, conditions)
+    if not archived:
+        return rows
+    # An order is in one table only, so its item lines stay together.
+    return heapq.merge(rows, _rows(ArchivedOrder, conditions), key=lambda row: (row[1], row[0]))
+
+
+def _format(row):
+    row = list(row)
+    row[1] = _date_field.to_representation(row[1])
+    row[6] = 'Delivered' if row[6] else 'Pending'
+    for index in (7, 12, 13):
+        if row[index] is not None:
+            row[index] = str(row[index])
+    return row
+
+
+def stream_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for row in rows:
+        writer.writerow(_format(row))
+        if buffer.tell() >= _BUFFER_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def stream_ndjson(rows):
+    renderer = FastJSONRenderer()
+    buffer = []
+    size = 0
+    for _, lines in groupby(map(_format, rows), key=lambda row: row[0]):
+        lines = list(lines)
+        order = dict(zip(COLUMNS[:_ORDER_COLUMNS], lines[0]))
+        order['items'] = [
+            dict(zip(COLUMNS[_ORDER_COLUMNS:], line[_ORDER_COLUMNS:]))
+            for line in lines if line[_ORDER_COLUMNS] is not None
+        ]
+        line = renderer.render(order) + b'\n'
+        buffer.append(line)
+        size += len(line)
+        if size >= _BUFFER_SIZE:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    yield b''.join(buffer)
+
+
+WRITERS = {
+    'csv': (stream_csv, 'text/csv; charset=utf-8'),
+    'ndjson': (stream_ndjson, 'application/x-ndjson'),
+}
+
+#endregion
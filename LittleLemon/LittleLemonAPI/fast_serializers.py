@@ -0,0 +1,202 @@
+import decimal
+from collections import defaultdict
+from rest_framework import serializers
+from rest_framework.response import Response
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+from .serializers import CartSerializer, MenuItemSerializer, OrderItemSerializer, OrderSerializer
+
+# Read-only list path: rows come from .values() and are turned into the exact
+# JSON shape of the DRF serializers by mappers compiled once from those
+# serializers' fields, so no model instances are built and there is no
+# per-field to_representation dispatch. tests.py checks the rendered bytes
+# against the regular serializers.
+
+
+def _decimal(field):
+    exponent = decimal.Decimal('.1') ** field.decimal_places
+    context = decimal.getcontext().copy()
+    context.prec = field.max_digits
+    rounding = field.rounding
+
+    def convert(value):
+        if value is None:
+            return ''
+        return f'{value.quantize(exponent, rounding=rounding, context=context):f}'
+    return convert
+
+
+def _datetime(field):
+    def convert(value):
+        if not value:
+            return None
+        value = field.enforce_timezone(value).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    return convert
+
+
+def _converter(field):
+    if isinstance(field, serializers.DecimalField):
+        return _decimal(field)
+    if isinstance(field, serializers.DateTimeField):
+        return _datetime(field)
+    if isinstance(field, (serializers.IntegerField, serializers.CharField, serializers.BooleanField)):
+        return None
+    raise TypeError(f'No fast mapping for {type(field).__name__}')
+
+
+class RowMapper:
+    # Compiled from a serializer: `columns` are the .values() names to fetch
+    # and map() builds one output dict from one row. `extra` maps a field name
+    # to (columns, function of the row) for fields like SerializerMethodField;
+    # `skip` leaves fields out for the caller to fill in.
+
+    def __init__(self, serializer, prefix='', extra=None, skip=()):
+        self.columns = []
+        self.plan = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if extra and name in extra:
+                columns, function = extra[name]
+                self.columns += [prefix + column for column in columns]
+                self.plan.append((name, 'extra', function))
+            elif name in skip:
+                self.plan.append((name, 'skip', None))
+            elif isinstance(field, serializers.BaseSerializer):
+                nested = RowMapper(field, f'{prefix}{field.source}__')
+                self.columns += nested.columns
+                self.plan.append((name, 'nested', (f'{prefix}{field.source}__id', nested)))
+            else:
+                column = prefix + field.source
+                self.columns.append(column)
+                self.plan.append((name, 'value', (column, _converter(field))))
+
+    def map(self, row):
+        data = {}
+        for name, kind, payload in self.plan:
+            if kind == 'value':
+                column, convert = payload
+                value = row[column]
+                data[name] = convert(value) if convert else value
+            elif kind == 'nested':
+                pk_column, nested = payload
+                data[name] = None if row[pk_column] is None else nested.map(row)
+            elif kind == 'extra':
+                data[name] = payload(row)
+            else:
+                data[name] = None
+        return data
+
+    def values(self, queryset):
+        return queryset.prefetch_related(None).values(*self.columns)
+
+
+class OrderRows:
+    # Orders plus their items in exactly two queries. `item_model` is
+    # ArchivedOrderItem for archived orders.
+    def __init__(self, item_model=OrderItem):
+        self.item_model = item_model
+        self.orders = RowMapper(
+            OrderSerializer(),
+            extra={'status': (['status'], lambda row: 'Delivered' if row['status'] else 'Pending')},
+            skip=('order_items',),
+        )
+        self.items = RowMapper(OrderItemSerializer())
+
+    def values(self, queryset):
+        return self.orders.values(queryset)
+
+    def item_rows(self, rows):
+        return (
+            self.item_model.objects.filter(order_id__in=[row['id'] for row in rows])
+            .order_by('id')
+            .values('order_id', *self.items.columns)
+        )
+
+    def assemble(self, rows, item_rows):
+        items = defaultdict(list)
+        for row in item_rows:
+            items[row['order_id']].append(self.items.map(row))
+        data = []
+        for row in rows:
+            order = self.orders.map(row)
+            order['order_items'] = items[row['id']]
+            data.append(order)
+        return data
+
+    def serialize(self, rows):
+        rows = list(rows)
+        return self.assemble(rows, self.item_rows(rows) if rows else [])
+
+    async def aserialize(self, rows):
+        rows = [row async for row in rows.aiterator()]
+        item_rows = [row async for row in self.item_rows(rows).aiterator()] if rows else []
+        return self.assemble(rows, item_rows)
+
+
+class OrderSnapshotRows:
+    # Orders with a current snapshot (see snapshots.py) come straight out of
+    # that column, so a page of them is one query on the orders table. The
+    # others on the page go through `fallback` together.
+    def __init__(self, fallback, model=Order):
+        self.fallback = fallback
+        self.model = model
+
+    def values(self, queryset):
+        return queryset.prefetch_related(None).values('id', 'date', 'snapshot', 'snapshot_version')
+
+    def fresh(self, row):
+        return row['snapshot_version'] == Order.SNAPSHOT_VERSION and row['snapshot'] is not None
+
+    def stale_orders(self, rows):
+        ids = [row['id'] for row in rows if not self.fresh(row)]
+        return self.fallback.values(self.model.objects.filter(pk__in=ids)) if ids else None
+
+    def merge(self, rows, rebuilt):
+        rebuilt = {order['id']: order for order in rebuilt}
+        return [row['snapshot'] if self.fresh(row) else rebuilt[row['id']]
+                for row in rows if self.fresh(row) or row['id'] in rebuilt]
+
+    def serialize(self, rows):
+        rows = list(rows)
+        stale = self.stale_orders(rows)
+        return self.merge(rows, self.fallback.serialize(stale) if stale is not None else [])
+
+    async def aserialize(self, rows):
+        rows = [row async for row in rows.aiterator()]
+        stale = self.stale_orders(rows)
+        return self.merge(rows, await self.fallback.aserialize(stale) if stale is not None else [])
+
+
+class MapperRows:
+    def __init__(self, mapper):
+        self.mapper = mapper
+
+    def values(self, queryset):
+        return self.mapper.values(queryset)
+
+    def serialize(self, rows):
+        return [self.mapper.map(row) for row in rows]
+
+    async def aserialize(self, rows):
+        return [self.mapper.map(row) async for row in rows.aiterator()]
+
+
+menu_item_rows = MapperRows(RowMapper(MenuItemSerializer()))
+cart_rows = MapperRows(RowMapper(CartSerializer()))
+order_rows = OrderRows()
+order_snapshot_rows = OrderSnapshotRows(order_rows)
+archived_order_rows = OrderSnapshotRows(OrderRows(ArchivedOrderItem), ArchivedOrder)
+
+
+class FastListMixin:
+    # For ListAPIView subclasses: list() goes through `fast_rows` instead of
+    # serializer_class. Writes keep using the regular serializer.
+    fast_rows = None
+
+    def list(self, request, *args, **kwargs):
+        rows = self.fast_rows.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(self.fast_rows.serialize(page))
+        return Response(self.fast_rows.serialize(rows))
@@ -0,0 +1,109 @@
+import functools
+import hashlib
+import time
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from .models import IdempotencyKey
+from .sweeping import delete_in_batches
+
+# Idempotency-Key support for POST handlers. The first request with a key
+# claims it by inserting a row (the (user, key) unique constraint makes the
+# claim atomic across workers), runs the handler and stores the response
+# data. Repeats within IDEMPOTENCY_KEY_TTL get that response replayed without
+# running the handler again. A repeat that arrives while the first request is
+# still running waits up to IDEMPOTENCY_WAIT seconds for it, then gets a 409.
+# Keys reused with a different method, path or body get a 422. Server errors
+# and exceptions release the key so the client can retry.
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+_POLL_INTERVAL = 0.05
+
+
+def key_ttl():
+    return getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60)
+
+
+def lock_timeout():
+    # A claim still running after this long belongs to a worker that died.
+    return getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 60)
+
+
+def fingerprint(request):
+    digest = hashlib.sha256(f'{request.method} {request.path}\n'.encode())
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def _claim(user, key, request_fingerprint):
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user=user, key=key, fingerprint=request_fingerprint, created_at=timezone.now(),
+            ), True
+    except IntegrityError:
+        return IdempotencyKey.objects.filter(user=user, key=key).first(), False
+
+
+def _release(record):
+    # Only removes the row this request saw, never a newer claim.
+    IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at).delete()
+
+
+def idempotent(handler):
+    @functools.wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or not request.user.is_authenticated:
+            return handler(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return Response({'error': f'{HEADER} must be at most 255 characters'}, status.HTTP_400_BAD_REQUEST)
+
+        request_fingerprint = fingerprint(request)
+        deadline = time.monotonic() + getattr(settings, 'IDEMPOTENCY_WAIT', 5)
+        while True:
+            record, claimed = _claim(request.user, key, request_fingerprint)
+            if claimed:
+                break
+            if record is None:
+                continue
+            if record.fingerprint != request_fingerprint:
+                return Response({'error': f'{HEADER} was already used for a different request'},
+                                status.HTTP_422_UNPROCESSABLE_ENTITY)
+            age = (timezone.now() - record.created_at).total_seconds()
+            if age > key_ttl() or (record.status_code is None and age > lock_timeout()):
+                _release(record)
+                continue
+            if record.status_code is not None:
+                return Response(record.response, status=record.status_code, headers={REPLAYED_HEADER: 'true'})
+            if time.monotonic() >= deadline:
+                return Response({'error': f'A request with this {HEADER} is still in progress'},
+                                status.HTTP_409_CONFLICT)
+            time.sleep(_POLL_INTERVAL)
+
+        try:
+            response = handler(self, request, *args, **kwargs)
+        except Exception:
+            _release(record)
+            raise
+        if response.status_code >= 500:
+            _release(record)
+        else:
+            IdempotencyKey.objects.filter(pk=record.pk).update(
+                status_code=response.status_code, response=response.data,
+            )
+        return response
+    return wrapper
+
+
+def sweep(batch_size=1000):
+    # Deletes expired keys and abandoned claims; returns how many went.
+    now = timezone.now()
+    expired = IdempotencyKey.objects.filter(created_at__lt=now - timezone.timedelta(seconds=key_ttl()))
+    abandoned = IdempotencyKey.objects.filter(
+        status_code__isnull=True, created_at__lt=now - timezone.timedelta(seconds=lock_timeout()),
+    )
+    return sum(delete_in_batches(queryset, batch_size) for queryset in (expired, abandoned))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from LittleLemonAPI import archive
+
+
+class Command(BaseCommand):
+    help = 'Move delivered orders older than ORDER_ARCHIVE_AFTER_DAYS into the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, help='Overrides ORDER_ARCHIVE_AFTER_DAYS')
+        parser.add_argument('--batch-size', type=int, default=500, help='Orders moved per transaction')
+
+    def handle(self, *args, **options):
+        moved = archive.archive_orders(options['older_than_days'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} orders'))
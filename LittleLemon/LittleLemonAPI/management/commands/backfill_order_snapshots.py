@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from LittleLemonAPI import snapshots
+
+
+class Command(BaseCommand):
+    help = 'Write the JSON snapshot of every order that has none or an outdated one'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--rebuild', action='store_true', help='Rewrite current snapshots too')
+
+    def handle(self, *args, **options):
+        written = snapshots.backfill(options['batch_size'], options['rebuild'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} order snapshots'))
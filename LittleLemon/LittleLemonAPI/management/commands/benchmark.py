@@ -0,0 +1,126 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from LittleLemonAPI import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Seed a benchmark dataset in a throwaway database and measure every API endpoint'
+
+    def add_arguments(self, parser):
+        for name, default in benchmarks.DEFAULT_SIZES.items():
+            parser.add_argument(f'--{name.replace("_", "-")}', type=int, default=default, dest=name)
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--endpoint', action='append', dest='only', help='Only run the named endpoint(s)')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        parser.add_argument('--baseline', help='Fail if results regress against this JSON report')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed latency slowdown (0.2 = 20%%)')
+        parser.add_argument('--concurrency', action='store_true',
+                            help='Compare sync WSGI and async ASGI throughput with many slow clients instead')
+        parser.add_argument('--path', default='menu-items', help='Endpoint for --concurrency, relative to /api/')
+        parser.add_argument('--clients', type=int, default=50)
+        parser.add_argument('--workers', type=int, default=4, help='Sync worker threads for --concurrency')
+        parser.add_argument('--client-delay', type=float, default=0.05,
+                            help='Seconds each client waits between requests')
+        parser.add_argument('--contention', action='store_true',
+                            help='Run concurrent checkouts and order reads against a file database '
+                                 'under each SQLite profile instead')
+        parser.add_argument('--profile', action='append', dest='profiles', choices=list(settings.SQLITE_PROFILES),
+                            help='SQLite profile(s) for --contention (default: all)')
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--duration', type=float, default=5.0, help='Seconds per --contention run')
+        parser.add_argument('--keepdb', action='store_true', help='Reuse the benchmark database between runs')
+
+    @contextmanager
+    def database(self, options, sizes, keepdb):
+        # Never touch the real database: seed into the test database instead.
+        old_name = connection.settings_dict['NAME']
+        setup_test_environment(debug=False)
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+        try:
+            from LittleLemonAPI.models import MenuItem
+            if not MenuItem.objects.exists():
+                self.stdout.write('Seeding dataset...')
+                benchmarks.seed(sizes, batch_size=options['batch_size'])
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+            teardown_test_environment()
+
+    @contextmanager
+    def sqlite_profile(self, name, path):
+        # The test database as a file (WAL needs one) with the profile's
+        # connection settings; every thread's connection reads this dict.
+        settings_dict = connection.settings_dict
+        saved = {key: settings_dict.get(key) for key in ('OPTIONS', 'CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')}
+        saved_test_name = settings_dict['TEST'].get('NAME')
+        connection.close()
+        settings_dict.update({'CONN_HEALTH_CHECKS': False, **settings.SQLITE_PROFILES[name]})
+        settings_dict['TEST']['NAME'] = path
+        try:
+            yield
+        finally:
+            connection.close()
+            settings_dict.update(saved)
+            settings_dict['TEST']['NAME'] = saved_test_name
+
+    def handle(self, *args, **options):
+        sizes = {name: options[name] for name in benchmarks.DEFAULT_SIZES}
+        if options['contention']:
+            return self.contention(options, sizes)
+
+        with self.database(options, sizes, options['keepdb']):
+            if options['concurrency']:
+                report = benchmarks.concurrency(
+                    options['path'], clients=options['clients'], workers=options['workers'],
+                    client_delay=options['client_delay'],
+                )
+            else:
+                report = benchmarks.run(options['iterations'], options['only'], sizes)
+
+        if options['concurrency']:
+            for name in ('sync_wsgi', 'async_asgi'):
+                result = report[name]
+                self.stdout.write(
+                    f'{name:<12} p50 {result["p50_ms"]:>8.2f}ms  p99 {result["p99_ms"]:>8.2f}ms  '
+                    f'{result["throughput_rps"]:>8} req/s'
+                )
+            if options['output']:
+                benchmarks.dump(report, options['output'])
+            return
+
+        for name, result in report['endpoints'].items():
+            self.stdout.write(
+                f'{name:<24} {result["status"]:>3}  p50 {result["p50_ms"]:>8.2f}ms  '
+                f'p99 {result["p99_ms"]:>8.2f}ms  {result["throughput_rps"]:>8} req/s  {result["queries"]:>3} queries'
+            )
+        if options['output']:
+            benchmarks.dump(report, options['output'])
+        if options['baseline']:
+            regressions = benchmarks.compare(benchmarks.load(options['baseline']), report, options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions against baseline'))
+
+    def contention(self, options, sizes):
+        report = {}
+        with tempfile.TemporaryDirectory() as directory:
+            for name in options['profiles'] or settings.SQLITE_PROFILES:
+                path = os.path.join(directory, f'benchmark-{name}.sqlite3')
+                with self.sqlite_profile(name, path), self.database(options, sizes, keepdb=False):
+                    report[name] = benchmarks.contention(options['writers'], options['readers'], options['duration'])
+        for name, result in report.items():
+            for kind in ('checkout', 'orders'):
+                stats = result[kind]
+                self.stdout.write(
+                    f'{name:<8} {kind:<9} {stats["throughput_rps"]:>8} req/s  p99 {stats.get("p99_ms", 0):>9.2f}ms  '
+                    f'{stats["failures"]:>5} failed'
+                )
+        if options['output']:
+            benchmarks.dump(report, options['output'])
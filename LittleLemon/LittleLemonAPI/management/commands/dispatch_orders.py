@@ -0,0 +1,42 @@
+import logging
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from LittleLemonAPI import dispatch
+
+logger = logging.getLogger('LittleLemonAPI.dispatch')
+
+
+class Command(BaseCommand):
+    help = 'Assign unassigned pending orders to the least busy delivery crew members'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--preview', action='store_true', help='Show the assignments without saving them')
+        parser.add_argument(
+            '--every', type=int, default=getattr(settings, 'DISPATCH_INTERVAL', 0),
+            help='Keep running, once every this many seconds (default: DISPATCH_INTERVAL)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                self.dispatch(options['preview'])
+            except Exception:
+                if not options['every']:
+                    raise
+                # Logged and retried on the next tick.
+                logger.exception('Order dispatch failed')
+            if not options['every']:
+                return
+            time.sleep(options['every'])
+            close_old_connections()
+
+    def dispatch(self, preview):
+        result = dispatch.preview() if preview else dispatch.run()
+        for assignment in result['assignments']:
+            self.stdout.write(f'Order {assignment["order"]} -> crew {assignment["delivery_crew"]}')
+        verb = 'Would assign' if preview else 'Assigned'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {result["assigned"]} orders, {result["unassigned"]} left unassigned'
+        ))
@@ -0,0 +1,35 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from LittleLemonAPI.menu_import import import_menu_items, max_rows, parse_csv
+
+
+class Command(BaseCommand):
+    help = 'Create or update menu items in bulk from a JSON or CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['json', 'csv'],
+                            help='Defaults to the file extension')
+        parser.add_argument('--skip-invalid', action='store_true',
+                            help='Import the valid rows even if some rows have errors')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'json')
+        with open(path, encoding='utf-8-sig') as handle:
+            if file_format == 'csv':
+                rows = parse_csv(handle.read())
+            else:
+                rows = json.load(handle)
+                if isinstance(rows, dict):
+                    rows = rows.get('items', [])
+        if len(rows) > max_rows():
+            raise CommandError(f'At most {max_rows()} rows per import, got {len(rows)}')
+        report = import_menu_items(rows, options['skip_invalid'])
+        for error in report['errors']:
+            self.stderr.write(f'Row {error["row"]}: {json.dumps(error["errors"])}')
+        if report['errors'] and not options['skip_invalid']:
+            raise CommandError(f'{len(report["errors"])} invalid rows, nothing imported')
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(report["created"])} and updated {len(report["updated"])} menu items'
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from LittleLemonAPI import rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily sales, item sales and delivery crew rollups from orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        counts = rollups.rebuild(options['batch_size'])
+        summary = ', '.join(f'{count} {name}' for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rollups: {summary}'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from LittleLemonAPI.menu_cache import bump_menu_version
+from LittleLemonAPI.models import MenuItem
+from LittleLemonAPI.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the menu full-text search index from scratch'
+
+    def handle(self, *args, **options):
+        get_backend().rebuild()
+        # Cached search pages may have been built from the stale index.
+        bump_menu_version()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {MenuItem.objects.count()} menu items'))
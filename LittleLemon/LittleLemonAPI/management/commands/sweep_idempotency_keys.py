@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from LittleLemonAPI.idempotency import sweep
+
+
+class Command(BaseCommand):
+    help = 'Delete expired Idempotency-Key records and abandoned in-flight claims'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        deleted = sweep(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} idempotency keys'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from LittleLemonAPI.throttles import sweep
+
+
+class Command(BaseCommand):
+    help = 'Delete throttle windows that no rate limit reads any more'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        deleted = sweep(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} throttle windows'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = 'Copy the primary SQLite database into a replica alias, for trying out read routing locally'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='replica', help='Replica alias to overwrite')
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        if alias not in connections or alias == 'default':
+            raise CommandError(f'No replica database "{alias}" is configured (set SQLITE_REPLICA)')
+        primary, replica = connections['default'], connections[alias]
+        if primary.vendor != 'sqlite' or replica.vendor != 'sqlite':
+            raise CommandError('Only SQLite databases can be copied; use real replication elsewhere')
+        primary.ensure_connection()
+        replica.ensure_connection()
+        # The online backup API copies a consistent snapshot while the
+        # primary keeps serving writes.
+        primary.connection.backup(replica.connection)
+        self.stdout.write(self.style.SUCCESS(f'Copied {primary.settings_dict["NAME"]} into {replica.settings_dict["NAME"]}'))
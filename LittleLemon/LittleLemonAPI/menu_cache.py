@@ -0,0 +1,106 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+from .conditional import make_etag
+from .shared_cache import is_shared
+
+# Serialized menu pages are cached under the current menu version, so bumping
+# the version (on any MenuItem / Category write) orphans every cached page at
+# once. Like the role and token caches this needs a cache shared by every
+# process: with a per-process LocMemCache a write on one worker would leave
+# the other workers serving their old pages and ETags, so pages are then not
+# cached and lists fall back to ETags of the rendered page.
+VERSION_KEY = 'littlelemon:menu:version'
+HITS_KEY = 'littlelemon:menu:hits'
+MISSES_KEY = 'littlelemon:menu:misses'
+MODIFIED_KEY = 'littlelemon:menu:modified'
+
+
+def _alias():
+    return getattr(settings, 'MENU_CACHE_ALIAS', 'default')
+
+
+def _cache():
+    return caches[_alias()]
+
+
+def enabled():
+    return is_shared(_alias())
+
+
+def _incr(cache, key, delta=1):
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        # Missing (or evicted) key. Start a version from the clock so an
+        # eviction can never bring back pages cached under an older version.
+        initial = time.time_ns() if key == VERSION_KEY else delta
+        cache.add(key, initial, None)
+        return cache.get(key, initial)
+
+
+def menu_version():
+    cache = _cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = _incr(cache, VERSION_KEY, 0)
+    return version
+
+
+def bump_menu_version():
+    cache = _cache()
+    cache.set(MODIFIED_KEY, int(time.time()), None)
+    return _incr(cache, VERSION_KEY)
+
+
+def page_key(prefix, request):
+    params = sorted(request.query_params.lists())
+    digest = hashlib.md5(repr(params).encode()).hexdigest()
+    return f'littlelemon:menu:{menu_version()}:{prefix}:{digest}'
+
+
+def get_page(key):
+    cache = _cache()
+    data = cache.get(key)
+    _incr(cache, MISSES_KEY if data is None else HITS_KEY)
+    return data
+
+
+def set_page(key, data):
+    _cache().set(key, data, getattr(settings, 'MENU_CACHE_TIMEOUT', 600))
+
+
+def stats():
+    values = _cache().get_many([HITS_KEY, MISSES_KEY])
+    return {'hits': values.get(HITS_KEY, 0), 'misses': values.get(MISSES_KEY, 0)}
+
+
+def reset_stats():
+    _cache().delete_many([HITS_KEY, MISSES_KEY])
+
+
+class CachedMenuListMixin:
+    menu_cache_prefix = None
+
+    def get_list_validators(self, request):
+        # ETag / Last-Modified for ConditionalListMixin. The menu version
+        # changes with every write the page renders, so it is the validator
+        # and a revalidation costs no queries.
+        if not enabled():
+            return super().get_list_validators(request)
+        values = _cache().get_many([VERSION_KEY, MODIFIED_KEY])
+        version = values.get(VERSION_KEY) or menu_version()
+        etag = make_etag(request, self.menu_cache_prefix, version, sorted(request.query_params.lists()))
+        return etag, values.get(MODIFIED_KEY)
+
+    def list(self, request, *args, **kwargs):
+        if not enabled():
+            return super().list(request, *args, **kwargs)
+        key = page_key(self.menu_cache_prefix, request)
+        data = get_page(key)
+        if data is None:
+            data = super().list(request, *args, **kwargs).data
+            set_page(key, data)
+        return Response(data)
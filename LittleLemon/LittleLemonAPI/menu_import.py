@@ -0,0 +1,132 @@
+import csv
+import io
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from .menu_cache import bump_menu_version
+from .models import Category, MenuItem
+from .search import get_backend as search_backend
+from .serializers import MenuItemImportSerializer
+
+# Bulk menu import shared by the API endpoint and `manage.py import_menu`.
+# Rows are validated field by field without touching the database, then
+# category existence, update targets and title/price/category uniqueness are
+# checked for the whole batch with one query each. Everything is written with
+# bulk_create/bulk_update in one transaction. Bulk writes skip model signals,
+# so the search index, updated_at and the menu cache version are maintained
+# here instead.
+
+UNIQUE_MESSAGE = 'The fields title, price, category_id must make a unique set.'
+FIELDS = ('title', 'price', 'featured', 'category_id')
+
+
+def max_rows():
+    return getattr(settings, 'MENU_IMPORT_MAX_ROWS', 5000)
+
+
+def parse_csv(text):
+    # Blank cells count as missing, so an empty id column means "create".
+    return [
+        {key.strip(): value.strip() for key, value in row.items() if key and value and value.strip()}
+        for row in csv.DictReader(io.StringIO(text))
+    ]
+
+
+def _validate_rows(rows, errors):
+    create = MenuItemImportSerializer()
+    update = MenuItemImportSerializer(partial=True)
+    cleaned = {}
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            errors[index] = {'non_field_errors': ['Expected an object']}
+            continue
+        serializer = update if row.get('id') not in (None, '') else create
+        try:
+            cleaned[index] = serializer.run_validation(row)
+        except ValidationError as exc:
+            errors[index] = exc.detail
+    return cleaned
+
+
+def _check_batch(cleaned, errors):
+    # Set-based checks. Returns the items being updated, by id.
+    def reject(index, field, message):
+        errors.setdefault(index, {}).setdefault(field, []).append(message)
+        cleaned.pop(index, None)
+
+    seen_ids = set()
+    for index, data in list(cleaned.items()):
+        if 'id' in data:
+            if data['id'] in seen_ids:
+                reject(index, 'id', 'Menu item appears more than once in this batch')
+            seen_ids.add(data['id'])
+    existing = MenuItem.objects.in_bulk(seen_ids) if seen_ids else {}
+    for index, data in list(cleaned.items()):
+        if 'id' in data:
+            if data['id'] not in existing:
+                reject(index, 'id', 'Menu item does not exist')
+            else:
+                item = existing[data['id']]
+                cleaned[index] = {**{field: getattr(item, field) for field in FIELDS}, **data}
+
+    category_ids = {data['category_id'] for data in cleaned.values()}
+    categories = set(Category.objects.filter(id__in=category_ids).values_list('id', flat=True)) if category_ids else set()
+    for index, data in list(cleaned.items()):
+        if data['category_id'] not in categories:
+            reject(index, 'category_id', 'Category does not exist')
+
+    # Uniqueness against the batch itself and against every stored item that
+    # this batch does not rewrite.
+    keys = {}
+    for index, data in cleaned.items():
+        keys.setdefault((data['title'], data['price'], data['category_id']), []).append(index)
+    stored = set()
+    titles = {key[0] for key in keys}
+    if titles:
+        stored = set(
+            MenuItem.objects.filter(title__in=titles).exclude(id__in=seen_ids)
+            .values_list('title', 'price', 'category_id')
+        )
+    for key, indexes in keys.items():
+        if len(indexes) > 1 or key in stored:
+            for index in indexes:
+                reject(index, 'non_field_errors', UNIQUE_MESSAGE)
+    return existing
+
+
+def import_menu_items(rows, skip_invalid=False):
+    # Returns a report with the created and updated ids and the errors per
+    # row (numbered from 1). Unless skip_invalid is set, any error means
+    # nothing is written.
+    errors = {}
+    cleaned = _validate_rows(rows, errors)
+    existing = _check_batch(cleaned, errors)
+    report = {
+        'created': [],
+        'updated': [],
+        'errors': [{'row': index + 1, 'errors': errors[index]} for index in sorted(errors)],
+    }
+    if (errors and not skip_invalid) or not cleaned:
+        return report
+
+    now = timezone.now()
+    created = []
+    updated = []
+    for data in cleaned.values():
+        if 'id' in data:
+            item = existing[data['id']]
+            for field in FIELDS:
+                setattr(item, field, data[field])
+            item.updated_at = now
+            updated.append(item)
+        else:
+            created.append(MenuItem(**data))
+    with transaction.atomic():
+        MenuItem.objects.bulk_create(created, batch_size=500)
+        MenuItem.objects.bulk_update(updated, ['title', 'price', 'featured', 'category', 'updated_at'], batch_size=500)
+        search_backend().index([item.pk for item in created + updated])
+    bump_menu_version()
+    report['created'] = [item.pk for item in created]
+    report['updated'] = [item.pk for item in updated]
+    return report
@@ -0,0 +1,138 @@
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+# Per-request SQL / view / render timings, reported in a
+# Server-Timing header and aggregated per route for the staff stats endpoint.
+# With REQUEST_METRICS['ENABLED'] off the middleware removes itself from the
+# chain at startup, so it costs nothing; SAMPLE_RATE measures only a fraction
+# of requests in production.
+
+
+def metrics_config():
+    return {'ENABLED': False, 'SAMPLE_RATE': 1.0, 'WINDOW': 500, **getattr(settings, 'REQUEST_METRICS', {})}
+
+
+class RouteStats:
+    def __init__(self, window):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(lambda: deque(maxlen=window))
+
+    def add(self, route, sample):
+        with self.lock:
+            self.samples[route].append(sample)
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+
+    def report(self):
+        with self.lock:
+            snapshot = {route: list(samples) for route, samples in self.samples.items()}
+        report = {}
+        for route, samples in sorted(snapshot.items()):
+            totals = sorted(sample['total'] for sample in samples)
+            count = len(samples)
+            report[route] = {
+                'count': count,
+                'p50_ms': round(totals[count // 2], 3),
+                'p99_ms': round(totals[min(count - 1, int(count * 0.99))], 3),
+                **{
+                    f'mean_{name}': round(sum(sample[name] for sample in samples) / count, 3)
+                    for name in ('queries', 'sql_ms', 'view_ms', 'render_ms')
+                },
+            }
+        return report
+
+
+stats = RouteStats(metrics_config()['WINDOW'])
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.sql = 0.0
+        self.sql_at_view_start = 0.0
+        self.sql_at_view_end = None
+        self.view_start = None
+        self.view_end = None
+        self.render_end = None
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql += time.perf_counter() - started
+            self.queries += 1
+
+    def view_finished(self):
+        self.view_end = time.perf_counter()
+        self.sql_at_view_end = self.sql
+
+    def rendered(self, response):
+        self.render_end = time.perf_counter()
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, get_response):
+        config = metrics_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = config['SAMPLE_RATE']
+
+    def __call__(self, request):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        metrics = request._request_metrics = RequestMetrics()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(metrics.record_query))
+            response = self.get_response(request)
+        finished = time.perf_counter()
+
+        view_start = metrics.view_start or started
+        view_end = metrics.view_end or finished
+        sql_at_view_end = metrics.sql if metrics.sql_at_view_end is None else metrics.sql_at_view_end
+        sql_in_view = sql_at_view_end - metrics.sql_at_view_start
+        sample = {
+            'total': (finished - started) * 1000,
+            'queries': metrics.queries,
+            'sql_ms': metrics.sql * 1000,
+            # Time spent in the view outside SQL: authentication, throttling,
+            # permissions, pagination and serializer output alike.
+            'view_ms': max(view_end - view_start - sql_in_view, 0) * 1000,
+            'render_ms': ((metrics.render_end or view_end) - view_end) * 1000,
+        }
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={sample["sql_ms"]:.2f};desc="{metrics.queries} queries"',
+            f'view;dur={sample["view_ms"]:.2f}',
+            f'render;dur={sample["render_ms"]:.2f}',
+            f'total;dur={sample["total"]:.2f}',
+        ])
+        match = request.resolver_match
+        if match is not None:
+            stats.add(f'{request.method} {match.route}', sample)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = getattr(request, '_request_metrics', None)
+        if metrics is not None:
+            metrics.view_start = time.perf_counter()
+            metrics.sql_at_view_start = metrics.sql
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after this hook returns.
+        metrics = getattr(request, '_request_metrics', None)
+        if metrics is not None:
+            metrics.view_finished()
+            response.add_post_render_callback(metrics.rendered)
+        return response
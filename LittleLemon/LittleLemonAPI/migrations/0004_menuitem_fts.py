@@ -0,0 +1,39 @@
+from django.db import migrations
+
+FTS_TABLE = 'LittleLemonAPI_menuitem_fts'
+
+
+def create_fts_table(apps, schema_editor):
+    # Without FTS5 the search backend falls back to LIKE filtering.
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        if 'ENABLE_FTS5' not in {row[0] for row in cursor.fetchall()}:
+            return
+    schema_editor.execute(
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS "{FTS_TABLE}" USING fts5('
+        "title, category, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    schema_editor.execute(
+        f'INSERT INTO "{FTS_TABLE}" (rowid, title, category) '
+        'SELECT m.id, m.title, c.title FROM "LittleLemonAPI_menuitem" m '
+        'JOIN "LittleLemonAPI_category" c ON c.id = m.category_id'
+    )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS "{FTS_TABLE}"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0003_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0004_menuitem_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThrottleWindow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255)),
+                ('window', models.BigIntegerField()),
+                ('hits', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('key', 'window')},
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:51
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0007_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='snapshot',
+            field=models.JSONField(blank=True, editable=False, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='snapshot_version',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0009_order_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='throttlewindow',
+            name='expires_at',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:23
+
+from django.db import migrations, models
+
+
+def create_lock(apps, schema_editor):
+    apps.get_model('LittleLemonAPI', 'DispatchLock').objects.create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0010_throttlewindow_expires_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DispatchLock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_run_at', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.RunPython(create_lock, migrations.RunPython.noop),
+    ]
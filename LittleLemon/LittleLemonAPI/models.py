@@ -1,10 +1,12 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 
 # Create your models here.
 class Category(models.Model):
     slug = models.SlugField()
     title = models.CharField(max_length=25,db_index=True)
+    updated_at = models.DateTimeField(auto_now=True,db_index=True)
 
     def __str__(self):
         return f'Category: {self.title}'
@@ -14,6 +16,7 @@ class MenuItem(models.Model):
     price = models.DecimalField(max_digits=6,decimal_places=2,db_index=True)
     featured = models.BooleanField(db_index=True)
     category = models.ForeignKey(Category,on_delete=models.PROTECT)
+    updated_at = models.DateTimeField(auto_now=True,db_index=True)
 
     def __str__(self):
         return f'Item: {self.title} from {self.category.title} category'
@@ -31,12 +34,37 @@ class Cart(models.Model):
     def __str__(self):
         return f'{self.user.username} added Item: {self.menuitem.title} from {self.menuitem.category.title} category'
 
+class OrderQuerySet(models.QuerySet):
+    def with_details(self):
+        # Everything OrderSerializer renders, in a fixed number of queries.
+        return self.select_related('user','delivery_crew').prefetch_related(
+            models.Prefetch('order_items', queryset=OrderItem.objects.select_related('menuitem').order_by('id'))
+        )
+
 class Order(models.Model):
     user = models.ForeignKey(User,on_delete=models.CASCADE)
     delivery_crew = models.ForeignKey(User,on_delete=models.SET_NULL,related_name='delivery_crew',null=True)
     status = models.BooleanField(db_index=True,default=False)
     total = models.DecimalField(max_digits=6,decimal_places=2)
     date = models.DateTimeField(db_index=True)
+    updated_at = models.DateTimeField(auto_now=True,db_index=True)
+    # OrderSerializer's output for this order, written at checkout by
+    # snapshots.py so reads skip the item, menu item and user joins. Rows whose
+    # snapshot_version isn't SNAPSHOT_VERSION are rendered from the joins.
+    snapshot = models.JSONField(null=True,blank=True,editable=False,encoder=DjangoJSONEncoder)
+    snapshot_version = models.PositiveSmallIntegerField(default=0,editable=False)
+
+    SNAPSHOT_VERSION = 1
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        # Keyset pagination of a customer's or crew member's orders seeks on
+        # (owner, date, id). The manager listing uses the plain date index.
+        indexes = [
+            models.Index(fields=['user','date','id']),
+            models.Index(fields=['delivery_crew','date','id']),
+        ]
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order,on_delete=models.CASCADE,related_name='order_items')
@@ -46,4 +74,91 @@ class OrderItem(models.Model):
     price = models.DecimalField(max_digits=6,decimal_places=2)
 
     class Meta:
-        unique_together = ('order','menuitem')
\ No newline at end of file
+        unique_together = ('order','menuitem')
+
+class ThrottleWindow(models.Model):
+    # Request counter for one throttle key in one fixed window; the sliding
+    # window estimate only ever reads the current and previous window.
+    # expires_at (Unix time) is when the window stops being the previous one,
+    # whatever the throttle's duration; the sweeper deletes rows past it.
+    key = models.CharField(max_length=255)
+    window = models.BigIntegerField()
+    hits = models.PositiveIntegerField(default=0)
+    expires_at = models.BigIntegerField(default=0,db_index=True)
+
+    class Meta:
+        unique_together = ('key','window')
+
+# Daily rollups for the manager analytics endpoints, kept up to date
+# incrementally by rollups.py and rebuilt by `manage.py rebuild_rollups`.
+class DailySales(models.Model):
+    day = models.DateField(unique=True)
+    orders = models.IntegerField(default=0)
+    delivered = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12,decimal_places=2,default=0)
+
+class DailyItemSales(models.Model):
+    day = models.DateField()
+    menuitem = models.ForeignKey(MenuItem,on_delete=models.CASCADE)
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12,decimal_places=2,default=0)
+
+    class Meta:
+        unique_together = ('day','menuitem')
+
+class DailyCrewDeliveries(models.Model):
+    day = models.DateField()
+    delivery_crew = models.ForeignKey(User,on_delete=models.CASCADE,related_name='+')
+    assigned = models.IntegerField(default=0)
+    delivered = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('day','delivery_crew')
+
+class IdempotencyKey(models.Model):
+    # A POST made with an Idempotency-Key header. status_code stays null while
+    # the first request is still running; afterwards the response is replayed
+    # for repeats until the sweeper removes the key.
+    user = models.ForeignKey(User,on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True,encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('user','key')
+
+# Delivered orders moved out of Order/OrderItem by archive.py once they are
+# old enough, keeping their ids. The columns match the hot tables, so the
+# same row mappers and snapshots serve both.
+class ArchivedOrder(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User,on_delete=models.CASCADE,related_name='+')
+    delivery_crew = models.ForeignKey(User,on_delete=models.SET_NULL,related_name='+',null=True)
+    status = models.BooleanField(default=True)
+    total = models.DecimalField(max_digits=6,decimal_places=2)
+    date = models.DateTimeField(db_index=True)
+    updated_at = models.DateTimeField()
+    snapshot = models.JSONField(null=True,encoder=DjangoJSONEncoder)
+    snapshot_version = models.PositiveSmallIntegerField(default=0)
+    archived_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user','date','id']),
+            models.Index(fields=['delivery_crew','date','id']),
+        ]
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder,on_delete=models.CASCADE,related_name='order_items')
+    menuitem = models.ForeignKey(MenuItem,on_delete=models.CASCADE,related_name='+')
+    quantity = models.SmallIntegerField()
+    unit_price = models.DecimalField(max_digits=6,decimal_places=2)
+    price = models.DecimalField(max_digits=6,decimal_places=2)
+
+class DispatchLock(models.Model):
+    # Single row that dispatch.run() updates before anything else, so runs
+    # from any number of processes take turns on every database backend.
+    last_run_at = models.DateTimeField(null=True)
@@ -0,0 +1,84 @@
+from django.utils.module_loading import import_string
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+#region JSON
+
+# Same bytes as DRF's JSONRenderer for its default settings (compact, UTF-8),
+# produced by orjson when it is installed. Datetimes are passed through to
+# DRF's encoder so they keep its format ('Z' suffix, full microseconds), and
+# Decimal becomes a float exactly like there. Indented output (the browsable
+# API, '; indent=N') and non-default settings use the stdlib path.
+_ORJSON_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS) if orjson else 0
+_encoder = JSONEncoder()
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        if (
+            orjson is None
+            or not self.compact
+            or self.ensure_ascii
+            or self.get_indent(accepted_media_type, renderer_context) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=_encoder.default, option=_ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            # e.g. integers beyond 64 bits.
+            return super().render(data, accepted_media_type, renderer_context)
+        # Keep DRF's escaping of U+2028/U+2029 so the output stays valid JavaScript.
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+#endregion
+
+#region Lazy renderers
+
+class LazyRenderer(BaseRenderer):
+    # Stands in for a renderer whose module is only imported the first time
+    # content negotiation actually picks it. media_type, format and charset
+    # are declared here because negotiation reads them on every request.
+    renderer_path = None
+    _renderer_class = None
+
+    @classmethod
+    def renderer_class(cls):
+        if cls._renderer_class is None:
+            cls._renderer_class = import_string(cls.renderer_path)
+        return cls._renderer_class
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return self.renderer_class()().render(data, accepted_media_type, renderer_context)
+
+
+class LazyXMLRenderer(LazyRenderer):
+    renderer_path = 'rest_framework_xml.renderers.XMLRenderer'
+    media_type = 'application/xml'
+    format = 'xml'
+    charset = 'utf-8'
+
+
+class LazyCSVRenderer(LazyRenderer):
+    renderer_path = 'rest_framework_csv.renderers.CSVRenderer'
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+
+class LazyYAMLRenderer(LazyRenderer):
+    renderer_path = 'rest_framework_yaml.renderers.YAMLRenderer'
+    media_type = 'application/yaml'
+    format = 'yaml'
+    charset = 'utf-8'
+
+#endregion
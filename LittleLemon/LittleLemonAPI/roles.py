@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.core.cache import cache
+from . import shared_cache
+
+MANAGER = 'Manager'
+DELIVERY_CREW = 'Delivery Crew'
+
+# Group names are loaded once per request and memoised on the user object,
+# which DRF keeps for the whole request. ROLE_CACHE_TIMEOUT (seconds) enables
+# an extra cross-request cache keyed by user id; 0 disables it, and so does a
+# default cache that is not shared between processes (see shared_cache.py).
+_REQUEST_ATTR = '_littlelemon_roles'
+
+
+def _cache_key(user_id):
+    return f'littlelemon:roles:{user_id}'
+
+
+def _cache_timeout():
+    return getattr(settings, 'ROLE_CACHE_TIMEOUT', 0) if shared_cache.is_shared() else 0
+
+
+def get_roles(user):
+    if user is None or not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, _REQUEST_ATTR, None)
+    if roles is not None:
+        return roles
+    timeout = _cache_timeout()
+    if timeout:
+        roles = cache.get(_cache_key(user.pk))
+    if roles is None:
+        roles = frozenset(user.groups.values_list('name', flat=True))
+        if timeout:
+            cache.set(_cache_key(user.pk), roles, timeout)
+    setattr(user, _REQUEST_ATTR, roles)
+    return roles
+
+
+async def aget_roles(user):
+    # get_roles() for async views, using the async cache and ORM APIs.
+    if user is None or not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, _REQUEST_ATTR, None)
+    if roles is not None:
+        return roles
+    timeout = _cache_timeout()
+    if timeout:
+        roles = await cache.aget(_cache_key(user.pk))
+    if roles is None:
+        roles = frozenset([name async for name in user.groups.values_list('name', flat=True)])
+        if timeout:
+            await cache.aset(_cache_key(user.pk), roles, timeout)
+    setattr(user, _REQUEST_ATTR, roles)
+    return roles
+
+
+def prime_roles(user, roles):
+    # For callers that already hold the user's roles, e.g. the token cache.
+    setattr(user, _REQUEST_ATTR, frozenset(roles))
+
+
+def has_role(user, name):
+    return name in get_roles(user)
+
+
+def is_manager(user):
+    return has_role(user, MANAGER)
+
+
+def is_delivery_crew(user):
+    return has_role(user, DELIVERY_CREW)
+
+
+def invalidate_roles(*user_ids):
+    cache.delete_many([_cache_key(user_id) for user_id in user_ids])
+
+
+async def ais_manager(user):
+    return MANAGER in await aget_roles(user)
+
+
+async def ais_delivery_crew(user):
+    return DELIVERY_CREW in await aget_roles(user)
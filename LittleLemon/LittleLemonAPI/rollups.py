@@ -0,0 +1,189 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db import connection, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import ArchivedOrder, ArchivedOrderItem, DailyCrewDeliveries, DailyItemSales, DailySales, Order, OrderItem
+
+# Daily sales, item sales and per-crew delivery counts. Every change is an
+# additive delta applied with a single INSERT ... ON CONFLICT DO UPDATE per
+# table, so concurrent checkouts never lose an increment. signals.py feeds
+# order creates, updates and deletes in here; checkout adds the item lines
+# it bulk-creates. Anything that writes orders around the ORM (bulk_create,
+# queryset.update()) should be followed by rebuild().
+
+_CENTS = Decimal('0.01')
+_status_field = Order._meta.get_field('status')
+
+#region Deltas
+
+def order_state(order):
+    # What an order contributes to the rollups, as last loaded or saved.
+    # Deferred fields are missing from __dict__; such an order can't be diffed.
+    # status may still be the raw value a view assigned ('0', 'false').
+    values = order.__dict__
+    if any(name not in values for name in ('date', 'delivery_crew_id', 'status', 'total')) or values['date'] is None:
+        return None
+    return values['date'], values['delivery_crew_id'], _status_field.to_python(values['status']), values['total'] or 0
+
+
+def _add(model, keys, deltas, rows):
+    if not rows:
+        return
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(column) for column in keys + deltas)
+    updates = ', '.join(f'{quote(column)} = {quote(column)} + excluded.{quote(column)}' for column in deltas)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {quote(model._meta.db_table)} ({columns}) VALUES ({", ".join(["%s"] * (len(keys) + len(deltas)))}) '
+            f'ON CONFLICT ({", ".join(quote(key) for key in keys)}) DO UPDATE SET {updates}',
+            [(connection.ops.adapt_datefield_value(row[0]), *row[1:]) for row in rows],
+        )
+
+
+def apply_order_changes(changes):
+    # `changes` is a list of (state, sign) pairs. Opposite changes to the same
+    # day cancel out before anything is written.
+    sales = defaultdict(lambda: [0, 0, Decimal(0)])
+    crews = defaultdict(lambda: [0, 0])
+    for (date, crew_id, delivered, total), sign in changes:
+        day = timezone.localdate(date)
+        sales[day][0] += sign
+        sales[day][1] += sign * delivered
+        sales[day][2] += sign * Decimal(total)
+        if crew_id is not None:
+            crews[day, crew_id][0] += sign
+            crews[day, crew_id][1] += sign * delivered
+    _add(DailySales, ['day'], ['orders', 'delivered', 'revenue'],
+         [(day, *delta) for day, delta in sales.items() if any(delta)])
+    _add(DailyCrewDeliveries, ['day', 'delivery_crew_id'], ['assigned', 'delivered'],
+         [(*key, *delta) for key, delta in crews.items() if any(delta)])
+
+
+def record_order_saved(old, new, created):
+    if new is None:
+        return
+    if created:
+        apply_order_changes([(new, 1)])
+    elif old is not None and old != new:
+        apply_order_changes([(old, -1), (new, 1)])
+
+
+def record_items(date, lines, sign=1):
+    # `lines` are dicts with menuitem_id, quantity and price.
+    items = defaultdict(lambda: [0, Decimal(0)])
+    for line in lines:
+        items[line['menuitem_id']][0] += sign * line['quantity']
+        items[line['menuitem_id']][1] += sign * Decimal(line['price'])
+    day = timezone.localdate(date)
+    _add(DailyItemSales, ['day', 'menuitem_id'], ['quantity', 'revenue'],
+         [(day, menuitem_id, *delta) for menuitem_id, delta in items.items()])
+
+
+def record_order_deleted(order, state):
+    if state is None:
+        return
+    apply_order_changes([(state, -1)])
+    record_items(state[0], OrderItem.objects.filter(order=order).values('menuitem_id', 'quantity', 'price'), -1)
+
+#endregion
+
+#region Rebuild
+
+def _aggregates(orders, items):
+    day = TruncDate('date', tzinfo=timezone.get_current_timezone())
+    item_day = TruncDate('order__date', tzinfo=timezone.get_current_timezone())
+    sales = orders.objects.annotate(day=day).values('day').annotate(
+        orders=Count('id'), delivered=Count('id', filter=Q(status=True)), revenue=Sum('total'),
+    ).order_by()
+    item_sales = items.objects.annotate(day=item_day).values('day', 'menuitem_id').annotate(
+        quantity=Sum('quantity'), revenue=Sum('price'),
+    ).order_by()
+    crews = orders.objects.filter(delivery_crew__isnull=False).annotate(day=day).values(
+        'day', 'delivery_crew_id',
+    ).annotate(assigned=Count('id'), delivered=Count('id', filter=Q(status=True))).order_by()
+    return (
+        (DailySales, ['day'], ['orders', 'delivered', 'revenue'], sales),
+        (DailyItemSales, ['day', 'menuitem_id'], ['quantity', 'revenue'], item_sales),
+        (DailyCrewDeliveries, ['day', 'delivery_crew_id'], ['assigned', 'delivered'], crews),
+    )
+
+
+def rebuild(batch_size=5000):
+    # Recomputes every rollup from the hot and archived orders in one
+    # transaction: the hot totals are inserted, the archived ones added on.
+    with transaction.atomic():
+        for model in (DailySales, DailyItemSales, DailyCrewDeliveries):
+            model.objects.all().delete()
+        for model, _, _, rows in _aggregates(Order, OrderItem):
+            batch = []
+            for row in rows.iterator(chunk_size=batch_size):
+                batch.append(model(**row))
+                if len(batch) >= batch_size:
+                    model.objects.bulk_create(batch)
+                    batch = []
+            model.objects.bulk_create(batch)
+        for model, keys, deltas, rows in _aggregates(ArchivedOrder, ArchivedOrderItem):
+            _add(model, keys, deltas, [
+                tuple(row[name] for name in keys + deltas) for row in rows.iterator(chunk_size=batch_size)
+            ])
+        return {model._meta.model_name: model.objects.count() for model in (DailySales, DailyItemSales, DailyCrewDeliveries)}
+
+#endregion
+
+#region Reports
+
+def _money(value):
+    return f'{Decimal(value or 0).quantize(_CENTS):f}'
+
+
+def _average(revenue, orders):
+    return _money(Decimal(revenue) / orders if orders else 0)
+
+
+def _days(queryset, start, end):
+    if start:
+        queryset = queryset.filter(day__gte=start)
+    if end:
+        queryset = queryset.filter(day__lte=end)
+    return queryset
+
+
+def revenue_report(start=None, end=None):
+    days = list(_days(DailySales.objects, start, end).order_by('day').values('day', 'orders', 'delivered', 'revenue'))
+    orders = sum(row['orders'] for row in days)
+    revenue = sum((row['revenue'] for row in days), Decimal(0))
+    return {
+        'orders': orders,
+        'revenue': _money(revenue),
+        'average_order_value': _average(revenue, orders),
+        'days': [
+            {**row, 'revenue': _money(row['revenue']), 'average_order_value': _average(row['revenue'], row['orders'])}
+            for row in days
+        ],
+    }
+
+
+def top_items_report(start=None, end=None, limit=10):
+    rows = (
+        _days(DailyItemSales.objects, start, end)
+        .values('menuitem_id', title=F('menuitem__title'))
+        .annotate(quantity=Sum('quantity'), revenue=Sum('revenue'))
+        .filter(quantity__gt=0)
+        .order_by('-quantity', '-revenue', 'menuitem_id')[:limit]
+    )
+    return [{**row, 'revenue': _money(row['revenue'])} for row in rows]
+
+
+def crew_report(start=None, end=None):
+    rows = (
+        _days(DailyCrewDeliveries.objects, start, end)
+        .values('delivery_crew_id', username=F('delivery_crew__username'))
+        .annotate(assigned=Sum('assigned'), delivered=Sum('delivered'))
+        .filter(assigned__gt=0)
+        .order_by('-delivered', 'delivery_crew_id')
+    )
+    return list(rows)
+
+#endregion
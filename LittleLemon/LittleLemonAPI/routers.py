@@ -0,0 +1,95 @@
+import random
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+from .shared_cache import is_shared
+
+# Primary / replica routing. Every write goes to the primary ('default').
+# Reads go to one of READ_REPLICAS only while a view using
+# ReplicaRoutingMixin handles a safe request, so background jobs, commands
+# and everything outside those views keep reading the primary. A successful
+# write through one of the mixin's views pins that user's reads to the
+# primary for REPLICA_STICKY_SECONDS, so they see their own cart and order
+# changes even while the replicas lag behind. The pin is a user-id keyed
+# entry in the cache when that is shared by every worker, which also covers
+# token clients that drop cookies, plus a signed cookie that travels with
+# the client and is the only pin with a per-process cache.
+
+_read_alias = ContextVar('littlelemon_read_alias', default=None)
+
+STICKY_COOKIE = 'littlelemon_primary'
+_STICKY_SALT = 'LittleLemonAPI.routers.sticky'
+
+
+def _sticky_key(user_id):
+    return f'littlelemon:primary:{user_id}'
+
+
+def replicas():
+    return getattr(settings, 'READ_REPLICAS', [])
+
+
+def _sticky_seconds():
+    return getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+
+
+def mark_sticky(request, response):
+    timeout = _sticky_seconds()
+    if timeout and replicas() and request.user.is_authenticated:
+        if is_shared():
+            cache.set(_sticky_key(request.user.pk), True, timeout)
+        response.set_signed_cookie(STICKY_COOKIE, str(request.user.pk), salt=_STICKY_SALT,
+                                   max_age=timeout, httponly=True, samesite='Lax')
+
+
+def is_sticky(request):
+    # The timestamp signer rejects cookies older than the timeout, whatever
+    # the client does with max_age.
+    if not request.user.is_authenticated:
+        return False
+    user_id = request.get_signed_cookie(STICKY_COOKIE, default=None, salt=_STICKY_SALT, max_age=_sticky_seconds())
+    if user_id == str(request.user.pk):
+        return True
+    return is_shared() and cache.get(_sticky_key(request.user.pk), False)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaRoutingMixin:
+    # replica_reads = False only keeps the stickiness, for views whose reads
+    # must see the primary (e.g. the cart).
+    replica_reads = True
+
+    def dispatch(self, request, *args, **kwargs):
+        token = _read_alias.set(None)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            _read_alias.reset(token)
+
+    def initial(self, request, *args, **kwargs):
+        # Runs after authentication and permission checks.
+        super().initial(request, *args, **kwargs)
+        if self.replica_reads and request.method in SAFE_METHODS and replicas() and not is_sticky(request):
+            _read_alias.set(random.choice(replicas()))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            mark_sticky(request, response)
+        return response
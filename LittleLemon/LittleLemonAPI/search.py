@@ -0,0 +1,146 @@
+import re
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Case, IntegerField, Q, When
+from django.utils.module_loading import import_string
+from rest_framework.filters import SearchFilter
+from .models import MenuItem
+
+FTS_TABLE = 'LittleLemonAPI_menuitem_fts'
+
+FTS_CREATE_SQL = (
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS "{FTS_TABLE}" USING fts5('
+    "title, category, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+)
+FTS_POPULATE_SQL = (
+    f'INSERT INTO "{FTS_TABLE}" (rowid, title, category) '
+    'SELECT m.id, m.title, c.title FROM "LittleLemonAPI_menuitem" m '
+    'JOIN "LittleLemonAPI_category" c ON c.id = m.category_id'
+)
+
+
+def fts5_supported(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return 'ENABLE_FTS5' in {row[0] for row in cursor.fetchall()}
+
+
+class SearchBackend:
+    # Interface for menu search backends. search() returns menu item ids
+    # best match first, or None when the backend cannot answer and the
+    # caller should fall back to a plain LIKE filter.
+
+    def search(self, query, limit):
+        raise NotImplementedError
+
+    def index(self, item_ids):
+        pass
+
+    def index_category(self, category_id):
+        pass
+
+    def remove(self, item_ids):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class LikeSearchBackend(SearchBackend):
+    def search(self, query, limit):
+        return None
+
+
+class SQLiteFTSBackend(SearchBackend):
+    def __init__(self):
+        self.alias = router.db_for_write(MenuItem)
+        self._available = None
+
+    @property
+    def connection(self):
+        # Looked up per call: connections are per thread, the backend is not.
+        return connections[self.alias]
+
+    def available(self):
+        if self._available is None:
+            self._available = FTS_TABLE in self.connection.introspection.table_names()
+        return self._available
+
+    def match_expression(self, query):
+        # Every term must match (in either column) and each term is a prefix,
+        # so "chick sal" finds "Chicken salad".
+        terms = re.findall(r'\w+', query)
+        return ' '.join('"%s"*' % term for term in terms)
+
+    def search(self, query, limit):
+        expression = self.match_expression(query)
+        if not self.available() or not expression:
+            return None
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM "{FTS_TABLE}" WHERE "{FTS_TABLE}" MATCH %s ORDER BY rank LIMIT %s',
+                [expression, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def index(self, item_ids):
+        if not self.available() or not item_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(item_ids))
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM "{FTS_TABLE}" WHERE rowid IN ({placeholders})', list(item_ids))
+            cursor.execute(f'{FTS_POPULATE_SQL} WHERE m.id IN ({placeholders})', list(item_ids))
+
+    def index_category(self, category_id):
+        self.index(list(MenuItem.objects.filter(category_id=category_id).values_list('id', flat=True)))
+
+    def remove(self, item_ids):
+        if not self.available() or not item_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(item_ids))
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM "{FTS_TABLE}" WHERE rowid IN ({placeholders})', list(item_ids))
+
+    def rebuild(self):
+        if not fts5_supported(self.connection):
+            return
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS "{FTS_TABLE}"')
+            cursor.execute(FTS_CREATE_SQL)
+            cursor.execute(FTS_POPULATE_SQL)
+        self._available = True
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'MENU_SEARCH_BACKEND', 'LittleLemonAPI.search.SQLiteFTSBackend')
+        _backend = import_string(path)()
+    return _backend
+
+
+def search_menu_items(queryset, query, ranked=True):
+    ids = get_backend().search(query, getattr(settings, 'MENU_SEARCH_LIMIT', 1000))
+    if ids is None:
+        for term in re.findall(r'\w+', query):
+            queryset = queryset.filter(Q(title__icontains=term) | Q(category__title__icontains=term))
+        return queryset
+    queryset = queryset.filter(pk__in=ids)
+    if ranked and ids:
+        rank = Case(*[When(pk=pk, then=position) for position, pk in enumerate(ids)], output_field=IntegerField())
+        queryset = queryset.order_by(rank)
+    return queryset
+
+
+class MenuSearchFilter(SearchFilter):
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        ranked = not request.query_params.get('ordering')
+        return search_menu_items(queryset, ' '.join(terms), ranked=ranked)
@@ -31,6 +31,20 @@ class MenuItemSerializer(serializers.ModelSerializer):
 
     # def CalculateTax(self, product : MenuItem):
     #     return round(product.price * Decimal(1.12),2)
+
+class MenuItemImportSerializer(serializers.ModelSerializer):
+    # One row of a bulk import; rows with an id update that item. Uniqueness
+    # and category existence are checked for the whole batch at once in
+    # menu_import.py, so there are no per-row validators hitting the database.
+    id = serializers.IntegerField(required=False)
+    category_id = serializers.IntegerField()
+
+    class Meta:
+        model = MenuItem
+        fields = ['id', 'title', 'price', 'featured', 'category_id']
+        validators = []
+
+    validate_price = MenuItemSerializer.validate_price
     
 class GroupSerializer(serializers.ModelSerializer):  
         class Meta:
@@ -73,6 +87,30 @@ class CartSerializer(serializers.ModelSerializer):
         return attrs
     
 
+class CartLineSerializer(serializers.Serializer):
+    menuitem_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(max_value=32767)
+
+    validate_quantity = CartSerializer.validate_quantity
+
+class CartBatchSerializer(serializers.Serializer):
+    # Lines to add to (incrementing existing ones), lines whose quantity is
+    # replaced, and menu item ids to take out of the cart.
+    add = CartLineSerializer(many=True, required=False)
+    set = CartLineSerializer(many=True, required=False)
+    remove = serializers.ListField(child=serializers.IntegerField(), required=False)
+
+    def validate(self, attrs):
+        seen = set()
+        for name in ('add', 'set', 'remove'):
+            ids = [line['menuitem_id'] for line in attrs.get(name, [])] if name != 'remove' else attrs.get(name, [])
+            if seen.intersection(ids) or len(set(ids)) != len(ids):
+                raise serializers.ValidationError('Each menu item may appear only once per batch')
+            seen.update(ids)
+        if not seen:
+            raise serializers.ValidationError('Nothing to do')
+        return attrs
+
 
 class OrderItemSerializer(serializers.ModelSerializer):
     menuitem = SimpleItemSerializer(read_only=True)
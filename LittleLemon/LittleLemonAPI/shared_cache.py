@@ -0,0 +1,13 @@
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+# Cross-request entries that a signal must be able to invalidate everywhere
+# (cached roles and tokens) are only kept when the default cache is shared by
+# every server process: redis, memcached, the database cache, or the file
+# cache on a single host. LocMemCache lives inside one process, so a signal
+# handled by one worker would leave the other workers' copies in place.
+
+
+def is_shared(alias='default'):
+    return not isinstance(caches[alias], (LocMemCache, DummyCache))
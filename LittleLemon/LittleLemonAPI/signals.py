@@ -0,0 +1,140 @@
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_out
+from rest_framework.authtoken.models import Token
+from .authentication import invalidate_token, invalidate_user_tokens
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from .menu_cache import bump_menu_version
+from .models import ArchivedOrder, Category, MenuItem, Order, OrderItem
+from . import events, rollups, snapshots
+from .roles import invalidate_roles
+from .search import get_backend as search_backend
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def group_membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Fires for user.groups.add() as well as group.user_set.add(), which is
+    # what the manager / delivery crew views and the admin use.
+    if action not in ('post_add', 'post_remove', 'post_clear', 'pre_clear'):
+        return
+    if not reverse:
+        user_ids = [instance.pk]
+    elif action == 'pre_clear':
+        user_ids = list(instance.user_set.values_list('pk', flat=True))
+    else:
+        user_ids = list(pk_set or ())
+    if user_ids:
+        invalidate_roles(*user_ids)
+        invalidate_user_tokens(*user_ids)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver(post_init, sender=User)
+def remember_username(sender, instance, **kwargs):
+    instance._loaded_username = instance.__dict__.get('username')
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    # Covers deactivation as well as any other change to the cached user.
+    if not created:
+        invalidate_user_tokens(instance.pk)
+        if getattr(instance, '_loaded_username', None) not in (None, instance.username):
+            for model in (Order, ArchivedOrder):
+                snapshots.mark_stale(model.objects.filter(Q(user=instance) | Q(delivery_crew=instance)))
+    instance._loaded_username = instance.username
+
+
+@receiver(user_logged_out)
+def user_logged_out_handler(sender, user, **kwargs):
+    if user is not None:
+        invalidate_user_tokens(user.pk)
+
+
+@receiver(post_save, sender=MenuItem)
+@receiver(post_delete, sender=MenuItem)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def menu_changed(sender, **kwargs):
+    bump_menu_version()
+
+
+@receiver(post_init, sender=MenuItem)
+def remember_menu_item(sender, instance, **kwargs):
+    instance._loaded_rendered = (instance.__dict__.get('title'), instance.__dict__.get('price'))
+
+
+@receiver(post_save, sender=MenuItem)
+def menu_item_saved(sender, instance, created, **kwargs):
+    # Orders render the live title and price of their menu items, like
+    # OrderSerializer does.
+    rendered = (instance.title, instance.price)
+    loaded = getattr(instance, '_loaded_rendered', (None, None))
+    if not created and loaded[0] is not None and loaded != rendered:
+        for model in (Order, ArchivedOrder):
+            snapshots.mark_stale(model.objects.filter(order_items__menuitem=instance))
+    instance._loaded_rendered = rendered
+
+
+@receiver(post_save, sender=MenuItem)
+def index_menu_item(sender, instance, **kwargs):
+    search_backend().index([instance.pk])
+
+
+@receiver(post_delete, sender=MenuItem)
+def unindex_menu_item(sender, instance, **kwargs):
+    search_backend().remove([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def index_category(sender, instance, created, **kwargs):
+    if not created:
+        search_backend().index_category(instance.pk)
+
+
+@receiver(post_init, sender=Order)
+def remember_order_state(sender, instance, **kwargs):
+    instance._saved_state = rollups.order_state(instance)
+
+
+@receiver(pre_save, sender=Order)
+def refresh_order_snapshot(sender, instance, raw=False, **kwargs):
+    if not raw and not instance._state.adding:
+        snapshots.refresh_snapshot(instance)
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, created, **kwargs):
+    old = getattr(instance, '_saved_state', None)
+    state = rollups.order_state(instance)
+    rollups.record_order_saved(old, state, created)
+    if created:
+        events.publish_order_event('order.created', instance)
+    elif old is None or state is None or old[1:3] != state[1:3]:
+        events.publish_order_event('order.updated', instance, old[1] if old else None)
+    instance._saved_state = state
+
+
+@receiver(pre_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    # Before the cascade removes the items.
+    rollups.record_order_deleted(instance, getattr(instance, '_saved_state', None))
+
+
+@receiver(post_delete, sender=Order)
+def publish_order_deleted(sender, instance, **kwargs):
+    events.publish_order_event('order.deleted', instance)
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def order_item_changed(sender, instance, origin=None, **kwargs):
+    # Checkout bulk-creates items before writing the snapshot, so this only
+    # sees later edits. Items deleted along with their order don't matter.
+    if not isinstance(origin, Order):
+        snapshots.mark_stale(Order.objects.filter(pk=instance.order_id))
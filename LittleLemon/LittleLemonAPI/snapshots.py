@@ -0,0 +1,63 @@
+from django.utils import timezone
+from .fast_serializers import order_rows
+from .models import Order
+from .serializers import UserSerializer
+
+# Order snapshots: the exact JSON OrderSerializer renders, stored on the order
+# so list and detail reads come from the orders table alone. Status and
+# delivery crew changes patch the snapshot in the same UPDATE (signals.py).
+# Anything else that changes what the order renders (its items edited in the
+# admin, a renamed user, a menu item's new title or price) marks the snapshot
+# stale, and stale orders are rendered from the joins until `manage.py
+# backfill_order_snapshots` rewrites them, so both paths always match the
+# serializer. Bump Order.SNAPSHOT_VERSION whenever OrderSerializer's output
+# changes.
+
+_status_field = Order._meta.get_field('status')
+
+
+def write_snapshots(order_ids):
+    # Two reads for the whole batch and one bulk UPDATE. updated_at is left
+    # alone: the order itself did not change.
+    data = order_rows.serialize(order_rows.values(Order.objects.filter(pk__in=order_ids)))
+    orders = [Order(pk=order['id'], snapshot=order, snapshot_version=Order.SNAPSHOT_VERSION) for order in data]
+    Order.objects.bulk_update(orders, ['snapshot', 'snapshot_version'], batch_size=500)
+    return {order.pk: order.snapshot for order in orders}
+
+
+def refresh_snapshot(order):
+    # Status and crew, for an order about to be saved. Only loads the crew
+    # member when the crew changed.
+    if order.snapshot is None or order.snapshot_version != Order.SNAPSHOT_VERSION:
+        return
+    crew = order.snapshot['delivery_crew']
+    if (crew and crew['id']) != order.delivery_crew_id:
+        crew = UserSerializer(order.delivery_crew).data if order.delivery_crew_id else None
+    order.snapshot = {
+        **order.snapshot,
+        'delivery_crew': crew,
+        'status': 'Delivered' if _status_field.to_python(order.status) else 'Pending',
+    }
+
+
+def mark_stale(orders):
+    # Works for Order and ArchivedOrder querysets. The rendered order changed,
+    # so updated_at (what its ETag and Last-Modified come from) moves too.
+    return orders.update(snapshot_version=0, updated_at=timezone.now())
+
+
+def backfill(batch_size=1000, rebuild=False):
+    # Walks the orders by primary key a batch at a time; unless `rebuild` is
+    # set, only orders without a current snapshot are written. Returns how
+    # many were.
+    orders = Order.objects.order_by('pk')
+    if not rebuild:
+        orders = orders.exclude(snapshot_version=Order.SNAPSHOT_VERSION)
+    written = 0
+    last = 0
+    while True:
+        ids = list(orders.filter(pk__gt=last).values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return written
+        written += len(write_snapshots(ids))
+        last = ids[-1]
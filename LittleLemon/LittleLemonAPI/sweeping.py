@@ -0,0 +1,12 @@
+# Shared by the throttle window and idempotency key sweepers.
+
+
+def delete_in_batches(queryset, batch_size=1000):
+    # Deletes the rows of `queryset` a batch at a time, so no single statement
+    # holds the table for long. Returns how many went.
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += queryset.model.objects.filter(pk__in=ids).delete()[0]
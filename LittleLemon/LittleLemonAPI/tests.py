@@ -1,3 +1,1477 @@
-from django.test import TestCase
+from django.contrib.auth.models import User, Group
+from django.core.cache import cache
+from django.conf import settings
+from django.db import connection, connections
+import asyncio
+import io
+import csv
+import json
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework.views import APIView
+from django.utils import timezone
+from asgiref.sync import sync_to_async
+from .models import Cart, Category, MenuItem, Order, OrderItem, ThrottleWindow
+from .models import ArchivedOrder, ArchivedOrderItem, DailyCrewDeliveries, DailyItemSales, DailySales, DispatchLock, IdempotencyKey
+from . import archive, authentication, dispatch, events, rollups, routers, snapshots
+from .idempotency import fingerprint
+from . import benchmarks, menu_cache, middleware, throttles
+from .fast_serializers import cart_rows, menu_item_rows, order_rows, order_snapshot_rows
+from .serializers import CartSerializer, MenuItemSerializer, OrderSerializer
+from rest_framework.renderers import JSONRenderer
+from .renderers import FastJSONRenderer, LazyCSVRenderer
+from .search import get_backend as search_backend
+from .throttles import SharedUserRateThrottle
+from .roles import get_roles, is_manager, MANAGER, DELIVERY_CREW
 
 # Create your tests here.
+
+class NoThrottleMixin:
+    # Throttle bookkeeping adds its own queries; tests that count queries
+    # switch it off so they measure only the endpoint.
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.enterClassContext(mock.patch.object(APIView, 'throttle_classes', []))
+
+
+class SharedCacheMixin:
+    # Cross-request role and token caching needs a cache shared by every
+    # process; a file cache stands in for redis or memcached.
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        location = cls.enterClassContext(tempfile.TemporaryDirectory())
+        cls.enterClassContext(override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': location,
+        }}))
+
+
+class RolesTest(SharedCacheMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('tester', password='secret')
+        self.managers = Group.objects.create(name=MANAGER)
+        Group.objects.create(name=DELIVERY_CREW)
+
+    def fresh_user(self):
+        return User.objects.get(pk=self.user.pk)
+
+    def test_roles_loaded_once_per_request(self):
+        user = self.fresh_user()
+        with self.assertNumQueries(1):
+            self.assertFalse(is_manager(user))
+            self.assertFalse(is_manager(user))
+            self.assertEqual(get_roles(user), frozenset())
+
+    def test_cross_request_cache_invalidated_on_membership_change(self):
+        get_roles(self.fresh_user())
+        user = self.fresh_user()
+        with self.assertNumQueries(0):
+            get_roles(user)
+        self.managers.user_set.add(self.user)
+        self.assertTrue(is_manager(self.fresh_user()))
+        self.user.groups.clear()
+        self.assertFalse(is_manager(self.fresh_user()))
+
+    def test_process_local_cache_is_not_used_across_requests(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            get_roles(self.fresh_user())
+            user = self.fresh_user()
+            with self.assertNumQueries(1):
+                get_roles(user)
+
+    def test_manager_endpoints_invalidate_roles(self):
+        admin = User.objects.create_superuser('admin', password='secret')
+        client = APIClient()
+        client.force_authenticate(admin)
+        self.assertFalse(is_manager(self.fresh_user()))
+        client.post('/api/groups/manager/users', {'username': 'tester'})
+        self.assertTrue(is_manager(self.fresh_user()))
+        client.delete(f'/api/groups/manager/users/{self.user.pk}')
+        self.assertFalse(is_manager(self.fresh_user()))
+
+
+class OrderQueryCountTest(NoThrottleMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.manager = User.objects.create_user('manager', password='secret')
+        Group.objects.create(name=MANAGER).user_set.add(self.manager)
+        self.crew = User.objects.create_user('crew', password='secret')
+        self.customer = User.objects.create_user('customer', password='secret')
+        category = Category.objects.create(slug='mains', title='Mains')
+        self.items = [
+            MenuItem.objects.create(title=f'Dish {i}', price=5 + i, featured=False, category=category)
+            for i in range(5)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+
+    def add_orders(self, count, items_per_order):
+        for _ in range(count):
+            order = Order.objects.create(user=self.customer, delivery_crew=self.crew, total=10, date=timezone.now())
+            for item in self.items[:items_per_order]:
+                OrderItem.objects.create(order=order, menuitem=item, quantity=1, unit_price=item.price, price=item.price)
+
+    def count_queries(self, url):
+        cache.clear()
+        self.client.force_authenticate(User.objects.get(pk=self.manager.pk))
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(captured)
+
+    def test_order_list_query_count_is_constant(self):
+        self.add_orders(1, 1)
+        baseline = self.count_queries('/api/orders')
+        self.add_orders(10, 5)
+        self.assertEqual(self.count_queries('/api/orders'), baseline)
+        self.assertEqual(self.count_queries('/api/orders?page=2'), baseline)
+
+    def test_single_order_query_count_is_constant(self):
+        self.add_orders(1, 1)
+        small = Order.objects.get()
+        baseline = self.count_queries(f'/api/orders/{small.pk}')
+        self.add_orders(1, 5)
+        large = Order.objects.latest('id')
+        self.assertEqual(self.count_queries(f'/api/orders/{large.pk}'), baseline)
+
+
+class CheckoutTest(NoThrottleMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = User.objects.create_user('customer', password='secret')
+        category = Category.objects.create(slug='mains', title='Mains')
+        for i in range(20):
+            item = MenuItem.objects.create(title=f'Dish {i}', price=5, featured=False, category=category)
+            Cart.objects.create(user=self.customer, menuitem=item, quantity=2, unit_price=5, price=10)
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def test_checkout_moves_cart_into_one_order(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.post('/api/orders')
+        self.assertEqual(response.status_code, 201)
+        self.assertLess(len(captured), 15)
+        order = Order.objects.get()
+        self.assertEqual(order.total, 200)
+        self.assertEqual(order.order_items.count(), 20)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_second_submit_finds_empty_cart(self):
+        self.client.post('/api/orders')
+        response = self.client.post('/api/orders')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class MenuCacheTest(NoThrottleMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.manager = User.objects.create_user('manager', password='secret')
+        Group.objects.create(name=MANAGER).user_set.add(self.manager)
+        self.category = Category.objects.create(slug='mains', title='Mains')
+        MenuItem.objects.create(title='Soup', price=5, featured=False, category=self.category)
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+
+    def check_hits_and_invalidation(self):
+        menu_cache.reset_stats()
+        first = self.client.get('/api/menu-items?search=soup')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/menu-items?search=soup')
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(menu_cache.stats(), {'hits': 1, 'misses': 1})
+
+        item = first.json()['results'][0]
+        self.client.patch(f'/api/menu-items/{item["id"]}', {'title': 'Soup of the day'})
+        third = self.client.get('/api/menu-items?search=soup')
+        self.assertEqual(third.json()['results'][0]['title'], 'Soup of the day')
+        self.assertEqual(menu_cache.stats(), {'hits': 1, 'misses': 2})
+
+        self.category.title = 'Starters'
+        self.category.save()
+        self.assertEqual(self.client.get('/api/categories').json()['results'][0]['title'], 'Starters')
+
+    def test_locmem_backend_is_not_used(self):
+        # A per-process cache can't be invalidated on the other workers.
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.client.get('/api/menu-items')
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get('/api/menu-items')
+            self.assertTrue(captured)
+            self.assertTrue(response['ETag'].startswith('W/"'))
+            self.assertEqual(menu_cache.stats(), {'hits': 0, 'misses': 0})
+
+    def test_file_backend(self):
+        with tempfile.TemporaryDirectory() as location:
+            with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location,
+            }}):
+                self.check_hits_and_invalidation()
+
+    def check_workers(self, backend, location_b):
+        # Two cache instances standing in for two worker processes; the menu
+        # is changed through worker B after worker A served it.
+        with tempfile.TemporaryDirectory() as location:
+            with override_settings(CACHES={
+                'default': {'BACKEND': backend, 'LOCATION': location},
+                'worker_a': {'BACKEND': backend, 'LOCATION': location},
+                'worker_b': {'BACKEND': backend, 'LOCATION': location_b or location},
+            }):
+                with override_settings(MENU_CACHE_ALIAS='worker_a'):
+                    etag = self.client.get('/api/menu-items')['ETag']
+                    self.assertEqual(self.client.get('/api/menu-items', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+                with override_settings(MENU_CACHE_ALIAS='worker_b'):
+                    item = MenuItem.objects.get()
+                    item.title = 'Stew'
+                    item.save()
+                with override_settings(MENU_CACHE_ALIAS='worker_a'):
+                    response = self.client.get('/api/menu-items', HTTP_IF_NONE_MATCH=etag)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(response.json()['results'][0]['title'], 'Stew')
+
+    def test_shared_cache_across_workers(self):
+        self.check_workers('django.core.cache.backends.filebased.FileBasedCache', None)
+
+    def test_separate_locmem_caches_across_workers(self):
+        self.check_workers('django.core.cache.backends.locmem.LocMemCache', 'worker-b')
+
+
+class ConditionalGetTest(SharedCacheMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = User.objects.create_user('customer', password='secret')
+        self.category = Category.objects.create(slug='mains', title='Mains')
+        self.item = MenuItem.objects.create(title='Soup', price=5, featured=False, category=self.category)
+        self.order = Order.objects.create(user=self.customer, total=5, date=timezone.now())
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def assert_revalidates(self, url, change):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304
+        )
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_menu_items(self):
+        def change():
+            self.category.title = 'Starters'
+            self.category.save()
+        self.assert_revalidates('/api/menu-items', change)
+
+    def test_categories(self):
+        self.assert_revalidates('/api/categories', lambda: Category.objects.create(slug='sides', title='Sides'))
+
+    def test_single_order(self):
+        def change():
+            self.order.status = True
+            self.order.save()
+        self.assert_revalidates(f'/api/orders/{self.order.pk}', change)
+
+    def test_single_order_follows_renames(self):
+        url = f'/api/orders/{self.order.pk}'
+        etag = self.client.get(url)['ETag']
+        self.customer.username = 'renamed'
+        self.customer.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['user']['username'], 'renamed')
+
+    def test_order_list_follows_joined_rows(self):
+        # Renaming the customer changes the page without touching updated_at.
+        response = self.client.get('/api/orders')
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertEqual(self.client.get('/api/orders', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.customer.username = 'renamed'
+        self.customer.save()
+        response = self.client.get('/api/orders', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['user']['username'], 'renamed')
+
+    def test_lists_run_no_validator_queries(self):
+        for url in ('/api/menu-items?pagination=cursor', '/api/orders?pagination=cursor'):
+            self.client.get(url)
+            with CaptureQueriesContext(connection) as captured:
+                self.client.get(url)
+            self.assertFalse([query['sql'] for query in captured if 'COUNT(' in query['sql'] or 'MAX(' in query['sql']])
+
+    def test_menu_lists_without_a_shared_cache(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            response = self.client.get('/api/menu-items')
+            self.assertTrue(response['ETag'].startswith('W/"'))
+            self.assertEqual(self.client.get('/api/menu-items', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_etag_depends_on_format(self):
+        json_etag = self.client.get('/api/categories')['ETag']
+        self.assertNotEqual(self.client.get('/api/categories?format=yaml')['ETag'], json_etag)
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = User.objects.create_user('customer', password='secret')
+        now = timezone.now()
+        # Pairs of orders share a date so the id tie-breaker is exercised.
+        for i in range(9):
+            Order.objects.create(user=self.customer, total=5, date=now - timezone.timedelta(days=i // 2))
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def test_pages_follow_date_then_id_without_gaps(self):
+        expected = list(Order.objects.order_by('-date', '-id').values_list('id', flat=True))
+        seen = []
+        url = '/api/orders?pagination=cursor'
+        while url:
+            body = self.client.get(url).json()
+            self.assertNotIn('count', body)
+            seen += [order['id'] for order in body['results']]
+            url = body['next']
+        self.assertEqual(seen, expected)
+
+    def test_count_is_opt_in(self):
+        body = self.client.get('/api/orders?pagination=cursor&count=true').json()
+        self.assertEqual(body['count'], 9)
+        self.assertEqual(len(body['results']), 4)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/orders?cursor=bogus').status_code, 404)
+
+    def test_page_numbers_still_default(self):
+        body = self.client.get('/api/orders?page=3').json()
+        self.assertEqual(body['count'], 9)
+        self.assertEqual(len(body['results']), 1)
+
+
+class MenuSearchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('customer', password='secret')
+        self.salads = Category.objects.create(slug='salads', title='Salads')
+        mains = Category.objects.create(slug='mains', title='Mains')
+        self.greek = MenuItem.objects.create(title='Greek salad', price=6, featured=False, category=self.salads)
+        MenuItem.objects.create(title='Chicken salad', price=7, featured=False, category=mains)
+        MenuItem.objects.create(title='Chicken chicken soup', price=5, featured=False, category=mains)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, query):
+        body = self.client.get('/api/menu-items', {'search': query}).json()
+        return [item['title'] for item in body['results']]
+
+    def test_prefix_terms_and_ranking(self):
+        self.assertTrue(search_backend().available())
+        self.assertEqual(self.search('chick sal'), ['Chicken salad'])
+        self.assertEqual(self.search('chicken')[0], 'Chicken chicken soup')
+        self.assertEqual(sorted(self.search('salad')), ['Chicken salad', 'Greek salad'])
+
+    def test_index_follows_writes(self):
+        self.salads.title = 'Greens'
+        self.salads.save()
+        self.assertEqual(self.search('greens'), ['Greek salad'])
+        self.greek.delete()
+        self.assertEqual(self.search('greek'), [])
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM "LittleLemonAPI_menuitem_fts"')
+        self.assertEqual(self.search('soup'), [])
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(self.search('soup'), ['Chicken chicken soup'])
+
+    def test_backend_uses_the_calling_threads_connection(self):
+        backend = search_backend()
+        self.assertIs(backend.connection, connections['default'])
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(backend.connection))
+        thread.start()
+        thread.join()
+        self.assertIsNot(seen[0], connections['default'])
+
+
+class SlidingWindowThrottleTest(TestCase):
+    class Throttle(SharedUserRateThrottle):
+        rate = '3/minute'
+        now = 600.0
+
+        def timer(self):
+            return self.now
+
+    def setUp(self):
+        self.user = User.objects.create_user('customer', password='secret')
+        self.request = type('Request', (), {'user': self.user, 'META': {}})()
+
+    def check(self, at):
+        throttle = self.Throttle()
+        throttle.now = at
+        return throttle.allow_request(self.request, None), throttle
+
+    def test_limit_and_sliding_window(self):
+        self.assertEqual([self.check(610)[0] for _ in range(4)], [True, True, True, False])
+        allowed, throttle = self.check(615)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(throttle.wait(), 45 + 20)
+        # 30s into the next window half of the previous window still counts.
+        self.assertEqual([self.check(690)[0] for _ in range(3)], [True, False, False])
+        self.assertEqual(ThrottleWindow.objects.get(window=10).hits, 3)
+        self.assertEqual(ThrottleWindow.objects.get(window=11).hits, 1)
+
+    def test_old_windows_are_dropped(self):
+        self.check(610)
+        self.check(670)
+        self.check(730)
+        self.assertEqual(sorted(ThrottleWindow.objects.values_list('window', flat=True)), [11, 12])
+
+    def test_sweep_drops_windows_of_keys_that_never_return(self):
+        self.check(610)
+        self.assertEqual(ThrottleWindow.objects.get().expires_at, 720)
+        self.assertEqual(throttles.sweep(now=719), 0)
+        out = io.StringIO()
+        with mock.patch('LittleLemonAPI.throttles.time.time', return_value=721):
+            call_command('sweep_throttle_windows', '--batch-size', '1', stdout=out)
+        self.assertIn('Deleted 1 throttle windows', out.getvalue())
+        self.assertFalse(ThrottleWindow.objects.exists())
+
+
+class CachedTokenAuthenticationTest(SharedCacheMixin, NoThrottleMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('customer', password='secret')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_second_request_skips_token_and_role_queries(self):
+        self.client.get('/api/cart/menu-items')
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.client.get('/api/cart/menu-items').status_code, 200)
+        tables = ' '.join(query['sql'] for query in captured)
+        self.assertNotIn('authtoken_token', tables)
+        self.assertNotIn('auth_group', tables)
+
+    def test_logout_invalidates(self):
+        self.client.get('/api/cart/menu-items')
+        self.assertEqual(self.client.post('/api/token/logout/').status_code, 204)
+        self.assertEqual(self.client.get('/api/cart/menu-items').status_code, 401)
+
+    def test_deactivation_invalidates(self):
+        self.client.get('/api/cart/menu-items')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/cart/menu-items').status_code, 401)
+
+    def test_group_change_refreshes_roles(self):
+        self.assertEqual(self.client.get('/api/groups/manager/users').status_code, 403)
+        Group.objects.create(name=MANAGER).user_set.add(self.user)
+        self.assertEqual(self.client.get('/api/groups/manager/users').status_code, 200)
+
+    def test_only_ids_are_cached_and_is_active_is_checked(self):
+        self.client.get('/api/cart/menu-items')
+        user_id, roles = cache.get(authentication._cache_key(self.token.key))
+        self.assertEqual(user_id, self.user.pk)
+        # A deactivation whose signal only reached another process.
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get('/api/cart/menu-items').status_code, 401)
+
+    def test_process_local_cache_is_not_used(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.client.get('/api/cart/menu-items')
+            with CaptureQueriesContext(connection) as captured:
+                self.client.get('/api/cart/menu-items')
+        self.assertIn('authtoken_token', ' '.join(query['sql'] for query in captured))
+
+
+class BenchmarkSmokeTest(TestCase):
+    def test_every_endpoint_runs_against_a_tiny_dataset(self):
+        sizes = benchmarks.seed({
+            'categories': 2, 'menu_items': 20, 'managers': 1, 'crew': 2,
+            'customers': 3, 'cart_items': 2, 'orders': 30, 'items_per_order': 2,
+        }, batch_size=7)
+        self.assertEqual(Order.objects.count(), 30)
+        self.assertEqual(OrderItem.objects.count(), 60)
+        report = benchmarks.run(iterations=2, sizes=sizes)
+        self.assertEqual(len(report['endpoints']), len(benchmarks.ENDPOINTS))
+        self.assertEqual(benchmarks.uncovered_routes(report), [])
+        for name, result in report['endpoints'].items():
+            self.assertLess(result['status'], 400, name)
+            self.assertGreater(result['queries'], 0, name)
+        slower = {'endpoints': {name: {**result, 'p50_ms': result['p50_ms'] * 3 + 1}
+                                for name, result in report['endpoints'].items()}}
+        self.assertEqual(benchmarks.compare(report, report), [])
+        self.assertEqual(len(benchmarks.compare(report, slower)), len(report['endpoints']))
+
+
+
+class SQLiteProfileTest(TestCase):
+    def test_tuned_profile_is_applied_to_connections(self):
+        if settings.SQLITE_PROFILE != 'tuned':
+            self.skipTest('SQLITE_PROFILE is not tuned')
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 20000)
+@override_settings(REQUEST_METRICS={'ENABLED': True, 'SAMPLE_RATE': 1.0})
+class RequestMetricsTest(NoThrottleMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        middleware.stats.reset()
+        self.admin = User.objects.create_superuser('admin', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_server_timing_and_route_stats(self):
+        Category.objects.create(slug='mains', title='Mains')
+        response = self.client.get('/api/categories')
+        timing = response['Server-Timing']
+        for metric in ('db;dur=', 'queries"', 'view;dur=', 'render;dur=', 'total;dur='):
+            self.assertIn(metric, timing)
+        self.client.get('/api/categories')
+        report = self.client.get('/api/stats/requests').json()
+        self.assertTrue(report['enabled'])
+        self.assertEqual(report['endpoints']['GET api/categories']['count'], 2)
+
+    def test_stats_are_staff_only(self):
+        self.client.force_authenticate(User.objects.create_user('customer', password='secret'))
+        self.assertEqual(self.client.get('/api/stats/requests').status_code, 403)
+
+    @override_settings(REQUEST_METRICS={'ENABLED': False})
+    def test_disabled_middleware_is_not_loaded(self):
+        self.assertNotIn('Server-Timing', self.client.get('/api/categories'))
+
+
+class FastSerializerCompatibilityTest(TestCase):
+    def setUp(self):
+        customer = User.objects.create_user('customer', password='secret')
+        crew = User.objects.create_user('crew', password='secret')
+        categories = [Category.objects.create(slug=f'c{i}', title=f'Category {i}') for i in range(2)]
+        items = [
+            MenuItem.objects.create(title=f'Dish {i}', price=Decimal('2.00') + Decimal('1.55') * i, featured=i % 2 == 0,
+                                    category=categories[i % 2])
+            for i in range(4)
+        ]
+        for item in items[:3]:
+            Cart.objects.create(user=customer, menuitem=item, quantity=3, unit_price=item.price, price=item.price * 3)
+        for i in range(3):
+            order = Order.objects.create(
+                user=customer, delivery_crew=crew if i else None, status=i == 2, total='12.50',
+                date=timezone.now() - timezone.timedelta(days=i, microseconds=i * 1234),
+            )
+            for item in items[i:]:
+                OrderItem.objects.create(order=order, menuitem=item, quantity=2, unit_price=item.price, price=item.price * 2)
+
+    def assert_same_bytes(self, serializer_class, rows, queryset):
+        expected = JSONRenderer().render(serializer_class(queryset, many=True).data)
+        actual = JSONRenderer().render(rows.serialize(rows.values(queryset)))
+        self.assertEqual(actual, expected)
+
+    def test_menu_items(self):
+        self.assert_same_bytes(MenuItemSerializer, menu_item_rows, MenuItem.objects.order_by('id'))
+
+    def test_cart(self):
+        self.assert_same_bytes(CartSerializer, cart_rows, Cart.objects.order_by('id'))
+
+    def test_orders(self):
+        self.assert_same_bytes(OrderSerializer, order_rows, Order.objects.with_details().order_by('-date', '-id'))
+
+    def test_order_snapshots(self):
+        self.assertEqual(snapshots.backfill(batch_size=2), 3)
+        snapshots.mark_stale(Order.objects.filter(status=True))
+        self.assert_same_bytes(OrderSerializer, order_snapshot_rows, Order.objects.with_details().order_by('-date', '-id'))
+
+
+class FastJSONRendererTest(NoThrottleMixin, TestCase):
+    def test_matches_drf_output(self):
+        data = {
+            'price': Decimal('12.50'),
+            'date': timezone.now().replace(microsecond=123456),
+            'day': timezone.now().date(),
+            'nested': [{'title': 'Caf\u00e9 \u2028 line', 'crew': None, 'ok': True}],
+            3: 'non-string key',
+        }
+        for media_type in (None, 'application/json; indent=4'):
+            self.assertEqual(
+                FastJSONRenderer().render(data, media_type),
+                JSONRenderer().render(data, media_type),
+            )
+
+    def test_lazy_renderer_serves_its_format(self):
+        customer = User.objects.create_user('customer', password='secret')
+        Category.objects.create(slug='mains', title='Mains')
+        client = APIClient()
+        client.force_authenticate(customer)
+        response = client.get('/api/categories?format=csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn(b'Mains', response.content)
+        self.assertIsNotNone(LazyCSVRenderer._renderer_class)
+
+
+class OrderExportTest(NoThrottleMixin, TestCase):
+    def setUp(self):
+        self.manager = User.objects.create_user('manager', password='secret')
+        self.manager.groups.add(Group.objects.create(name='Manager'))
+        self.crew = User.objects.create_user('crew', password='secret')
+        self.customer = User.objects.create_user('customer', password='secret')
+        category = Category.objects.create(slug='mains', title='Mains')
+        soup = MenuItem.objects.create(title='Soup', price=5, featured=False, category=category)
+        salad = MenuItem.objects.create(title='Salad', price='7.25', featured=False, category=category)
+        day = timezone.datetime(2024, 3, 1, 12, tzinfo=timezone.get_current_timezone())
+        self.orders = []
+        for i in range(3):
+            order = Order.objects.create(user=self.customer, delivery_crew=self.crew if i else None, status=i == 2,
+                                         total='12.25', date=day + timezone.timedelta(days=i))
+            for item in (soup, salad)[:i + 1] if i < 2 else ():
+                OrderItem.objects.create(order=order, menuitem=item, quantity=1, unit_price=item.price, price=item.price)
+            self.orders.append(order)
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+
+    def export(self, query=''):
+        response = self.client.get(f'/api/orders/export{query}')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_has_one_line_per_item(self):
+        with override_settings(ORDER_EXPORT_CHUNK_SIZE=1), CaptureQueriesContext(connection) as queries:
+            rows = list(csv.DictReader(io.StringIO(self.export())))
+        # One streamed query however small the chunks.
+        self.assertEqual(len([q for q in queries if 'FROM "LittleLemonAPI_order"' in q['sql']]), 1)
+        self.assertEqual([row['order_id'] for row in rows],
+                         [str(order.pk) for order in self.orders[:1] + self.orders[1:2] * 2 + self.orders[2:]])
+        self.assertEqual(rows[2]['menuitem'], 'Salad')
+        self.assertEqual(rows[2]['unit_price'], '7.25')
+        self.assertEqual(rows[0]['delivery_crew'], '')
+        self.assertEqual(rows[3]['status'], 'Delivered')
+        self.assertEqual(rows[3]['item_id'], '')
+
+    def test_ndjson_groups_items_per_order(self):
+        orders = [json.loads(line) for line in self.export('?output=ndjson').splitlines()]
+        self.assertEqual([len(order['items']) for order in orders], [1, 2, 0])
+        self.assertEqual(orders[1]['delivery_crew'], 'crew')
+        self.assertEqual(orders[1]['total'], '12.25')
+
+    def test_filters(self):
+        def ids(query):
+            return [json.loads(line)['order_id'] for line in self.export(f'?output=ndjson&{query}').splitlines()]
+        pks = [order.pk for order in self.orders]
+        self.assertEqual(ids('from=2024-03-02&to=2024-03-02'), pks[1:2])
+        self.assertEqual(ids('status=pending'), pks[:2])
+        self.assertEqual(ids(f'delivery_crew={self.crew.pk}&status=delivered'), pks[2:])
+        self.assertEqual(ids('delivery_crew=none'), pks[:1])
+        self.assertEqual(self.client.get('/api/orders/export?from=yesterday').status_code, 400)
+        for bad in ('2024-02-30', '2024-03-01T25:00', '9999-12-31'):
+            self.assertEqual(self.client.get(f'/api/orders/export?to={bad}').status_code, 400)
+        self.assertEqual(self.client.get('/api/orders?from=2024-02-30').status_code, 400)
+
+    def test_managers_only(self):
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.get('/api/orders/export').status_code, 403)
+
+
+class RollupTest(NoThrottleMixin, TestCase):
+    def setUp(self):
+        self.manager = User.objects.create_user('manager', password='secret')
+        self.manager.groups.add(Group.objects.create(name='Manager'))
+        self.crew = User.objects.create_user('crew', password='secret')
+        self.crew.groups.add(Group.objects.create(name='Delivery Crew'))
+        self.customer = User.objects.create_user('customer', password='secret')
+        category = Category.objects.create(slug='mains', title='Mains')
+        self.soup = MenuItem.objects.create(title='Soup', price=5, featured=False, category=category)
+        self.salad = MenuItem.objects.create(title='Salad', price=Decimal('7.25'), featured=False, category=category)
+        self.client = APIClient()
+
+    def snapshot(self):
+        return (
+            sorted(DailySales.objects.values_list('day', 'orders', 'delivered', 'revenue')),
+            sorted(DailyItemSales.objects.filter(quantity__gt=0).values_list('day', 'menuitem_id', 'quantity', 'revenue')),
+            sorted(DailyCrewDeliveries.objects.filter(assigned__gt=0).values_list('day', 'delivery_crew_id', 'assigned', 'delivered')),
+        )
+
+    def assert_matches_rebuild(self):
+        incremental = self.snapshot()
+        rollups.rebuild()
+        self.assertEqual(incremental, self.snapshot())
+
+    def checkout(self, *lines):
+        for item, quantity in lines:
+            Cart.objects.create(user=self.customer, menuitem=item, quantity=quantity,
+                                unit_price=item.price, price=item.price * quantity)
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.post('/api/orders').status_code, 201)
+        return Order.objects.latest('id')
+
+    def test_incremental_updates_match_rebuild(self):
+        first = self.checkout((self.soup, 2), (self.salad, 1))
+        second = self.checkout((self.salad, 3))
+        self.assert_matches_rebuild()
+        self.client.force_authenticate(self.manager)
+        self.client.put(f'/api/orders/{first.pk}', {'crew_id': self.crew.pk}, format='json')
+        self.client.force_authenticate(self.crew)
+        self.client.patch(f'/api/orders/{first.pk}', {'status': True}, format='json')
+        self.assert_matches_rebuild()
+        self.client.force_authenticate(self.manager)
+        self.client.put(f'/api/orders/{second.pk}', {'crew_id': self.crew.pk, 'status': True}, format='json')
+        self.client.delete(f'/api/orders/{first.pk}')
+        self.assert_matches_rebuild()
+        self.assertEqual(DailySales.objects.get().orders, 1)
+
+    def test_form_encoded_status_strings(self):
+        order = self.checkout((self.soup, 1))
+        self.client.force_authenticate(self.manager)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/orders/{order.pk}', {'status': '1'})
+            self.client.patch(f'/api/orders/{order.pk}', {'status': '0'})
+        self.assertFalse(Order.objects.get(pk=order.pk).status)
+        self.assertEqual(DailySales.objects.get().delivered, 0)
+        self.assert_matches_rebuild()
+
+    def test_reports(self):
+        self.checkout((self.soup, 2), (self.salad, 1))
+        order = self.checkout((self.salad, 3))
+        order.delivery_crew = self.crew
+        order.status = True
+        order.save()
+        self.client.force_authenticate(self.manager)
+        self.client.get('/api/analytics/revenue')
+        # Roles are memoised on the user by now: the report is one read.
+        with self.assertNumQueries(1):
+            revenue = self.client.get('/api/analytics/revenue').data
+        self.assertEqual((revenue['orders'], revenue['revenue'], revenue['average_order_value']), (2, '39.00', '19.50'))
+        self.assertEqual(revenue['days'][0]['delivered'], 1)
+        top = self.client.get('/api/analytics/top-items?limit=1').data
+        self.assertEqual([(row['title'], row['quantity'], row['revenue']) for row in top], [('Salad', 4, '29.00')])
+        crew = self.client.get('/api/analytics/delivery-crew').data
+        self.assertEqual([(row['username'], row['assigned'], row['delivered']) for row in crew], [('crew', 1, 1)])
+        tomorrow = timezone.localdate() + timezone.timedelta(days=1)
+        self.assertEqual(self.client.get(f'/api/analytics/revenue?from={tomorrow}').data['orders'], 0)
+        self.assertEqual(self.client.get('/api/analytics/revenue?to=soon').status_code, 400)
+        self.assertEqual(self.client.get('/api/analytics/revenue?from=2024-02-30').status_code, 400)
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.get('/api/analytics/revenue').status_code, 403)
+
+
+class MenuImportTest(NoThrottleMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.manager = User.objects.create_user('manager', password='secret')
+        self.manager.groups.add(Group.objects.create(name='Manager'))
+        self.mains = Category.objects.create(slug='mains', title='Mains')
+        self.soup = MenuItem.objects.create(title='Soup', price=5, featured=False, category=self.mains)
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+
+    def rows(self, count, start=0):
+        return [{'title': f'Dish {i}', 'price': '4.50', 'featured': False, 'category_id': self.mains.pk}
+                for i in range(start, start + count)]
+
+    def test_query_count_does_not_grow_with_batch(self):
+        self.client.post('/api/menu-items/bulk', self.rows(1, 1000), format='json')
+        counts = []
+        for start, count in ((0, 5), (5, 200)):
+            rows = self.rows(count, start) + [{'id': self.soup.pk, 'price': f'{5 + count}.00'}]
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.post('/api/menu-items/bulk', {'items': rows}, format='json')
+            self.assertEqual(response.status_code, 200, response.data)
+            self.assertEqual((len(response.data['created']), len(response.data['updated'])), (count, 1))
+            counts.append(len(captured))
+        # Only the INSERT is split, at SQLite's bound-parameter limit.
+        self.assertEqual(counts[1], counts[0] + 1)
+        self.assertEqual(MenuItem.objects.count(), 207)
+        self.soup.refresh_from_db()
+        self.assertEqual(self.soup.price, Decimal('205.00'))
+
+    def test_csv_updates_are_visible_to_cache_and_search(self):
+        self.assertEqual(self.client.get('/api/menu-items').data['count'], 1)
+        old_stamp = self.soup.updated_at
+        body = f'id,title,price,featured,category_id\n{self.soup.pk},Tomato soup,,,\n,Bread,3.00,true,{self.mains.pk}\n'
+        response = self.client.post('/api/menu-items/bulk', body, content_type='text/csv')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.client.get('/api/menu-items').data['count'], 2)
+        titles = [item['title'] for item in self.client.get('/api/menu-items?search=tomato').data['results']]
+        self.assertEqual(titles, ['Tomato soup'])
+        self.soup.refresh_from_db()
+        self.assertGreater(self.soup.updated_at, old_stamp)
+        self.assertTrue(MenuItem.objects.get(title='Bread').featured)
+
+    def test_errors_are_reported_per_row(self):
+        rows = [
+            {'title': 'Soup', 'price': '5', 'featured': False, 'category_id': self.mains.pk},
+            {'title': 'Pie', 'price': '1.00', 'featured': False, 'category_id': self.mains.pk},
+            {'title': 'Tart', 'price': '3', 'featured': False, 'category_id': 999},
+            {'title': 'Cake', 'price': '3', 'featured': False, 'category_id': self.mains.pk},
+            {'title': 'Cake', 'price': '3', 'featured': True, 'category_id': self.mains.pk},
+            {'id': 999, 'title': 'Ghost'},
+            {'title': 'Salad', 'price': '6', 'featured': False, 'category_id': self.mains.pk},
+        ]
+        response = self.client.post('/api/menu-items/bulk', rows, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['row'] for error in response.data['errors']], [1, 2, 3, 4, 5, 6])
+        self.assertIn('price', response.data['errors'][1]['errors'])
+        self.assertIn('category_id', response.data['errors'][2]['errors'])
+        self.assertEqual(MenuItem.objects.count(), 1)
+        response = self.client.post('/api/menu-items/bulk?skip_invalid=true', rows, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['created']), 1)
+        self.assertTrue(MenuItem.objects.filter(title='Salad').exists())
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as handle:
+            handle.write(f'title,price,featured,category_id\nBread,3.00,false,{self.mains.pk}\n')
+        out = io.StringIO()
+        call_command('import_menu', handle.name, stdout=out)
+        self.assertIn('Created 1', out.getvalue())
+        self.assertTrue(MenuItem.objects.filter(title='Bread').exists())
+        with override_settings(MENU_IMPORT_MAX_ROWS=0):
+            with self.assertRaisesMessage(CommandError, 'At most 0 rows per import, got 1'):
+                call_command('import_menu', handle.name, stdout=out)
+
+
+class CartBatchTest(NoThrottleMixin, TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user('customer', password='secret')
+        category = Category.objects.create(slug='mains', title='Mains')
+        self.items = [
+            MenuItem.objects.create(title=f'Dish {i}', price=Decimal('2.50') + i, featured=False, category=category)
+            for i in range(10)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def lines(self):
+        return dict(Cart.objects.filter(user=self.customer).values_list('menuitem_id', 'quantity'))
+
+    def test_batch_in_constant_queries(self):
+        self.client.post('/api/cart/menu-items', {'menuitem_id': self.items[0].pk, 'quantity': 1}, format='json')
+        batch = {
+            'add': [{'menuitem_id': item.pk, 'quantity': 2} for item in self.items[:8]],
+            'set': [{'menuitem_id': self.items[8].pk, 'quantity': 5}],
+            'remove': [self.items[9].pk],
+        }
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.post('/api/cart/menu-items/batch', batch, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertLessEqual(len(captured), 8)
+        self.assertEqual(len(response.data), 9)
+        self.assertEqual(self.lines()[self.items[0].pk], 3)
+        line = Cart.objects.get(user=self.customer, menuitem=self.items[0])
+        self.assertEqual(line.price, Decimal('7.50'))
+
+        response = self.client.post('/api/cart/menu-items/batch', {
+            'set': [{'menuitem_id': self.items[0].pk, 'quantity': 1}], 'remove': [self.items[1].pk],
+        }, format='json')
+        self.assertEqual(self.lines()[self.items[0].pk], 1)
+        self.assertNotIn(self.items[1].pk, self.lines())
+
+    def test_single_add_increments_existing_line(self):
+        codes = []
+        for _ in range(2):
+            response = self.client.post('/api/cart/menu-items', {'menuitem_id': self.items[3].pk, 'quantity': 2}, format='json')
+            codes.append(response.status_code)
+        self.assertEqual(codes, [201, 200])
+        self.assertEqual(response.data['quantity'], 4)
+        self.assertEqual(response.data['price'], '22.00')
+        self.assertEqual(self.client.post('/api/cart/menu-items', {'menuitem_id': 999, 'quantity': 1}, format='json').status_code, 404)
+        self.assertEqual(self.client.post('/api/cart/menu-items', {'menuitem_id': self.items[3].pk, 'quantity': 0}, format='json').status_code, 400)
+
+    def test_invalid_batches_change_nothing(self):
+        item = self.items[0].pk
+        for batch, code in (
+            ({'add': [{'menuitem_id': item, 'quantity': 1}], 'remove': [item]}, 400),
+            ({'add': [{'menuitem_id': item, 'quantity': 1}, {'menuitem_id': 999, 'quantity': 1}]}, 404),
+            ({}, 400),
+        ):
+            self.assertEqual(self.client.post('/api/cart/menu-items/batch', batch, format='json').status_code, code)
+        self.assertEqual(self.lines(), {})
+
+    def test_lines_must_fit_the_cart_columns(self):
+        item = self.items[0]
+        self.client.post('/api/cart/menu-items', {'menuitem_id': item.pk, 'quantity': 3000}, format='json')
+        # 4000 x 2.50 is over the 9999.99 a cart line's price can hold.
+        response = self.client.post('/api/cart/menu-items', {'menuitem_id': item.pk, 'quantity': 1000}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/cart/menu-items/batch', {
+            'add': [{'menuitem_id': self.items[1].pk, 'quantity': 1}],
+            'set': [{'menuitem_id': self.items[2].pk, 'quantity': 32767}],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.lines(), {item.pk: 3000})
+        # A cheap item runs into the SmallIntegerField limit first.
+        cheap = MenuItem.objects.create(title='Mint', price=Decimal('0.25'), featured=False, category=item.category)
+        codes = [
+            self.client.post('/api/cart/menu-items', {'menuitem_id': cheap.pk, 'quantity': quantity}, format='json').status_code
+            for quantity in (30000, 2768)
+        ]
+        self.assertEqual(codes, [201, 400])
+        self.assertEqual(self.lines(), {item.pk: 3000, cheap.pk: 30000})
+
+
+class IdempotencyKeyTest(NoThrottleMixin, TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user('customer', password='secret')
+        category = Category.objects.create(slug='mains', title='Mains')
+        self.item = MenuItem.objects.create(title='Soup', price=5, featured=False, category=category)
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def fill_cart(self):
+        Cart.objects.get_or_create(user=self.customer, menuitem=self.item,
+                                   defaults={'quantity': 1, 'unit_price': 5, 'price': 5})
+
+    def test_retried_checkout_is_replayed(self):
+        self.fill_cart()
+        first = self.client.post('/api/orders', HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.fill_cart()
+        with CaptureQueriesContext(connection) as captured:
+            second = self.client.post('/api/orders', HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual((first.status_code, second.status_code), (201, 201))
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertFalse(any('INSERT INTO "LittleLemonAPI_order"' in query['sql'] for query in captured))
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(self.client.post('/api/orders', HTTP_IDEMPOTENCY_KEY='checkout-2').status_code, 201)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_key_reused_for_another_body(self):
+        url = '/api/cart/menu-items'
+        self.client.post(url, {'menuitem_id': self.item.pk, 'quantity': 1}, format='json', HTTP_IDEMPOTENCY_KEY='k')
+        response = self.client.post(url, {'menuitem_id': self.item.pk, 'quantity': 2}, format='json', HTTP_IDEMPOTENCY_KEY='k')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Cart.objects.get().quantity, 1)
+
+    @override_settings(IDEMPOTENCY_WAIT=0)
+    def test_in_flight_duplicate_and_abandoned_claim(self):
+        self.fill_cart()
+        claim = IdempotencyKey.objects.create(user=self.customer, key='k', fingerprint=fingerprint(APIRequestFactory().post('/api/orders')),
+                                              created_at=timezone.now())
+        self.assertEqual(self.client.post('/api/orders', HTTP_IDEMPOTENCY_KEY='k').status_code, 409)
+        claim.created_at -= timezone.timedelta(minutes=5)
+        claim.save()
+        self.assertEqual(self.client.post('/api/orders', HTTP_IDEMPOTENCY_KEY='k').status_code, 201)
+
+    def test_sweeper_removes_expired_keys(self):
+        old = timezone.now() - timezone.timedelta(days=2)
+        IdempotencyKey.objects.create(user=self.customer, key='old', fingerprint='x', status_code=201, created_at=old)
+        IdempotencyKey.objects.create(user=self.customer, key='new', fingerprint='x', status_code=201,
+                                      created_at=timezone.now())
+        call_command('sweep_idempotency_keys', stdout=io.StringIO())
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['new'])
+
+
+class AsyncViewsTest(NoThrottleMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.manager = User.objects.create_user('manager', password='secret')
+        self.manager.groups.add(Group.objects.create(name='Manager'))
+        self.customer = User.objects.create_user('customer', password='secret')
+        self.other = User.objects.create_user('other', password='secret')
+        category = Category.objects.create(slug='mains', title='Mains')
+        items = [MenuItem.objects.create(title=f'Dish {i}', price=Decimal('2.25') + i, featured=False, category=category)
+                 for i in range(6)]
+        for item in items[:5]:
+            Cart.objects.create(user=self.customer, menuitem=item, quantity=2, unit_price=item.price, price=item.price * 2)
+        for i in range(5):
+            order = Order.objects.create(user=self.customer if i % 2 else self.other, total=10,
+                                         date=timezone.now() - timezone.timedelta(hours=i))
+            OrderItem.objects.create(order=order, menuitem=items[i], quantity=1, unit_price=items[i].price,
+                                     price=items[i].price)
+        self.order = order
+        self.item_id = items[4].pk
+        self.tokens = {user.username: Token.objects.create(user=user).key
+                       for user in (self.manager, self.customer, self.other)}
+
+    def sync_get(self, username, url):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.tokens[username]}')
+        return client.get(url)
+
+    async def async_get(self, username, url):
+        headers = {'Authorization': f'Token {self.tokens[username]}'} if username else {}
+        return await self.async_client.get(url, headers=headers)
+
+    async def test_same_json_as_sync_views(self):
+        cases = [
+            ('customer', '/api/menu-items?ordering=price', '/api/async/menu-items?ordering=price'),
+            ('customer', '/api/menu-items?ordering=-price&page=2', '/api/async/menu-items?ordering=-price&page=2'),
+            ('customer', '/api/menu-items?search=dish&page=2', '/api/async/menu-items?search=dish&page=2'),
+            ('customer', f'/api/menu-items/{self.item_id}', f'/api/async/menu-items/{self.item_id}'),
+            ('customer', '/api/cart/menu-items?pagination=cursor', '/api/async/cart/menu-items'),
+            ('customer', '/api/orders?pagination=cursor', '/api/async/orders'),
+            ('manager', '/api/orders?pagination=cursor', '/api/async/orders'),
+            ('manager', f'/api/orders/{self.order.pk}', f'/api/async/orders/{self.order.pk}'),
+        ]
+        for username, sync_url, async_url in cases:
+            expected = await sync_to_async(self.sync_get)(username, sync_url)
+            response = await self.async_get(username, async_url)
+            self.assertEqual(response.status_code, expected.status_code, async_url)
+            data = response.json()
+            if 'cursor' in sync_url:
+                self.assertEqual(data['results'], expected.json()['results'], async_url)
+            elif 'results' in data:
+                for key in ('count', 'results'):
+                    self.assertEqual(data[key], expected.json()[key], async_url)
+            else:
+                self.assertEqual(data, expected.json(), async_url)
+
+    async def test_archived_orders(self):
+        # One archived with a snapshot, one without.
+        orders = [pk async for pk in Order.objects.order_by('date').values_list('pk', flat=True)[:2]]
+        await Order.objects.filter(pk__in=orders).aupdate(status=True, date=timezone.now() - timezone.timedelta(days=400))
+        await sync_to_async(snapshots.write_snapshots)(orders[:1])
+        await sync_to_async(archive.archive_orders)()
+        self.assertEqual(await ArchivedOrder.objects.filter(pk__in=orders).acount(), 2)
+        for pk in orders:
+            expected = await sync_to_async(self.sync_get)('manager', f'/api/orders/{pk}')
+            response = await self.async_get('manager', f'/api/async/orders/{pk}')
+            self.assertEqual((response.status_code, response.json()), (200, expected.json()))
+
+    async def test_auth_permissions_and_errors(self):
+        self.assertEqual((await self.async_get(None, '/api/async/orders')).status_code, 401)
+        bad = await self.async_client.get('/api/async/orders', headers={'Authorization': 'Token nope'})
+        self.assertEqual((bad.status_code, bad.json()), (401, {'detail': 'Invalid token.'}))
+        self.assertEqual((await self.async_get('customer', f'/api/async/orders/{self.order.pk}')).status_code, 401)
+        self.assertEqual((await self.async_get('customer', '/api/async/orders/999')).status_code, 404)
+        self.assertEqual((await self.async_get('customer', '/api/async/menu-items?page=9')).status_code, 404)
+        self.assertEqual((await self.async_client.post('/api/async/menu-items')).status_code, 405)
+        page = (await self.async_get('customer', '/api/async/orders')).json()
+        self.assertEqual(page['count'], 2)
+
+
+@override_settings(EVENTS_HEARTBEAT=0.05, EVENTS_STREAM_TIMEOUT=1)
+class OrderEventsTest(NoThrottleMixin, TestCase):
+    def setUp(self):
+        self.broker = events.LocalBroker()
+        patcher = mock.patch.object(events, '_broker', self.broker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = User.objects.create_user('manager', password='secret')
+        self.manager.groups.add(Group.objects.create(name='Manager'))
+        crew_group = Group.objects.create(name='Delivery Crew')
+        self.crews = [User.objects.create_user(f'crew{i}', password='secret') for i in range(2)]
+        for crew in self.crews:
+            crew.groups.add(crew_group)
+        self.customer = User.objects.create_user('customer', password='secret')
+        self.token = Token.objects.create(user=self.customer).key
+        category = Category.objects.create(slug='mains', title='Mains')
+        self.item = MenuItem.objects.create(title='Soup', price=5, featured=False, category=category)
+        self.client = APIClient()
+
+    def published(self):
+        return [(event.type, sorted(event.audiences)) for event in self.broker.history]
+
+    def test_order_mutations_publish_after_commit(self):
+        Cart.objects.create(user=self.customer, menuitem=self.item, quantity=1, unit_price=5, price=5)
+        self.client.force_authenticate(self.customer)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/orders')
+        order = Order.objects.get()
+        self.client.force_authenticate(self.manager)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(f'/api/orders/{order.pk}', {'crew_id': self.crews[0].pk}, format='json')
+            self.client.put(f'/api/orders/{order.pk}', {'crew_id': self.crews[0].pk}, format='json')
+            self.client.put(f'/api/orders/{order.pk}', {'crew_id': self.crews[1].pk}, format='json')
+        self.client.force_authenticate(self.crews[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/orders/{order.pk}', {'status': True}, format='json')
+        self.client.force_authenticate(self.manager)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/orders/{order.pk}')
+        user, managers = f'user:{self.customer.pk}', 'managers'
+        crew0, crew1 = (f'crew:{crew.pk}' for crew in self.crews)
+        self.assertEqual(self.published(), [
+            ('order.created', sorted([managers, user])),
+            ('order.updated', sorted([crew0, managers, user])),
+            ('order.updated', sorted([crew0, crew1, managers, user])),
+            ('order.updated', sorted([crew1, managers, user])),
+            ('order.deleted', sorted([crew1, managers, user])),
+        ])
+        self.assertEqual(self.broker.history[-2].data['status'], 'Delivered')
+
+    async def open_stream(self, **headers):
+        response = await self.async_client.get('/api/async/orders/events', headers={
+            'Authorization': f'Token {self.token}', **headers,
+        })
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertTrue((await anext(stream)).startswith(b'retry:'))
+        return stream
+
+    async def next_event(self, stream):
+        while True:
+            chunk = await asyncio.wait_for(anext(stream), 2)
+            if not chunk.startswith(b':'):
+                return chunk.decode()
+
+    async def test_stream_delivers_only_the_users_orders(self):
+        stream = await self.open_stream()
+        self.assertEqual(await asyncio.wait_for(anext(stream), 2), b': keep-alive\n\n')
+        self.broker.publish('order.updated', {'id': 1}, {'user:999'})
+        await sync_to_async(self.broker.publish)('order.updated', {'id': 2}, {f'user:{self.customer.pk}'})
+        self.assertEqual(await self.next_event(stream), 'id: 2\nevent: order.updated\ndata: {"id":2}\n\n')
+        # The stream ends at EVENTS_STREAM_TIMEOUT and unsubscribes.
+        async for chunk in stream:
+            self.assertEqual(chunk, b': keep-alive\n\n')
+        self.assertEqual(dict(self.broker.subscribers), {})
+
+        replayed = await self.open_stream(**{'Last-Event-ID': '0'})
+        self.assertIn('id: 2\n', await self.next_event(replayed))
+        await replayed.aclose()
+
+    def test_wsgi_stream_is_not_buffered(self):
+        self.broker.publish('order.updated', {'id': 1}, {f'user:{self.customer.pk}'})
+        response = self.client.get('/api/async/orders/events', headers={
+            'Authorization': f'Token {self.token}', 'Last-Event-ID': '0',
+        })
+        stream = iter(response.streaming_content)
+        self.assertTrue(next(stream).startswith(b'retry:'))
+        self.assertEqual(next(stream), b'id: 1\nevent: order.updated\ndata: {"id":1}\n\n')
+        self.broker.publish('order.updated', {'id': 2}, {f'user:{self.customer.pk}'})
+        self.assertIn(b'id: 2\n', next(stream))
+        response.close()
+        self.assertEqual(dict(self.broker.subscribers), {})
+
+
+@override_settings(READ_REPLICAS=['replica'], REPLICA_STICKY_SECONDS=5)
+class ReplicaRoutingTest(NoThrottleMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = User.objects.create_user('customer', password='secret')
+        category = Category.objects.create(slug='mains', title='Mains')
+        self.item = MenuItem.objects.create(title='Soup', price=5, featured=False, category=category)
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+        # The test database has no replica alias: record where the router
+        # sends each read, then run it on the primary anyway.
+        self.routed = []
+        db_for_read = routers.ReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            self.routed.append(db_for_read(router, model, **hints))
+
+        patcher = mock.patch.object(routers.ReplicaRouter, 'db_for_read', record)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def reads(self, method, path, data=None):
+        self.routed.clear()
+        response = getattr(self.client, method)(path, data, format='json')
+        self.assertLess(response.status_code, 400)
+        return set(self.routed)
+
+    def test_list_reads_use_the_replica_until_the_user_writes(self):
+        self.assertEqual(self.reads('get', '/api/menu-items'), {'replica'})
+        self.assertEqual(self.reads('get', '/api/orders'), {'replica'})
+        self.assertEqual(self.reads('get', '/api/cart/menu-items'), {None})
+        self.assertEqual(self.reads('post', '/api/cart/menu-items', {'menuitem_id': self.item.pk, 'quantity': 1}), {None})
+        self.assertIn(routers.STICKY_COOKIE, self.client.cookies)
+        self.assertEqual(self.reads('get', '/api/orders'), {None})
+        self.assertEqual(self.reads('post', '/api/orders'), {None})
+        self.assertEqual(self.reads('get', '/api/orders'), {None})
+        # Another user can't reuse the cookie.
+        other = User.objects.create_user('other', password='secret')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.reads('get', '/api/orders'), {'replica'})
+        self.client.force_authenticate(self.customer)
+        with mock.patch('django.core.signing.time.time', return_value=time.time() + 6):
+            self.assertEqual(self.reads('get', '/api/orders'), {'replica'})
+
+    def test_failed_writes_are_not_sticky(self):
+        self.client.post('/api/orders')
+        self.assertNotIn(routers.STICKY_COOKIE, self.client.cookies)
+        self.assertEqual(routers.ReplicaRouter().db_for_write(Order), 'default')
+
+    def test_token_clients_without_cookies(self):
+        # Without a shared cache only the cookie pins reads.
+        self.reads('post', '/api/cart/menu-items', {'menuitem_id': self.item.pk, 'quantity': 1})
+        self.client.cookies.clear()
+        self.assertEqual(self.reads('get', '/api/orders'), {'replica'})
+        with tempfile.TemporaryDirectory() as location:
+            with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location,
+            }}):
+                self.reads('post', '/api/cart/menu-items', {'menuitem_id': self.item.pk, 'quantity': 1})
+                self.client.cookies.clear()
+                self.assertEqual(self.reads('get', '/api/orders'), {None})
+                other = User.objects.create_user('other', password='secret')
+                self.client.force_authenticate(other)
+                self.assertEqual(self.reads('get', '/api/orders'), {'replica'})
+                self.client.force_authenticate(self.customer)
+                cache.delete(routers._sticky_key(self.customer.pk))
+                self.assertEqual(self.reads('get', '/api/orders'), {'replica'})
+
+    @override_settings(READ_REPLICAS=[])
+    def test_without_replicas_everything_reads_the_primary(self):
+        self.assertEqual(self.reads('get', '/api/menu-items'), {None})
+        self.client.post('/api/cart/menu-items', {'menuitem_id': self.item.pk, 'quantity': 1}, format='json')
+        self.assertNotIn(routers.STICKY_COOKIE, self.client.cookies)
+
+
+class OrderSnapshotTest(NoThrottleMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.manager = User.objects.create_user('manager', password='secret')
+        self.manager.groups.add(Group.objects.create(name=MANAGER))
+        self.crew = User.objects.create_user('crew', password='secret')
+        self.crew.groups.add(Group.objects.create(name=DELIVERY_CREW))
+        self.customer = User.objects.create_user('customer', password='secret')
+        category = Category.objects.create(slug='mains', title='Mains')
+        for i in range(2):
+            item = MenuItem.objects.create(title=f'Dish {i}', price=Decimal('4.50') + i, featured=False, category=category)
+            Cart.objects.create(user=self.customer, menuitem=item, quantity=2, unit_price=item.price, price=item.price * 2)
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+        self.client.post('/api/orders')
+        self.order = Order.objects.get()
+
+    def expected(self):
+        return JSONRenderer().render(OrderSerializer(Order.objects.with_details().get()).data)
+
+    def stored(self):
+        order = Order.objects.get()
+        return order.snapshot_version == Order.SNAPSHOT_VERSION and JSONRenderer().render(order.snapshot)
+
+    def test_checkout_writes_and_updates_refresh_the_snapshot(self):
+        self.assertEqual(self.stored(), self.expected())
+        self.client.force_authenticate(self.manager)
+        self.client.put(f'/api/orders/{self.order.pk}', {'crew_id': self.crew.pk}, format='json')
+        self.assertEqual(self.stored(), self.expected())
+        self.client.force_authenticate(self.crew)
+        self.client.patch(f'/api/orders/{self.order.pk}', {'status': True}, format='json')
+        self.assertEqual(self.stored(), self.expected())
+        self.assertIn(b'"Delivered"', self.stored())
+
+    def test_reads_skip_the_joins(self):
+        for url in (f'/api/orders/{self.order.pk}', '/api/orders?pagination=cursor'):
+            self.client.get(url)
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get(url)
+            tables = [query['sql'] for query in captured if 'LittleLemonAPI_order' in query['sql']]
+            self.assertEqual(len(tables), 1, tables)
+            self.assertFalse([sql for sql in tables if 'orderitem' in sql or 'JOIN' in sql])
+            result = response.json()
+            self.assertEqual(json.dumps(result.get('results', [result])[0]), json.dumps(json.loads(self.expected())))
+
+    def test_stale_snapshots_fall_back_and_backfill(self):
+        self.customer.username = 'renamed'
+        self.customer.save()
+        self.assertEqual(Order.objects.get().snapshot_version, 0)
+        self.assertEqual(self.client.get(f'/api/orders/{self.order.pk}').json()['user']['username'], 'renamed')
+        out = io.StringIO()
+        call_command('backfill_order_snapshots', stdout=out)
+        self.assertIn('Wrote 1 order snapshots', out.getvalue())
+        self.assertEqual(self.stored(), self.expected())
+        self.client.force_authenticate(self.manager)
+        self.client.get('/api/orders')
+        self.assertEqual(self.stored(), self.expected())
+        OrderItem.objects.filter(order=self.order).first().delete()
+        self.assertEqual(Order.objects.get().snapshot_version, 0)
+        self.assertEqual(len(self.client.get(f'/api/orders/{self.order.pk}').json()['order_items']), 1)
+
+    def test_menu_item_changes_reach_every_order(self):
+        # A second order with the same items; editing one order's item must
+        # not leave the two showing different titles.
+        for item in MenuItem.objects.all():
+            Cart.objects.create(user=self.customer, menuitem=item, quantity=1, unit_price=item.price, price=item.price)
+        self.client.post('/api/orders')
+        item = MenuItem.objects.get(title='Dish 0')
+        item.title = 'Stew'
+        item.save()
+        featured = MenuItem.objects.get(title='Dish 1')
+        featured.featured = True
+        featured.save()
+        self.assertEqual(sorted(Order.objects.values_list('snapshot_version', flat=True)), [0, 0])
+        OrderItem.objects.filter(order=self.order).update(quantity=3)
+        OrderItem.objects.filter(order=self.order).first().save()
+        snapshots.backfill()
+        for order in self.client.get('/api/orders').json()['results']:
+            self.assertEqual([row['menuitem']['title'] for row in order['order_items']], ['Stew', 'Dish 1'])
+        expected = JSONRenderer().render(OrderSerializer(Order.objects.with_details().order_by('-date', '-id'), many=True).data)
+        rows = order_snapshot_rows.serialize(order_snapshot_rows.values(Order.objects.order_by('-date', '-id')))
+        self.assertEqual(JSONRenderer().render(rows), expected)
+        snapshots.mark_stale(Order.objects.all())
+        snapshots.backfill()
+        featured.featured = False
+        featured.save()
+        self.assertEqual(sorted(Order.objects.values_list('snapshot_version', flat=True)), [1, 1])
+
+
+class OrderArchiveTest(NoThrottleMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.manager = User.objects.create_user('manager', password='secret')
+        self.manager.groups.add(Group.objects.create(name=MANAGER))
+        self.customer = User.objects.create_user('customer', password='secret')
+        category = Category.objects.create(slug='mains', title='Mains')
+        item = MenuItem.objects.create(title='Soup', price=Decimal('5.00'), featured=False, category=category)
+        now = timezone.now()
+        # Old delivered orders are archived; old pending and recent ones stay.
+        for days, delivered in ((200, True), (150, True), (120, False), (100, True), (10, True), (1, False)):
+            order = Order.objects.create(user=self.customer, status=delivered, total=Decimal('10.00'),
+                                         date=now - timezone.timedelta(days=days))
+            OrderItem.objects.create(order=order, menuitem=item, quantity=2, unit_price=item.price, price=Decimal('10.00'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+
+    def all_orders(self, query):
+        response = self.client.get(f'/api/orders?{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_archiving_moves_old_delivered_orders(self):
+        before = self.all_orders('from=2000-01-01&page=1')
+        rollup = list(DailySales.objects.order_by('day').values_list('day', 'orders', 'delivered', 'revenue'))
+        out = io.StringIO()
+        call_command('archive_orders', '--batch-size', '2', stdout=out)
+        self.assertIn('Archived 3 orders', out.getvalue())
+        self.assertEqual(Order.objects.count(), 3)
+        self.assertEqual(ArchivedOrder.objects.count(), 3)
+        self.assertEqual(ArchivedOrderItem.objects.count(), 3)
+        self.assertEqual(OrderItem.objects.count(), 3)
+        self.assertFalse(Order.objects.filter(status=True, date__lt=timezone.now() - timezone.timedelta(days=90)).exists())
+        # Archiving is not a sale being undone, and a rebuild counts the archive.
+        self.assertEqual(list(DailySales.objects.order_by('day').values_list('day', 'orders', 'delivered', 'revenue')), rollup)
+        rollups.rebuild()
+        self.assertEqual(list(DailySales.objects.order_by('day').values_list('day', 'orders', 'delivered', 'revenue')), rollup)
+
+        self.assertEqual(self.all_orders('page=1')['count'], 3)
+        after = self.all_orders('from=2000-01-01&page=1')
+        self.assertEqual(after, before)
+        archived = ArchivedOrder.objects.order_by('date').first()
+        detail = self.client.get(f'/api/orders/{archived.pk}').json()
+        self.assertEqual(detail['order_items'][0]['quantity'], 2)
+        self.assertEqual(archive.archive_orders(), 0)
+
+    def test_ranges_page_across_hot_and_archived_orders(self):
+        newest_first = list(Order.objects.order_by('-date', '-id').values_list('id', flat=True))
+        archive.archive_orders(older_than_days=30)
+        ids = []
+        url = '/api/orders?from=2000-01-01&pagination=cursor'
+        while url:
+            page = self.client.get(url).json()
+            ids += [order['id'] for order in page['results']]
+            url = page['next']
+        self.assertEqual(ids, newest_first)
+        numbered = []
+        for page in (1, 2):
+            numbered += [order['id'] for order in self.all_orders(f'from=2000-01-01&page={page}&ordering=date')['results']]
+        self.assertEqual(numbered, newest_first[::-1])
+        self.assertEqual(self.all_orders('to=2100-01-01&status=pending&page=1')['count'], 2)
+        self.assertEqual(self.all_orders('to=2100-01-01&status=delivered&page=1')['count'], 4)
+
+    def test_export_covers_archived_orders_in_a_range(self):
+        oldest_first = list(Order.objects.order_by('date', 'id').values_list('id', flat=True))
+        archive.archive_orders()
+        response = self.client.get('/api/orders/export?output=ndjson&from=2000-01-01')
+        exported = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([order['order_id'] for order in exported], oldest_first)
+        self.assertEqual([len(order['items']) for order in exported], [1] * 6)
+
+    async def test_async_list_covers_archived_orders_in_a_range(self):
+        newest_first = [pk async for pk in Order.objects.order_by('-date', '-id').values_list('id', flat=True)]
+        await sync_to_async(archive.archive_orders)()
+        token = await Token.objects.acreate(user=self.manager)
+        headers = {'Authorization': f'Token {token.key}'}
+        ids = []
+        for page in (1, 2):
+            body = (await self.async_client.get(f'/api/async/orders?from=2000-01-01&page={page}', headers=headers)).json()
+            ids += [order['id'] for order in body['results']]
+        self.assertEqual(ids, newest_first)
+        self.assertEqual(body['count'], 6)
+        body = (await self.async_client.get('/api/async/orders?status=delivered', headers=headers)).json()
+        self.assertEqual(body['count'], 1)
+        response = await self.async_client.get('/api/async/orders?from=yesterday', headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+
+class OrderDispatchTest(NoThrottleMixin, TestCase):
+    def setUp(self):
+        self.broker = events.LocalBroker()
+        patcher = mock.patch.object(events, '_broker', self.broker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = User.objects.create_user('manager', password='secret')
+        self.manager.groups.add(Group.objects.create(name=MANAGER))
+        crew_group = Group.objects.create(name=DELIVERY_CREW)
+        self.crews = [User.objects.create_user(f'crew{i}', password='secret') for i in range(3)]
+        retired = User.objects.create_user('retired', password='secret', is_active=False)
+        for crew in [*self.crews, retired]:
+            crew.groups.add(crew_group)
+        self.customer = User.objects.create_user('customer', password='secret')
+        now = timezone.now()
+        # Open orders: crew0 has two, crew1 none, crew2 one.
+        for crew in (self.crews[0], self.crews[0], self.crews[2]):
+            Order.objects.create(user=self.customer, delivery_crew=crew, status=False, total=10, date=now)
+        Order.objects.create(user=self.customer, status=True, total=10, date=now)
+        self.pending = [
+            Order.objects.create(user=self.customer, status=False, total=10, date=now - timezone.timedelta(minutes=i))
+            for i in range(4, 0, -1)
+        ]
+        snapshots.backfill()
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+
+    def test_preview_and_run(self):
+        expected = [
+            {'order': self.pending[0].pk, 'delivery_crew': self.crews[1].pk},
+            {'order': self.pending[1].pk, 'delivery_crew': self.crews[1].pk},
+            {'order': self.pending[2].pk, 'delivery_crew': self.crews[2].pk},
+            {'order': self.pending[3].pk, 'delivery_crew': self.crews[0].pk},
+        ]
+        preview = self.client.get('/api/orders/dispatch').json()
+        self.assertEqual(preview['assignments'], expected)
+        self.assertEqual(Order.objects.filter(delivery_crew__isnull=True, status=False).count(), 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/orders/dispatch')
+        self.assertEqual(response.json(), preview)
+        self.assertEqual([row['open'] for row in preview['open_orders']], [3, 2, 2])
+        self.assertFalse(Order.objects.filter(delivery_crew__isnull=True, status=False).exists())
+        order = Order.objects.get(pk=self.pending[0].pk)
+        self.assertEqual(order.snapshot, OrderSerializer(order).data)
+        self.assertEqual(
+            dict(DailyCrewDeliveries.objects.values_list('delivery_crew_id', 'assigned')),
+            {self.crews[0].pk: 3, self.crews[1].pk: 2, self.crews[2].pk: 2},
+        )
+        self.assertEqual([event.type for event in self.broker.history], ['order.updated'] * 4)
+        self.assertEqual(self.client.post('/api/orders/dispatch').json()['assigned'], 0)
+
+    @override_settings(DISPATCH_MAX_OPEN_ORDERS=2)
+    def test_capacity_and_permissions(self):
+        out = io.StringIO()
+        call_command('dispatch_orders', stdout=out)
+        self.assertIn('Assigned 3 orders, 1 left unassigned', out.getvalue())
+        self.assertEqual(dispatch.crew_loads(), {crew.pk: 2 for crew in self.crews})
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.post('/api/orders/dispatch').status_code, 403)
+
+    def test_runs_take_the_lock_row_first(self):
+        # select_for_update() is a no-op on SQLite; the lock row write is not.
+        with CaptureQueriesContext(connection) as captured:
+            dispatch.run()
+        writes = [query['sql'] for query in captured if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        self.assertTrue(writes[0].startswith('UPDATE "LittleLemonAPI_dispatchlock"'), writes[0])
+        self.assertIsNotNone(DispatchLock.objects.get().last_run_at)
+        DispatchLock.objects.all().delete()
+        dispatch.run()
+        self.assertEqual(DispatchLock.objects.get().pk, 1)
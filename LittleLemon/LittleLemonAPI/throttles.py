@@ -1,10 +1,141 @@
-from rest_framework.throttling import UserRateThrottle
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import F
+from django.utils.module_loading import import_string
+from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
+from .models import ThrottleWindow
+from .sweeping import delete_in_batches
 
-class ManagerRateThrottle(UserRateThrottle):
+#region Stores
+
+# A store keeps one counter per (key, fixed window) and must increment it
+# atomically across every worker process. hit() returns the counts for the
+# current and previous window after the increment; undo() takes a rejected
+# request back out.
+#
+# The database store writes a row per key and window. Keys that come back
+# drop their own old windows; the rest (one-off anonymous IPs, revoked
+# tokens) are removed by `manage.py sweep_throttle_windows`.
+
+class DatabaseThrottleStore:
+    def hit(self, key, window, duration):
+        table = ThrottleWindow._meta.db_table
+        with connection.cursor() as cursor:
+            # Single-statement atomic increment (SQLite >= 3.24, PostgreSQL).
+            cursor.execute(
+                f'INSERT INTO "{table}" ("key", "window", "hits", "expires_at") VALUES (%s, %s, 1, %s) '
+                'ON CONFLICT ("key", "window") DO UPDATE SET "hits" = "hits" + 1',
+                [key, window, int((window + 2) * duration)],
+            )
+        counts = dict(
+            ThrottleWindow.objects.filter(key=key, window__in=[window - 1, window]).values_list('window', 'hits')
+        )
+        current = counts.get(window, 0)
+        if current == 1:
+            # First hit of a new window: windows before the previous one are
+            # never read again.
+            ThrottleWindow.objects.filter(key=key, window__lt=window - 1).delete()
+        return current, counts.get(window - 1, 0)
+
+    def undo(self, key, window):
+        ThrottleWindow.objects.filter(key=key, window=window).update(hits=F('hits') - 1)
+
+
+def sweep(batch_size=1000, now=None):
+    # Deletes expired windows; returns how many went.
+    expired = ThrottleWindow.objects.filter(expires_at__lt=time.time() if now is None else now)
+    return delete_in_batches(expired, batch_size)
+
+
+class CacheThrottleStore:
+    # Only shared and atomic with a cache whose incr() is atomic across
+    # processes, such as memcached or redis.
+    def __init__(self):
+        self.cache = caches[getattr(settings, 'THROTTLE_CACHE_ALIAS', 'default')]
+
+    def hit(self, key, window, duration):
+        current_key, previous_key = f'{key}:{window}', f'{key}:{window - 1}'
+        # Keys expire on their own once they can no longer be the previous window.
+        if not self.cache.add(current_key, 1, duration * 2):
+            try:
+                self.cache.incr(current_key)
+            except ValueError:
+                self.cache.add(current_key, 1, duration * 2)
+        counts = self.cache.get_many([current_key, previous_key])
+        return counts.get(current_key, 1), counts.get(previous_key, 0)
+
+    def undo(self, key, window):
+        try:
+            self.cache.decr(f'{key}:{window}')
+        except ValueError:
+            pass
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        path = getattr(settings, 'THROTTLE_STORE', 'LittleLemonAPI.throttles.DatabaseThrottleStore')
+        _store = import_string(path)()
+    return _store
+
+#endregion
+
+#region Throttles
+
+class SlidingWindowThrottleMixin:
+    # Replaces SimpleRateThrottle's per-key timestamp list with a sliding
+    # window counter: the previous window's count weighted by how much of it
+    # still overlaps the sliding window, plus the current window's count.
+    # Fixed memory and O(1) per check.
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = self.timer()
+        window, offset = divmod(self.now, self.duration)
+        self.window = int(window)
+        self.elapsed = offset / self.duration
+        self.current, self.previous = get_store().hit(self.key, self.window, self.duration)
+        if self.previous * (1 - self.elapsed) + self.current > self.num_requests:
+            get_store().undo(self.key, self.window)
+            self.current -= 1
+            return self.throttle_failure()
+        return True
+
+    def wait(self):
+        if self.current >= self.num_requests:
+            # Wait for the next window, then for enough of it to pass.
+            remaining = (1 - self.elapsed) * self.duration
+            return remaining + self.duration * (1 - (self.num_requests - 1) / max(self.current, 1))
+        if not self.previous:
+            return None
+        # Elapsed fraction at which the weighted previous count leaves room.
+        needed = 1 - (self.num_requests - 1 - self.current) / self.previous
+        return max(needed - self.elapsed, 0) * self.duration
+
+
+class SharedUserRateThrottle(SlidingWindowThrottleMixin, UserRateThrottle):
+    pass
+
+class SharedAnonRateThrottle(SlidingWindowThrottleMixin, AnonRateThrottle):
+    pass
+
+class ManagerRateThrottle(SharedUserRateThrottle):
     scope = 'manager'
 
-class DeliveryRateThrottle(UserRateThrottle):
+class DeliveryRateThrottle(SharedUserRateThrottle):
     scope = 'delivery'
 
-class CustomerRateThrottle(UserRateThrottle):
-    scope = 'customer'
\ No newline at end of file
+class CustomerRateThrottle(SharedUserRateThrottle):
+    scope = 'customer'
+
+#endregion
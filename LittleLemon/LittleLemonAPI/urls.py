@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     #region function-based views urls
@@ -17,13 +17,30 @@ urlpatterns = [
     #region class-based views urls
     path('categories', views.CategoryView.as_view()),
     path('menu-items', views.MenuItemsView.as_view()),
+    path('menu-items/bulk', views.MenuItemImportView.as_view()),
     path('menu-items/<int:pk>', views.SingleMenuItemView.as_view()),
     path('groups/manager/users',views.ManagersView.as_view()),
     path('groups/manager/users/<int:pk>',views.RemoveManagerView.as_view()),
     path('groups/delivery-crew/users',views.DeliveryCrewView.as_view()),
     path('groups/delivery-crew/users/<int:pk>',views.RemoveDeliveryCrewView.as_view()),
     path('cart/menu-items',views.CartView.as_view()),
+    path('cart/menu-items/batch',views.CartBatchView.as_view()),
     path('orders',views.OrdersView.as_view()),
     path('orders/<int:pk>',views.SingleOrderView.as_view()),
+    path('orders/export',views.OrderExportView.as_view()),
+    path('orders/dispatch',views.OrderDispatchView.as_view()),
+    path('analytics/revenue',views.RevenueAnalyticsView.as_view()),
+    path('analytics/top-items',views.TopItemsAnalyticsView.as_view()),
+    path('analytics/delivery-crew',views.CrewAnalyticsView.as_view()),
+    path('stats/requests',views.RequestStatsView.as_view()),
+    #endregion
+
+    #region async views urls
+    path('async/menu-items', async_views.menu_items),
+    path('async/menu-items/<int:pk>', async_views.single_item),
+    path('async/cart/menu-items', async_views.cart),
+    path('async/orders', async_views.orders),
+    path('async/orders/<int:pk>', async_views.single_order),
+    path('async/orders/events', async_views.order_events),
     #endregion
 ]
\ No newline at end of file
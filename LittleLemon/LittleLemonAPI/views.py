@@ -5,17 +5,34 @@ from rest_framework.decorators import api_view, permission_classes,throttle_clas
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated,IsAdminUser
 from .permissions import *
-from rest_framework.throttling import UserRateThrottle, AnonRateThrottle
+from .roles import is_manager, is_delivery_crew
 from .throttles import *
 from django.core.paginator import Paginator, EmptyPage
 from .models import *
 from .serializers import *
-from datetime import date
+from .checkout import place_order
+from .menu_cache import CachedMenuListMixin
+from .pagination import KeysetPagination
+from .fast_serializers import FastListMixin, menu_item_rows, cart_rows, order_snapshot_rows, archived_order_rows
+from .archive import OrderHistory, serialize_history, wants_archive
+from .search import MenuSearchFilter, search_menu_items
+from rest_framework.filters import OrderingFilter
+from rest_framework.views import APIView
+from . import middleware
+from .export import WRITERS, export_filters, export_rows
+from django.http import Http404, StreamingHttpResponse
+from .carts import update_cart
+from .idempotency import idempotent
+from django.utils.dateparse import parse_date
+from . import dispatch, rollups
+from .menu_import import import_menu_items, max_rows, parse_csv
+from .routers import ReplicaRoutingMixin
+from .conditional import ConditionalListMixin, ConditionalDetailMixin, make_etag, latest_timestamp, not_modified, add_validators
 
 #region Function-based views
 
 @api_view(['GET','POST'])
-@throttle_classes([UserRateThrottle])
+@throttle_classes([SharedUserRateThrottle])
 @permission_classes([IsAuthenticated])
 def menu_items(request):
     if request.method == 'GET':
@@ -31,7 +48,7 @@ def menu_items(request):
             if to_price:
                 items = items.filter(price__lte=to_price)
             if search:
-                items = items.filter(title__icontains=search)
+                items = search_menu_items(items, search)
             if ordering:
                 ordering = ordering.split(',')
                 try:
@@ -46,7 +63,7 @@ def menu_items(request):
             serialized_item = MenuItemSerializer(items, many=True, context={'request': request})
             return Response(serialized_item.data, status.HTTP_200_OK)
     else:
-        if request.user.groups.filter(name='Manager').exists(): 
+        if is_manager(request.user): 
             serialized_item = MenuItemSerializer(data=request.data, context={'request': request})
             serialized_item.is_valid(raise_exception=True)
             serialized_item.save()
@@ -57,14 +74,14 @@ def menu_items(request):
 
 @api_view(['GET','PUT','DELETE','PATCH'])
 @permission_classes([IsAuthenticated])
-@throttle_classes([UserRateThrottle])
+@throttle_classes([SharedUserRateThrottle])
 def single_item(request,id):
     if request.method == 'GET':
         item = get_object_or_404(MenuItem,pk=id)
         serialized_item = MenuItemSerializer(item)
         return Response(serialized_item.data, status.HTTP_200_OK)
     else:
-        if request.user.groups.filter(name='Manager').exists(): 
+        if is_manager(request.user): 
             item = get_object_or_404(MenuItem,pk=id)
             if request.method == 'PUT':
                 serialized_item = MenuItemSerializer(item, data=request.data, context={'request': request})
@@ -136,7 +153,7 @@ def remove_delivery_crew(request, id):
 
 @api_view(['GET','POST','DELETE'])
 @permission_classes([IsAuthenticated])
-@throttle_classes([UserRateThrottle])
+@throttle_classes([SharedUserRateThrottle])
 def cart(request):    
     if request.method == 'GET':
         carts = Cart.objects.filter(user=request.user)
@@ -165,15 +182,15 @@ def cart(request):
 
 @api_view(['GET','POST'])
 @permission_classes([IsAuthenticated])
-@throttle_classes([UserRateThrottle])
+@throttle_classes([SharedUserRateThrottle])
 def orders(request):
     if request.method == 'GET':
-        if request.user.groups.filter(name='Manager'):
-            orders = Order.objects.prefetch_related('order_items').all()
-        elif request.user.groups.filter(name='Delivery Crew'):
-            orders = Order.objects.prefetch_related('order_items').filter(delivery_crew=request.user)
+        if is_manager(request.user):
+            orders = Order.objects.with_details()
+        elif is_delivery_crew(request.user):
+            orders = Order.objects.with_details().filter(delivery_crew=request.user)
         else:
-            orders = Order.objects.prefetch_related('order_items').filter(user=request.user)
+            orders = Order.objects.with_details().filter(user=request.user)
         per_page = request.query_params.get('perpage',default=4)
         page = request.query_params.get('page',default=1)
         ordering = request.query_params.get('ordering')
@@ -197,33 +214,26 @@ def orders(request):
         serialized_orders = OrderSerializer(orders, many=True)
         return Response(serialized_orders.data, status.HTTP_200_OK)
     else:
-        carts = Cart.objects.filter(user=request.user)
-        if not carts.exists():
+        if place_order(request.user) is None:
             return Response({'error': 'Cart is empty'}, status.HTTP_400_BAD_REQUEST)
-        total = sum([cart_item.price for cart_item in carts])
-        order = Order.objects.create(user=request.user, status=False, total = total, date = date.today())
-        order.save()
-        for cart_item in carts:
-            order_item = OrderItem.objects.create(order=order, menuitem=cart_item.menuitem, quantity=cart_item.quantity, unit_price=cart_item.unit_price, price=cart_item.price)
-            order_item.save()
-            cart_item.delete()
         return Response({'message': 'Order placed successfully'}, status.HTTP_201_CREATED)
     
 @api_view(['GET','PUT','DELETE','PATCH'])
 @permission_classes([IsAuthenticated])
-@throttle_classes([UserRateThrottle])
+@throttle_classes([SharedUserRateThrottle])
 def single_order(request,id):
-    order = get_object_or_404(Order,pk=id)
+    # Only a GET renders the items, user and crew.
+    order = get_object_or_404(Order.objects.with_details() if request.method == 'GET' else Order,pk=id)
     if request.method == 'GET':
-        if request.user != order.user and not request.user.groups.filter(name='Manager').exists():
+        if request.user.id != order.user_id and not is_manager(request.user):
             return Response({'error': 'You are not allowed to perform this action'}, status.HTTP_401_UNAUTHORIZED)
         serialized_order = OrderSerializer(order)
         return Response(serialized_order.data, status.HTTP_200_OK)
     elif request.method == 'PUT':
-        if request.user.groups.filter(name='Manager').exists():
+        if is_manager(request.user):
             if 'crew_id' in request.data:
                 delivery_crew = get_object_or_404(User,pk=request.data['crew_id'])
-                if not delivery_crew.groups.filter(name='Delivery Crew').exists():
+                if not is_delivery_crew(delivery_crew):
                     return Response({'error': 'User is not in Delivery Crew group'}, status.HTTP_400_BAD_REQUEST)
                 order.delivery_crew = delivery_crew
             if 'status' in request.data:
@@ -232,12 +242,12 @@ def single_order(request,id):
             return Response({'message': 'Order status updated successfully'}, status.HTTP_200_OK)
         return Response({'error': 'You are not allowed to perform this action'}, status.HTTP_401_UNAUTHORIZED)
     elif request.method == 'DELETE':
-        if request.user.groups.filter(name='Manager').exists():
+        if is_manager(request.user):
             order.delete()
             return Response({'message': 'Order deleted successfully'}, status.HTTP_200_OK)
         return Response({'error': 'You are not allowed to perform this action'}, status.HTTP_401_UNAUTHORIZED)
     elif request.method == 'PATCH':
-        if request.user.groups.filter(name='Delivery Crew').exists() or request.user.groups.filter(name='Manager').exists():
+        if is_delivery_crew(request.user) or is_manager(request.user):
             order.status = request.data['status']
             order.save()
             return Response({'message': 'Status changed successfully successfully'}, status.HTTP_200_OK)
@@ -248,17 +258,27 @@ def single_order(request,id):
         
 #region Class-based views
         
-class CategoryView(generics.ListCreateAPIView):
+class CategoryView(ReplicaRoutingMixin, CachedMenuListMixin, ConditionalListMixin, generics.ListCreateAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticated]
+    menu_cache_prefix = 'categories'
 
-class MenuItemsView(generics.ListCreateAPIView):
-    queryset = MenuItem.objects.all()
+class MenuItemsView(ReplicaRoutingMixin, CachedMenuListMixin, ConditionalListMixin, FastListMixin, generics.ListCreateAPIView):
+    queryset = MenuItem.objects.select_related('category')
     serializer_class = MenuItemSerializer
+    fast_rows = menu_item_rows
+    menu_cache_prefix = 'menu-items'
+    pagination_class = KeysetPagination
+    keyset_ordering = ('price','id')
     ordering_fields = ['price','inventory']
     filterset_fields = ['price','inventory']
     search_fields = ['category__title','title']
+    filter_backends = [MenuSearchFilter, OrderingFilter]
+
+    @idempotent
+    def post(self, request, *args, **kwargs):
+        return super().post(request, *args, **kwargs)
 
     def get_permissions(self):
         permission_classes = [IsAuthenticated]
@@ -266,9 +286,10 @@ class MenuItemsView(generics.ListCreateAPIView):
             permission_classes = [IsManager | IsAdminUser]
         return [permission() for permission in permission_classes]
     
-class SingleMenuItemView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = MenuItem.objects.all()
+class SingleMenuItemView(ConditionalDetailMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = MenuItem.objects.select_related('category')
     serializer_class = MenuItemSerializer
+    conditional_fields = ('updated_at','category__updated_at')
     
     def get_permissions(self):
         permission_classes = [IsAuthenticated]
@@ -276,6 +297,24 @@ class SingleMenuItemView(generics.RetrieveUpdateDestroyAPIView):
             permission_classes = [IsManager | IsAdminUser]
         return [permission() for permission in permission_classes]
     
+class MenuItemImportView(APIView):
+    permission_classes = [IsManager | IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        if request.content_type.startswith('text/csv'):
+            rows = parse_csv(request.body.decode('utf-8-sig'))
+        else:
+            rows = request.data.get('items') if isinstance(request.data, dict) else request.data
+        if not isinstance(rows, list) or not rows:
+            return Response({'error': 'Send a non-empty list of menu items as JSON or CSV'}, status.HTTP_400_BAD_REQUEST)
+        if len(rows) > max_rows():
+            return Response({'error': f'At most {max_rows()} rows per import'}, status.HTTP_400_BAD_REQUEST)
+        skip_invalid = request.query_params.get('skip_invalid') in ('1', 'true')
+        report = import_menu_items(rows, skip_invalid)
+        if report['errors'] and not skip_invalid:
+            return Response(report, status.HTTP_400_BAD_REQUEST)
+        return Response(report, status.HTTP_200_OK)
+    
 class ManagersView(generics.ListCreateAPIView):
     queryset = User.objects.filter(groups__name='Manager')
     serializer_class = UserSerializer
@@ -324,74 +363,118 @@ class RemoveDeliveryCrewView(generics.DestroyAPIView):
         delivery_crew.user_set.remove(user)
         return Response({'message': 'User removed from Delivery Crew group'}, status.HTTP_200_OK)
     
-class CartView(generics.ListCreateAPIView,generics.DestroyAPIView):
+class CartView(ReplicaRoutingMixin, FastListMixin, generics.ListCreateAPIView,generics.DestroyAPIView):
+    replica_reads = False
     queryset = Cart.objects.all()
     serializer_class = CartSerializer
+    fast_rows = cart_rows
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('id',)
 
     def get_queryset(self):
         return Cart.objects.filter(user=self.request.user)
     
+    @idempotent
     def post(self, request, *args, **kwargs):
-        menu_item = get_object_or_404(MenuItem,pk=request.data['menuitem_id'])
-        data = {
-            'user_id': request.user.id,
-            'menuitem_id': request.data['menuitem_id'],
-            'quantity': request.data['quantity'],
-            'unit_price': menu_item.price,
-            'price': round(menu_item.price * int(request.data['quantity']),2)
-        }
-        serialized_carts = CartSerializer(data=data)
-        serialized_carts.is_valid(raise_exception=True)
-        serialized_carts.save()
-        return Response(serialized_carts.data, status.HTTP_201_CREATED)
+        # Adding an item that is already in the cart increments its quantity.
+        serialized_line = CartLineSerializer(data=request.data)
+        serialized_line.is_valid(raise_exception=True)
+        if update_cart(request.user, add=[serialized_line.validated_data]):
+            raise Http404('No MenuItem matches the given query.')
+        line = Cart.objects.filter(user=request.user, menuitem_id=serialized_line.validated_data['menuitem_id'])
+        data = cart_rows.serialize(cart_rows.values(line))[0]
+        # Only a new line holds exactly the posted quantity; 200 for an increment.
+        created = data['quantity'] == serialized_line.validated_data['quantity']
+        return Response(data, status.HTTP_201_CREATED if created else status.HTTP_200_OK)
     
     def delete(self, request, *args, **kwargs):
         Cart.objects.filter(user=self.request.user).delete()
         return Response({'message': 'All items removed from cart'}, status.HTTP_200_OK)
     
-class OrdersView(generics.ListCreateAPIView):
+class CartBatchView(ReplicaRoutingMixin, APIView):
+    replica_reads = False
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serialized_batch = CartBatchSerializer(data=request.data)
+        serialized_batch.is_valid(raise_exception=True)
+        batch = serialized_batch.validated_data
+        missing = update_cart(request.user, batch.get('add', []), batch.get('set', []), batch.get('remove', []))
+        if missing:
+            return Response({'error': 'Menu items not found', 'menuitem_ids': missing}, status.HTTP_404_NOT_FOUND)
+        carts = Cart.objects.filter(user=request.user).order_by('id')
+        return Response(cart_rows.serialize(cart_rows.values(carts)), status.HTTP_200_OK)
+    
+class OrdersView(ReplicaRoutingMixin, ConditionalListMixin, FastListMixin, generics.ListCreateAPIView):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    fast_rows = order_snapshot_rows
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-date','-id')
 
     def get_queryset(self):
-        if self.request.user.groups.filter(name='Manager').exists():
-            return Order.objects.all()
-        elif self.request.user.groups.filter(name='Delivery Crew').exists():
-            return Order.objects.filter(delivery_crew=self.request.user)
-        return Order.objects.filter(user=self.request.user)
+        return self.visible(Order.objects.with_details())
+
+    def visible(self, orders):
+        # The orders this user may list, narrowed by from/to/status/delivery_crew.
+        orders = orders.filter(export_filters(self.request.query_params))
+        if is_manager(self.request.user):
+            return orders
+        elif is_delivery_crew(self.request.user):
+            return orders.filter(delivery_crew=self.request.user)
+        return orders.filter(user=self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        # A date range also covers delivered orders moved to the archive.
+        if not wants_archive(request.query_params):
+            return super().list(request, *args, **kwargs)
+        orders = self.filter_queryset(self.get_queryset())
+        ordering = OrderingFilter().get_ordering(request, orders, self) or self.keyset_ordering
+        history = OrderHistory.of(orders, self.filter_queryset(self.visible(ArchivedOrder.objects.all())), ordering)
+        return self.get_paginated_response(serialize_history(self.paginate_queryset(history)))
     
+    @idempotent
     def post(self, request, *args, **kwargs):
-        carts = Cart.objects.filter(user=request.user)
-        if not carts.exists():
+        if place_order(request.user) is None:
             return Response({'error': 'Cart is empty'}, status.HTTP_400_BAD_REQUEST)
-        total = sum([cart_item.price for cart_item in carts])
-        order = Order.objects.create(user=request.user, status=False, total = total, date = date.today())
-        order.save()
-        for cart_item in carts:
-            order_item = OrderItem.objects.create(order=order, menuitem=cart_item.menuitem, quantity=cart_item.quantity, unit_price=cart_item.unit_price, price=cart_item.price)
-            order_item.save()
-            cart_item.delete()
         return Response({'message': 'Order placed successfully'}, status.HTTP_201_CREATED)
     
-class SingleOrderView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Order.objects.all()
+class SingleOrderView(ReplicaRoutingMixin, generics.RetrieveUpdateDestroyAPIView):
+    replica_reads = False
+    queryset = Order.objects.with_details()
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
-        order = get_object_or_404(Order,pk=kwargs['pk'])
-        if self.request.user!=order.user and not self.request.user.groups.filter(name='Manager'):
+        # Archived orders are read-only and always served from the archive.
+        fields = ('id','user_id','updated_at','snapshot','snapshot_version')
+        row = Order.objects.values(*fields).filter(pk=kwargs['pk']).first()
+        archived = row is None
+        if archived:
+            row = get_object_or_404(ArchivedOrder.objects.values(*fields),pk=kwargs['pk'])
+        if self.request.user.id!=row['user_id'] and not is_manager(self.request.user):
             return Response({'error': 'You are not allowed to perform this action'}, status.HTTP_401_UNAUTHORIZED)
-        return super().get(request, *args, **kwargs)
+        etag = make_etag(request, kwargs['pk'], row['updated_at'].isoformat())
+        last_modified = latest_timestamp(row['updated_at'])
+        response = not_modified(request, etag, last_modified)
+        if response is None:
+            if archived:
+                data = archived_order_rows.serialize([row])[0]
+            elif order_snapshot_rows.fresh(row):
+                data = row['snapshot']
+            else:
+                data = self.get_serializer(self.get_object()).data
+            response = Response(data)
+        return add_validators(response, etag, last_modified)
     
     def put(self, request, *args, **kwargs):
         order = get_object_or_404(Order,pk=kwargs['pk'])
-        if request.user.groups.filter(name='Manager').exists():
+        if is_manager(request.user):
             if 'crew_id' in request.data:
                 delivery_crew = get_object_or_404(User,pk=request.data['crew_id'])
-                if not delivery_crew.groups.filter(name='Delivery Crew').exists():
+                if not is_delivery_crew(delivery_crew):
                     return Response({'error': 'User is not in Delivery Crew group'}, status.HTTP_400_BAD_REQUEST)
                 order.delivery_crew = delivery_crew
             if 'status' in request.data:
@@ -402,9 +485,77 @@ class SingleOrderView(generics.RetrieveUpdateDestroyAPIView):
     
     def patch(self, request, *args, **kwargs):
         order = get_object_or_404(Order,pk=kwargs['pk'])
-        if request.user.groups.filter(name='Delivery Crew').exists() or request.user.groups.filter(name='Manager').exists():
+        if is_delivery_crew(request.user) or is_manager(request.user):
             order.status = request.data['status']
             order.save()
             return Response({'message': 'Status changed successfully successfully'}, status.HTTP_200_OK)
         return Response({'error': 'You are not allowed to perform this action'}, status.HTTP_401_UNAUTHORIZED)
+
+class OrderDispatchView(APIView):
+    # GET previews an automatic crew assignment run, POST runs it.
+    permission_classes = [IsManager | IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(dispatch.preview())
+
+    def post(self, request, *args, **kwargs):
+        return Response(dispatch.run())
+
+class OrderExportView(APIView):
+    permission_classes = [IsManager | IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        output = request.query_params.get('output', 'csv')
+        if output not in WRITERS:
+            return Response({'error': 'output must be csv or ndjson'}, status.HTTP_400_BAD_REQUEST)
+        write, content_type = WRITERS[output]
+        rows = export_rows(export_filters(request.query_params), wants_archive(request.query_params))
+        response = StreamingHttpResponse(write(rows), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="orders.{output}"'
+        return response
+
+class AnalyticsView(APIView):
+    # Reads the daily rollup tables; `from` and `to` are inclusive ISO dates.
+    permission_classes = [IsManager | IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        bounds = []
+        for name in ('from', 'to'):
+            value = request.query_params.get(name)
+            try:
+                day = parse_date(value) if value else None
+            except ValueError:
+                # Well-formed but impossible, e.g. 2024-02-30.
+                day = None
+            if value and day is None:
+                return Response({'error': f'{name} must be a date (YYYY-MM-DD)'}, status.HTTP_400_BAD_REQUEST)
+            bounds.append(day)
+        return Response(self.report(request, *bounds))
+
+class RevenueAnalyticsView(AnalyticsView):
+    def report(self, request, start, end):
+        return rollups.revenue_report(start, end)
+
+class TopItemsAnalyticsView(AnalyticsView):
+    def report(self, request, start, end):
+        limit = request.query_params.get('limit', '10')
+        limit = min(int(limit), 100) if limit.isdigit() else 10
+        return rollups.top_items_report(start, end, limit)
+
+class CrewAnalyticsView(AnalyticsView):
+    def report(self, request, start, end):
+        return rollups.crew_report(start, end)
+
+class RequestStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response({
+            'enabled': middleware.metrics_config()['ENABLED'],
+            'endpoints': middleware.stats.report(),
+        })
+
+    def delete(self, request, *args, **kwargs):
+        middleware.stats.reset()
+        return Response({'message': 'Request statistics cleared'}, status.HTTP_200_OK)
 #endregion